@@ -0,0 +1,5 @@
+"""
+HolySheet shared backend
+Building blocks used by the FastAPI server (main.py) and the Streamlit apps
+in scripts/.
+"""
@@ -0,0 +1,412 @@
+"""
+Deterministic checks and aggregates over the whole loaded sheet.
+
+The quick actions used to ask the model to find duplicates, gaps and trends
+in a row sample, which misses everything past the sample. analyze_frame runs
+the deterministic parts vectorized over every row instead:
+
+- missing values per column
+- format issues: text cells that don't match the rest of their column (a
+  stray "n/a" among amounts, " Food" next to "Food", "food" next to "Food")
+- groups of exactly duplicated rows, and near-duplicate transactions (see
+  holysheet.duplicates)
+- numeric outliers by robust z-score (distance from the median in MADs)
+- totals per month (or year for long spans) with period-over-period growth
+
+The model then only receives SheetAnalysis.to_text(), a compact summary that
+cites sheet rows and column letters, and is asked to explain it.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from holysheet.column_types import (
+    DATE_FORMATS,
+    date_column,
+    format_value,
+    parse_numeric,
+)
+from holysheet.duplicates import (
+    DuplicateCluster,
+    describe_clusters,
+    find_near_duplicates,
+)
+from holysheet.sheet_loader import column_letter
+
+SECTIONS = ("missing", "format", "duplicates", "near_duplicates", "outliers", "trends")
+
+# Which findings each quick action gets (prompts.QUICK_ACTIONS keys)
+ACTION_SECTIONS: Dict[str, Sequence[str]] = {
+    "analyze": ("missing", "duplicates", "near_duplicates", "outliers", "trends"),
+    "clean": ("missing", "format", "duplicates", "near_duplicates", "outliers"),
+    "trends": ("trends", "outliers"),
+}
+
+_DATE_LIKE = r"\d{1,4}[-/ ,]"
+
+# 0.6745 is the 75th percentile of the standard normal: MAD / 0.6745 ~ sigma
+_MAD_SCALE = 0.6745
+
+
+def _numeric_columns(frame: pd.DataFrame) -> List[int]:
+    return [
+        i
+        for i in range(frame.shape[1])
+        if pd.api.types.is_numeric_dtype(frame.iloc[:, i])
+        and not pd.api.types.is_bool_dtype(frame.iloc[:, i])
+    ]
+
+
+def _text_columns(frame: pd.DataFrame) -> List[int]:
+    return [
+        i
+        for i in range(frame.shape[1])
+        if frame.iloc[:, i].dtype == object
+        or isinstance(frame.iloc[:, i].dtype, pd.CategoricalDtype)
+        or pd.api.types.is_string_dtype(frame.iloc[:, i].dtype)
+    ]
+
+
+def _rows(mask: np.ndarray, first_row: int, limit: int) -> List[int]:
+    return [int(p) + first_row for p in np.flatnonzero(mask)[:limit]]
+
+
+def missing_values(
+    frame: pd.DataFrame, first_row: int = 2, max_rows: int = 10, first_column: int = 1
+) -> List[Dict[str, Any]]:
+    """Columns with empty cells: count, share and the first sheet rows"""
+    if frame.empty:
+        return []
+    nulls = frame.isna().to_numpy()
+    counts = nulls.sum(axis=0)
+    out = []
+    for i in np.flatnonzero(counts):
+        out.append(
+            {
+                "column": str(frame.columns[i]),
+                "letter": column_letter(first_column + i),
+                "missing": int(counts[i]),
+                "ratio": float(counts[i]) / len(frame),
+                "rows": _rows(nulls[:, i], first_row, max_rows),
+            }
+        )
+    return out
+
+
+def _parsed_kind(
+    text: pd.Series, weights: np.ndarray, min_ratio: float
+) -> Tuple[Optional[np.ndarray], str]:
+    """Parsed-value mask if enough (weighted) values are numbers or dates"""
+    present = text.notna().to_numpy()
+    needed = min_ratio * weights[present].sum()
+    numbers = parse_numeric(text).notna().to_numpy()
+    if weights[numbers].sum() >= needed:
+        return numbers, "number"
+    looks_like_date = text.str.contains(_DATE_LIKE, regex=True).fillna(False)
+    if weights[looks_like_date.to_numpy()].sum() < needed:
+        return None, ""
+    for fmt in DATE_FORMATS:
+        dates = pd.to_datetime(text, format=fmt, errors="coerce").notna().to_numpy()
+        if weights[dates].sum() >= needed:
+            return dates, "date"
+    return None, ""
+
+
+def format_issues(
+    frame: pd.DataFrame,
+    first_row: int = 2,
+    max_rows: int = 10,
+    min_ratio: float = 0.5,
+    first_column: int = 1,
+) -> List[Dict[str, Any]]:
+    """Text cells that break their column's format
+
+    A text column whose values are mostly numbers (or dates) reports the
+    cells that aren't; any text column reports padded values and values
+    spelled differently from the most common spelling of the same word.
+    Each distinct value is checked once and the result mapped back to rows.
+    """
+    out = []
+    for i in _text_columns(frame):
+        codes, uniques = pd.factorize(frame.iloc[:, i])
+        if not len(uniques):
+            continue
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        raw = pd.Series(np.asarray(uniques, dtype=object)).astype("string")
+        text = raw.str.strip()
+        text = text.mask(text == "")
+        present = text.notna().to_numpy()
+        base = {
+            "column": str(frame.columns[i]),
+            "letter": column_letter(first_column + i),
+        }
+
+        def report(issue: str, flagged: np.ndarray, values: List[str]) -> None:
+            rows = np.zeros(len(codes), dtype=bool)
+            valid = codes >= 0
+            rows[valid] = flagged[codes[valid]]
+            if rows.any():
+                out.append(
+                    {
+                        **base,
+                        "issue": issue,
+                        "count": int(rows.sum()),
+                        "rows": _rows(rows, first_row, max_rows),
+                        "values": values,
+                    }
+                )
+
+        parsed, kind = _parsed_kind(text, counts, min_ratio)
+        if parsed is not None:
+            bad = present & ~parsed
+            top = np.argsort(-counts * bad, kind="stable")[: min(5, int(bad.sum()))]
+            report(f"not a {kind}", bad, [str(text[j]) for j in top])
+
+        padded = present & (raw != raw.str.strip()).fillna(False).to_numpy()
+        report("leading or trailing spaces", padded, [])
+
+        # Spellings that fold to the same key; the most common one is "right"
+        folded = text.str.casefold().str.replace(r"\s+", " ", regex=True)
+        spellings = pd.DataFrame({"key": folded, "text": text, "count": counts}).loc[
+            present
+        ]
+        spellings = spellings.drop_duplicates(["key", "text"])
+        variants = spellings[spellings["key"].duplicated(keep=False)]
+        if not variants.empty:
+            ranked = variants.sort_values("count", ascending=False, kind="stable")
+            usual = ranked.drop_duplicates("key").set_index("key")["text"]
+            minor = ranked[ranked["text"].to_numpy() != usual[ranked["key"]].to_numpy()]
+            flagged = text.isin(minor["text"]).fillna(False).to_numpy()
+            examples = [
+                f"{t} -> {usual[k]}" for k, t in zip(minor["key"], minor["text"])
+            ]
+            report("spelled differently from the usual value", flagged, examples[:5])
+    return out
+
+
+def duplicate_groups(frame: pd.DataFrame, first_row: int = 2) -> List[List[int]]:
+    """Sheet rows of every group of identical rows, in sheet order"""
+    if frame.empty:
+        return []
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    dup = pd.Series(hashes).duplicated(keep=False).to_numpy()
+    if not dup.any():
+        return []
+    positions = np.flatnonzero(dup)
+    # Rows with equal 64-bit hashes of every cell; collisions are negligible
+    groups = pd.Series(positions + first_row).groupby(hashes[positions]).agg(list)
+    return sorted([int(r) for r in group] for group in groups)
+
+
+def robust_z_scores(values: pd.Series) -> Optional[pd.Series]:
+    """(x - median) / (MAD / 0.6745); None when the MAD is zero"""
+    present = values.dropna()
+    if present.empty:
+        return None
+    median = present.median()
+    mad = (present - median).abs().median()
+    if not mad:
+        return None
+    return _MAD_SCALE * (values - median) / mad
+
+
+def outliers(
+    frame: pd.DataFrame,
+    threshold: float = 3.5,
+    first_row: int = 2,
+    max_rows: int = 10,
+    first_column: int = 1,
+) -> List[Dict[str, Any]]:
+    """Numeric cells more than threshold robust z-scores from the median"""
+    out = []
+    for i in _numeric_columns(frame):
+        column = frame.iloc[:, i].astype("float64")
+        z = robust_z_scores(column)
+        if z is None:
+            continue
+        flagged = (z.abs() > threshold).to_numpy()
+        if not flagged.any():
+            continue
+        positions = np.flatnonzero(flagged)
+        strongest = positions[np.argsort(-z.abs().to_numpy()[positions])][:max_rows]
+        out.append(
+            {
+                "column": str(frame.columns[i]),
+                "letter": column_letter(first_column + i),
+                "count": int(flagged.sum()),
+                "median": float(column.median()),
+                "cells": [
+                    (int(p) + first_row, float(column.iat[p]), float(z.iat[p]))
+                    for p in strongest
+                ],
+            }
+        )
+    return out
+
+
+def period_growth(frame: pd.DataFrame, max_columns: int = 3) -> Optional[pd.DataFrame]:
+    """Rows and totals per month (year past two years) with growth in percent"""
+    date_col = date_column(frame)
+    numeric = [frame.columns[i] for i in _numeric_columns(frame)][:max_columns]
+    if date_col is None or not numeric or frame[date_col].notna().sum() == 0:
+        return None
+    dates = frame[date_col]
+    span_days = (dates.max() - dates.min()).days
+    periods = dates.dt.to_period("M" if span_days <= 730 else "Y")
+    grouped = frame[numeric].groupby(periods)
+    table = grouped.sum(min_count=1)
+    # Include empty periods so growth compares consecutive periods
+    full = pd.period_range(table.index.min(), table.index.max())
+    table = table.reindex(full)
+    table.index.name = date_col
+    table.insert(0, "rows", grouped.size().reindex(full, fill_value=0))
+    for name in numeric:
+        table[f"{name} growth %"] = table[name].pct_change(fill_method=None) * 100
+    return table
+
+
+@dataclass
+class SheetAnalysis:
+    """Findings over every row of a frame"""
+
+    rows: int
+    missing: List[Dict[str, Any]] = field(default_factory=list)
+    format_issues: List[Dict[str, Any]] = field(default_factory=list)
+    duplicates: List[List[int]] = field(default_factory=list)
+    near_duplicates: List[DuplicateCluster] = field(default_factory=list)
+    near_duplicates_text: str = "Near-duplicate transactions: none"
+    outliers: List[Dict[str, Any]] = field(default_factory=list)
+    trends: Optional[pd.DataFrame] = None
+    outlier_threshold: float = 3.5
+
+    @property
+    def duplicate_rows(self) -> int:
+        """Rows that repeat an earlier row (what removing duplicates would drop)"""
+        return sum(len(g) - 1 for g in self.duplicates)
+
+    def _missing_text(self) -> str:
+        if not self.missing:
+            return "Missing values: none"
+        lines = ["Missing values:"]
+        for m in self.missing:
+            lines.append(
+                f"- {m['column']} [{m['letter']}]: {m['missing']:,} empty "
+                f"({m['ratio']:.0%}), rows {_row_list(m['rows'], m['missing'])}"
+            )
+        return "\n".join(lines)
+
+    def _format_text(self) -> str:
+        if not self.format_issues:
+            return "Format issues: none"
+        lines = ["Format issues:"]
+        for f in self.format_issues:
+            line = f"- {f['column']} [{f['letter']}]: {f['count']:,} {f['issue']}"
+            if f["values"]:
+                line += " (" + ", ".join(f'"{v}"' for v in f["values"]) + ")"
+            lines.append(line + f", rows {_row_list(f['rows'], f['count'])}")
+        return "\n".join(lines)
+
+    def _duplicates_text(self, max_groups: int = 10) -> str:
+        if not self.duplicates:
+            return "Exact duplicate rows: none"
+        lines = [
+            f"Exact duplicate rows: {len(self.duplicates):,} groups, "
+            f"{self.duplicate_rows:,} extra copies"
+        ]
+        for group in self.duplicates[:max_groups]:
+            lines.append("- rows " + ", ".join(str(r) for r in group))
+        if len(self.duplicates) > max_groups:
+            lines.append(f"- ... {len(self.duplicates) - max_groups:,} more groups")
+        return "\n".join(lines)
+
+    def _outliers_text(self) -> str:
+        title = f"Outliers (robust z > {self.outlier_threshold:g})"
+        if not self.outliers:
+            return f"{title}: none"
+        lines = [f"{title}:"]
+        for o in self.outliers:
+            cells = ", ".join(
+                f"row {row}: {format_value(value)} (z {z:+.1f})"
+                for row, value, z in o["cells"]
+            )
+            more = o["count"] - len(o["cells"])
+            lines.append(
+                f"- {o['column']} [{o['letter']}]: {o['count']:,} "
+                f"(median {format_value(o['median'])}); {cells}"
+                + (f"; {more:,} more" if more > 0 else "")
+            )
+        return "\n".join(lines)
+
+    def _trends_text(self) -> str:
+        if self.trends is None:
+            return "Trends: no date column with numeric values"
+        table = self.trends
+        lines = [f"Totals by period ({table.index.name}): " + " | ".join(table.columns)]
+        for period, row in table.iterrows():
+            cells = [
+                (
+                    "-"
+                    if pd.isna(v)
+                    else f"{v:+.1f}%" if "growth" in name else format_value(v)
+                )
+                for name, v in row.items()
+            ]
+            lines.append(f"{period}: " + " | ".join(cells))
+        return "\n".join(lines)
+
+    def to_text(self, sections: Sequence[str] = SECTIONS) -> str:
+        """Compact summary of the chosen sections for a prompt"""
+        render = {
+            "missing": self._missing_text,
+            "format": self._format_text,
+            "duplicates": self._duplicates_text,
+            "near_duplicates": lambda: self.near_duplicates_text,
+            "outliers": self._outliers_text,
+            "trends": self._trends_text,
+        }
+        parts = [f"Computed over all {self.rows:,} rows (row numbers are sheet rows)"]
+        parts.extend(render[name]() for name in sections)
+        return "\n\n".join(parts)
+
+
+def _row_list(rows: List[int], total: int) -> str:
+    text = ", ".join(str(r) for r in rows)
+    return text + (", ..." if total > len(rows) else "")
+
+
+def analyze_frame(
+    frame: pd.DataFrame,
+    first_row: int = 2,
+    outlier_threshold: float = 3.5,
+    first_column: int = 1,
+) -> SheetAnalysis:
+    """Run every check once; render parts of it with to_text
+
+    first_row and first_column locate the frame's first data cell in the
+    sheet (see context.build_sheet_context).
+    """
+    near = find_near_duplicates(frame, first_row=first_row)
+    return SheetAnalysis(
+        rows=len(frame),
+        missing=missing_values(frame, first_row, first_column=first_column),
+        format_issues=format_issues(frame, first_row, first_column=first_column),
+        duplicates=duplicate_groups(frame, first_row),
+        near_duplicates=near,
+        near_duplicates_text=describe_clusters(frame, near, first_row=first_row),
+        outliers=outliers(
+            frame, outlier_threshold, first_row, first_column=first_column
+        ),
+        trends=period_growth(frame),
+        outlier_threshold=outlier_threshold,
+    )
+
+
+def action_findings(analysis: SheetAnalysis, action: Optional[str]) -> Optional[str]:
+    """Findings text for a quick action, None for actions that need none"""
+    sections = ACTION_SECTIONS.get(action or "")
+    if not sections:
+        return None
+    return analysis.to_text(sections)
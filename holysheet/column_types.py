@@ -0,0 +1,248 @@
+"""
+Column type inference for sheet data.
+
+The Sheets API hands back every cell as a string, so a freshly loaded frame
+is all object columns. infer_column_types converts each column, using only
+vectorized string and parse operations, to the most compact dtype that fits:
+currency and accounting amounts ("$1,234.56", "(45.00)") and percentages
+become floats or small ints, dates become datetime64, and low-cardinality
+text becomes categorical. Columns that do not parse cleanly stay as text.
+
+convert_like and append_rows extend an already typed frame with new raw
+rows (an append-only refresh) using the dtypes it already has. The date
+format picked for each date column is kept in the frame's attrs, so new
+rows are parsed the same way: a few rows that all fit mm/dd as well as
+dd/mm must not swap day and month.
+
+date_column and format_value are shared by everything that describes typed
+frames in prompts (context, analytics, duplicates, query tools).
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Tried in order; the first format that parses enough of the column wins
+DATE_FORMATS: Sequence[str] = (
+    "%Y-%m-%d",
+    "%m/%d/%Y",
+    "%m/%d/%y",
+    "%d/%m/%Y",
+    "%Y/%m/%d",
+    "%b %d, %Y",
+    "%B %d, %Y",
+    "%d-%b-%Y",
+    "%Y-%m-%d %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+)
+
+# frame.attrs key: {column: date format chosen by infer_column_types}
+DATE_FORMATS_ATTR = "date_formats"
+
+_CURRENCY_CHARS = r"[$€£¥,\s]"
+_LEADING_ZERO = r"^-?0\d"
+
+
+def _is_text(column: pd.Series) -> bool:
+    return column.dtype == object or pd.api.types.is_string_dtype(column.dtype)
+
+
+def _normalize(column: pd.Series) -> pd.Series:
+    """Stripped strings with blanks turned into NA"""
+    text = column.astype("string").str.strip()
+    return text.mask(text == "")
+
+
+def parse_numeric(text: pd.Series) -> pd.Series:
+    """Parse amounts, accounting negatives and percentages (NaN where not numeric)"""
+    percent = text.str.endswith("%").fillna(False)
+    cleaned = text.str.replace(_CURRENCY_CHARS, "", regex=True)
+    cleaned = cleaned.str.rstrip("%")
+    # Accounting style negatives: (45.00) -> -45.00
+    cleaned = cleaned.str.replace(r"^\((.*)\)$", r"-\1", regex=True)
+    numbers = pd.to_numeric(cleaned, errors="coerce").astype("float64")
+    if percent.any():
+        numbers = numbers.where(~percent, numbers / 100.0)
+    return numbers
+
+
+def parse_dates(
+    text: pd.Series, min_ratio: float, formats: Sequence[str] = DATE_FORMATS
+) -> Optional[pd.Series]:
+    """Parse with the first format that fits min_ratio of the values
+
+    The format used is left in the result's attrs["date_format"].
+    """
+    present = int(text.notna().sum())
+    if present == 0:
+        return None
+    # Cheap screen before trying formats: dates contain digits and separators
+    looks_like_date = text.str.contains(r"\d{1,4}[-/ ,]", regex=True).fillna(False)
+    if looks_like_date.sum() < min_ratio * present:
+        return None
+    for fmt in formats:
+        parsed = pd.to_datetime(text, format=fmt, errors="coerce")
+        if parsed.notna().sum() >= min_ratio * present:
+            parsed.attrs["date_format"] = fmt
+            return parsed
+    return None
+
+
+def _compact_numeric(numbers: pd.Series) -> pd.Series:
+    """Downcast whole-number columns without NAs to the smallest int type"""
+    if numbers.isna().any():
+        return numbers
+    whole = (numbers % 1 == 0).all()
+    if whole:
+        return pd.to_numeric(numbers.astype("int64"), downcast="integer")
+    return numbers
+
+
+def infer_column(
+    column: pd.Series,
+    min_ratio: float = 0.9,
+    categorical_ratio: float = 0.5,
+    max_categories: int = 1000,
+) -> pd.Series:
+    """Best compact dtype for one text column"""
+    if not _is_text(column):
+        return column
+    text = _normalize(column)
+    present = int(text.notna().sum())
+    if present == 0:
+        return column
+
+    numbers = parse_numeric(text)
+    has_leading_zero = text.str.contains(_LEADING_ZERO, regex=True).fillna(False).any()
+    if not has_leading_zero and numbers.notna().sum() >= min_ratio * present:
+        return _compact_numeric(numbers).rename(column.name)
+
+    dates = parse_dates(text, min_ratio)
+    if dates is not None:
+        return dates.rename(column.name)
+
+    unique = text.nunique(dropna=True)
+    if unique <= max_categories and unique <= categorical_ratio * present:
+        return text.astype("category").rename(column.name)
+    return column
+
+
+def infer_column_types(
+    frame: pd.DataFrame,
+    min_ratio: float = 0.9,
+    categorical_ratio: float = 0.5,
+    max_categories: int = 1000,
+) -> pd.DataFrame:
+    """Return a copy of frame with each text column converted to a typed column"""
+    columns = {
+        name: infer_column(
+            frame.iloc[:, i],
+            min_ratio=min_ratio,
+            categorical_ratio=categorical_ratio,
+            max_categories=max_categories,
+        )
+        for i, name in enumerate(frame.columns)
+    }
+    typed = pd.DataFrame(columns, index=frame.index)
+    typed.attrs[DATE_FORMATS_ATTR] = {
+        name: column.attrs["date_format"]
+        for name, column in columns.items()
+        if "date_format" in column.attrs
+    }
+    return typed
+
+
+def convert_like(
+    frame: pd.DataFrame, typed: pd.DataFrame, min_ratio: float = 0.9
+) -> Optional[pd.DataFrame]:
+    """Convert raw string rows to the dtypes already inferred for typed
+
+    Used to append rows to a typed frame without inferring again. Returns
+    None when a non-blank cell does not parse as its column's type, since
+    the column might then be inferred differently from scratch, and when a
+    date column's format was not recorded by infer_column_types.
+    """
+    date_formats = typed.attrs.get(DATE_FORMATS_ATTR, {})
+    columns = {}
+    for name in typed.columns:
+        target = typed[name].dtype
+        raw = frame[name]
+        text = _normalize(raw)
+        if isinstance(target, pd.CategoricalDtype):
+            columns[name] = text.astype("category")
+        elif pd.api.types.is_numeric_dtype(target):
+            numbers = parse_numeric(text)
+            if numbers.isna().sum() != text.isna().sum():
+                return None
+            if pd.api.types.is_integer_dtype(target):
+                if numbers.isna().any() or not (numbers % 1 == 0).all():
+                    columns[name] = numbers
+                    continue
+                numbers = numbers.astype("int64")
+                limits = np.iinfo(target)
+                if numbers.empty or (
+                    numbers.min() >= limits.min and numbers.max() <= limits.max
+                ):
+                    numbers = numbers.astype(target)
+            columns[name] = numbers
+        elif pd.api.types.is_datetime64_any_dtype(target):
+            if name not in date_formats:
+                return None
+            # The format of the whole column, not one guessed from new rows
+            dates = parse_dates(text, min_ratio=1.0, formats=(date_formats[name],))
+            if dates is None:
+                if text.notna().any():
+                    return None
+                dates = pd.Series(pd.NaT, index=text.index)
+            columns[name] = dates.astype(target)
+        else:
+            columns[name] = raw.astype(target)
+    converted = pd.DataFrame(columns, index=frame.index)
+    converted.attrs = dict(typed.attrs)
+    return converted
+
+
+def append_rows(typed: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """typed with rows (already converted by convert_like) added at the end"""
+    columns = {}
+    for name in typed.columns:
+        old, new = typed[name], rows[name]
+        if isinstance(old.dtype, pd.CategoricalDtype):
+            # Plain concat of categoricals with different categories gives object
+            merged = union_categoricals(
+                [old, new.astype("category")], ignore_order=True
+            )
+            columns[name] = pd.Series(merged, name=name)
+        else:
+            columns[name] = pd.concat([old, new], ignore_index=True)
+    appended = pd.DataFrame(columns)
+    appended.attrs = dict(typed.attrs)
+    return appended
+
+
+def date_column(frame: pd.DataFrame) -> Optional[str]:
+    """Name of the first datetime column, or None"""
+    for name in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[name]):
+            return name
+    return None
+
+
+def format_value(value) -> str:
+    """A cell value as short prompt text: dates, thousands separators, 40 chars"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "-"
+    if isinstance(value, pd.Timestamp):
+        if value == value.normalize():
+            return value.strftime("%Y-%m-%d")
+        return value.strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, (float, np.floating)):
+        if float(value).is_integer() and abs(value) < 1e15:
+            return f"{int(value):,}"
+        return f"{value:,.2f}"
+    if isinstance(value, (int, np.integer)):
+        return f"{int(value):,}"
+    text = str(value)
+    return text if len(text) <= 40 else text[:37] + "..."
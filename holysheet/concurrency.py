@@ -0,0 +1,119 @@
+"""
+Concurrency limits for outbound Claude calls.
+
+A global semaphore caps the number of in-flight requests for the whole
+process and a per-session semaphore stops one browser tab from taking every
+slot. Callers that cannot get a slot within the queue timeout get a
+QueueTimeout instead of waiting forever.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, Optional
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waited too long for a free slot"""
+
+
+class _SessionSlot:
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0
+
+
+class ConcurrencyLimiter:
+    """Global + per-session admission control for async work"""
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        max_per_session: int = 2,
+        queue_timeout: Optional[float] = 30.0,
+    ):
+        if max_concurrent < 1 or max_per_session < 1:
+            raise ValueError("Concurrency limits must be at least 1")
+        self.max_concurrent = max_concurrent
+        self.max_per_session = max_per_session
+        self.queue_timeout = queue_timeout
+        self._global: Optional[asyncio.Semaphore] = None
+        self._sessions: Dict[Hashable, _SessionSlot] = {}
+        self.active = 0
+        self.waiting = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "ConcurrencyLimiter":
+        return cls(
+            max_concurrent=settings.max_concurrent_chats,
+            max_per_session=settings.max_chats_per_session,
+            queue_timeout=settings.chat_queue_timeout,
+        )
+
+    def _global_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so the semaphore binds to the running loop
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concurrent)
+        return self._global
+
+    async def _acquire(self, semaphore: asyncio.Semaphore, deadline: Optional[float]):
+        if deadline is None:
+            await semaphore.acquire()
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError
+        await asyncio.wait_for(semaphore.acquire(), timeout=remaining)
+
+    @asynccontextmanager
+    async def slot(self, session_id: Hashable = None) -> AsyncIterator[None]:
+        """Hold one global slot (and one slot of session_id) for the block"""
+        deadline = None
+        if self.queue_timeout is not None:
+            deadline = time.monotonic() + self.queue_timeout
+
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _SessionSlot(self.max_per_session)
+        session.users += 1
+
+        self.waiting += 1
+        got_session = got_global = False
+        try:
+            try:
+                await self._acquire(session.semaphore, deadline)
+                got_session = True
+                await self._acquire(self._global_semaphore(), deadline)
+                got_global = True
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise QueueTimeout(
+                    f"No free slot after {self.queue_timeout:.0f}s "
+                    f"({self.active} requests in flight)"
+                ) from None
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+        finally:
+            if got_global:
+                self._global_semaphore().release()
+            if got_session:
+                session.semaphore.release()
+            session.users -= 1
+            if session.users == 0:
+                self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "timeouts": self.timeouts,
+            "sessions": len(self._sessions),
+            "max_concurrent": self.max_concurrent,
+        }
@@ -0,0 +1,148 @@
+"""
+Runtime settings for HolySheet, read from the environment.
+
+Every field can be overridden with an environment variable named
+HOLYSHEET_<FIELD NAME IN UPPER CASE>, e.g. HOLYSHEET_MAX_CONCURRENT_CHATS=16.
+"""
+
+import os
+from dataclasses import dataclass, fields
+
+
+def _coerce(raw: str, default):
+    if isinstance(default, bool):
+        return raw.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(raw)
+    if isinstance(default, float):
+        return float(raw)
+    return raw
+
+
+@dataclass
+class Settings:
+    """Tunables shared by the server and the Streamlit apps"""
+
+    claude_model: str = "claude-3-5-sonnet-20241022"
+    max_tokens: int = 2000
+
+    # Claude call concurrency (FastAPI server)
+    max_concurrent_chats: int = 8
+    max_chats_per_session: int = 2
+    chat_queue_timeout: float = 30.0
+
+    # Quick actions run together by "Run all analyses" (Streamlit webapp)
+    analysis_concurrency: int = 4
+
+    # Parsed sheet data cache
+    sheet_cache_max_mb: int = 256
+    sheet_cache_revalidate_after: float = 30.0
+
+    # Arrow snapshots of loaded sheets (needs pyarrow), memory-mapped back
+    # after a restart; empty to disable
+    sheet_snapshot_dir: str = ".holysheet/snapshots"
+    sheet_snapshot_max_mb: int = 2048
+
+    # Whole-tab loading: rows per chunk and concurrent batchGet calls
+    sheet_chunk_rows: int = 5000
+    sheet_read_workers: int = 4
+
+    # Append-only refresh of whole tabs: when a cached tab is out of date,
+    # this many of its last rows are read again to confirm only rows were
+    # appended, then just the new rows are fetched (0 = always reload)
+    sheet_refresh_overlap_rows: int = 20
+
+    # Approximate token budget for the sheet description sent with a prompt
+    context_token_budget: int = 3000
+
+    # Chat memory: earlier turns sent verbatim (approximate tokens) and the
+    # size of the rolling summary older turns are compacted into
+    history_token_budget: int = 4000
+    history_summary_tokens: int = 600
+
+    # On-disk cache of quick action answers
+    response_cache_path: str = ".holysheet/responses.sqlite"
+    response_cache_ttl: float = 24 * 3600.0
+    response_cache_max_mb: int = 50
+
+    # Per-connection sessions (FastAPI server)
+    session_idle_timeout: float = 30 * 60.0
+    session_max_total_mb: int = 1024
+
+    # WebSocket send queues: outbox size per connection, what to do when a
+    # client falls behind (drop, coalesce or disconnect), stalled write limit
+    ws_send_queue_size: int = 256
+    ws_slow_consumer_policy: str = "coalesce"
+    ws_send_timeout: float = 10.0
+    # Batched frames (clients that negotiate a subprotocol): how long a
+    # stream delta waits for company, and the most messages per frame
+    ws_batch_delay: float = 0.015
+    ws_batch_max: int = 64
+
+    # Where sessions and sheet snapshots live: "memory" (one worker) or
+    # "sqlite" (shared by every worker on the host)
+    state_backend: str = "memory"
+    state_path: str = ".holysheet/state.sqlite"
+
+    # Client-side API quotas in requests per minute (0 = no cap) and retries.
+    # Defaults follow the published Sheets limits (300/project, 60/user for
+    # reads and writes each) and Anthropic's entry-tier request limit.
+    sheets_read_requests_per_minute: int = 300
+    sheets_write_requests_per_minute: int = 300
+    sheets_user_requests_per_minute: int = 60
+    drive_requests_per_minute: int = 12000
+    anthropic_requests_per_minute: int = 50
+    anthropic_user_requests_per_minute: int = 0
+    api_burst_seconds: float = 10.0
+    api_max_retries: int = 5
+    api_backoff_base: float = 0.5
+    api_backoff_max: float = 32.0
+
+    # Google API clients: keep-alive transports shared by all threads, an
+    # optional directory of discovery documents ({api}.{version}.json) and
+    # how long before expiry the OAuth token is refreshed in the background
+    google_http_pool_size: int = 8
+    google_discovery_dir: str = ""
+    google_token_refresh_margin: float = 300.0
+
+    # Language model: "anthropic", "local" (an OpenAI-compatible server such
+    # as LM Studio) or "auto" (quick actions and sheets up to
+    # local_llm_max_rows rows go local first). The other one is the
+    # fallback; a provider that is down is skipped for the cooldown.
+    llm_provider: str = "anthropic"
+    local_llm_url: str = "http://localhost:1234/v1"
+    local_llm_model: str = "local-model"
+    local_llm_api_key: str = ""
+    local_llm_timeout: float = 60.0
+    local_llm_max_rows: int = 2000
+    llm_failure_cooldown: float = 30.0
+
+    # Query tools the model can call on the loaded sheet (filter, aggregate,
+    # top_k, pivot, describe): rounds of tool calls per question and caps on
+    # what one result sends back
+    query_tools: bool = True
+    query_tool_max_steps: int = 6
+    query_tool_max_rows: int = 50
+    query_tool_max_chars: int = 4000
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Build settings from HOLYSHEET_* environment variables"""
+        settings = cls()
+        for f in fields(cls):
+            raw = os.getenv(f"HOLYSHEET_{f.name.upper()}")
+            if raw is None:
+                continue
+            default = getattr(settings, f.name)
+            if raw == "":
+                # An explicitly empty string setting means "off" (e.g. no
+                # snapshot directory); other types keep their default
+                if isinstance(default, str):
+                    setattr(settings, f.name, "")
+                continue
+            try:
+                setattr(settings, f.name, _coerce(raw, default))
+            except ValueError:
+                # Keep the default rather than refusing to start
+                pass
+        return settings
@@ -0,0 +1,367 @@
+"""
+WebSocket fan-out with per-connection send queues.
+
+Every connection gets a bounded outbox drained by its own writer task, so
+sending to one socket never waits on another. Broadcasts only enqueue; when a
+client cannot keep up and its outbox is full, the slow-consumer policy
+decides what happens:
+
+- "drop": the new broadcast is discarded for that client
+- "coalesce": a keyed update replaces the queued update with the same key
+  (e.g. the latest progress for a job); unkeyed overflow is discarded
+- "disconnect": the client is closed so it can reconnect and resync
+
+Messages addressed to a single connection (chat replies) are never dropped;
+the sender waits for room instead. A write that stalls past send_timeout
+closes the connection.
+
+Messages are dicts (or JSON text) and are encoded by the writer, once per
+wire format however many sockets they go to. Clients that negotiate a
+subprotocol get the compact protocol: "holysheet.msgpack" sends MessagePack
+binary frames (when msgpack is installed) and "holysheet.json" JSON text.
+Either way, queued messages leave as one batched frame (a top-level
+array), consecutive chat_delta texts of one request are merged, and a
+streaming message waits batch_delay for company before it is sent. Clients
+that offer no subprotocol keep the original one JSON frame per message.
+Client to server messages stay JSON text; they are few and small.
+"""
+
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Union
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+POLICIES = ("drop", "coalesce", "disconnect")
+
+# Subprotocol -> wire format, most compact first
+SUBPROTOCOLS = {"holysheet.msgpack": "msgpack", "holysheet.json": "json"}
+
+# Small, frequent messages worth holding back for a batch
+STREAMING_TYPES = ("chat_delta", "chat_tool", "progress")
+
+# Close code for "try again later" (RFC 6455 registry)
+TRY_AGAIN_LATER = 1013
+
+
+def _plain(value: Any) -> Any:
+    """Fallback for values the encoders don't know (numpy scalars, dates)"""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class Message:
+    """An outgoing payload (dict or JSON text), encoded once per wire format"""
+
+    __slots__ = ("payload", "_json", "_packed")
+
+    def __init__(self, payload: Union[Dict[str, Any], str]):
+        self.payload = payload
+        self._json: Optional[str] = payload if isinstance(payload, str) else None
+        self._packed: Optional[bytes] = None
+
+    @property
+    def type(self) -> Optional[str]:
+        return self.payload.get("type") if isinstance(self.payload, dict) else None
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.payload, default=_plain)
+        return self._json
+
+    def packed(self) -> bytes:
+        if self._packed is None:
+            payload = self.payload
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            self._packed = msgpack.packb(payload, default=_plain)
+        return self._packed
+
+
+def pick_subprotocol(offered: List[str]) -> Optional[str]:
+    """The first subprotocol offered by the client that the server speaks"""
+    for name in offered:
+        if SUBPROTOCOLS.get(name) == "msgpack" and msgpack is None:
+            continue
+        if name in SUBPROTOCOLS:
+            return name
+    return None
+
+
+def merge_deltas(messages: List[Message]) -> List[Message]:
+    """Join consecutive chat_delta messages of the same request"""
+    merged: List[Message] = []
+    for message in messages:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and message.type == "chat_delta"
+            and previous.type == "chat_delta"
+            and message.payload.get("request_id") == previous.payload.get("request_id")
+        ):
+            payload = dict(previous.payload)
+            payload["text"] = payload.get("text", "") + message.payload.get("text", "")
+            merged[-1] = Message(payload)
+        else:
+            merged.append(message)
+    return merged
+
+
+def encode_batch(messages: List[Message], wire: str) -> Union[str, bytes]:
+    """One frame for the messages: a single payload, or an array of them"""
+    messages = merge_deltas(messages)
+    if wire == "msgpack":
+        if len(messages) == 1:
+            return messages[0].packed()
+        # An array is its header followed by the already encoded items
+        header = msgpack.Packer().pack_array_header(len(messages))
+        return header + b"".join(m.packed() for m in messages)
+    if len(messages) == 1:
+        return messages[0].json()
+    return "[" + ",".join(m.json() for m in messages) + "]"
+
+
+class Connection:
+    """One socket, its outbox and counters"""
+
+    def __init__(self, websocket: Any, max_queue: int, wire: Optional[str] = None):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        # None: one JSON text frame per message (clients without a subprotocol)
+        self.wire = wire
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.frames = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # Entries are [key, message] so a coalesced update keeps its place
+        self._pending: Deque[List[Any]] = deque()
+        self._keyed: Dict[str, List[Any]] = {}
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def full(self) -> bool:
+        return len(self._pending) >= self.max_queue
+
+    def offer(self, message: Any, key: Optional[str] = None) -> bool:
+        """Queue a message without waiting; False when the outbox is full"""
+        if self.closed:
+            return False
+        if not isinstance(message, Message):
+            message = Message(message)
+        if key is not None and key in self._keyed:
+            self._keyed[key][1] = message
+            self.coalesced += 1
+            return True
+        if self.full:
+            return False
+        entry = [key, message]
+        self._pending.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+        self._ready.set()
+        if self.full:
+            self._space.clear()
+        return True
+
+    async def put(self, message: Any) -> bool:
+        """Queue a message, waiting for room; False if the connection closed"""
+        while not self.offer(message):
+            if self.closed:
+                return False
+            await self._space.wait()
+        return True
+
+    async def next(self) -> Message:
+        while not self._pending:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._pop()
+
+    def drain(self, limit: int) -> List[Message]:
+        """Up to limit queued messages, without waiting"""
+        messages = []
+        while self._pending and len(messages) < limit:
+            messages.append(self._pop())
+        return messages
+
+    def _pop(self) -> Message:
+        key, message = self._pending.popleft()
+        if key is not None:
+            self._keyed.pop(key, None)
+        self._space.set()
+        return message
+
+    def close(self) -> None:
+        self.closed = True
+        self._pending.clear()
+        self._keyed.clear()
+        # Wake senders blocked in put() so they see the connection is gone
+        self._space.set()
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+
+class ConnectionManager:
+    """Tracks open sockets and delivers messages through their outboxes"""
+
+    def __init__(
+        self,
+        max_queue: int = 256,
+        policy: str = "coalesce",
+        send_timeout: Optional[float] = 10.0,
+        batch_delay: float = 0.015,
+        batch_max: int = 64,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy!r}")
+        if max_queue < 1:
+            raise ValueError("Send queue size must be at least 1")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.batch_delay = batch_delay
+        self.batch_max = max(batch_max, 1)
+        self._connections: Dict[Any, Connection] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self.slow_disconnects = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "ConnectionManager":
+        return cls(
+            max_queue=settings.ws_send_queue_size,
+            policy=settings.ws_slow_consumer_policy,
+            send_timeout=settings.ws_send_timeout,
+            batch_delay=settings.ws_batch_delay,
+            batch_max=settings.ws_batch_max,
+        )
+
+    async def connect(self, websocket: Any) -> Connection:
+        scope = getattr(websocket, "scope", None) or {}
+        subprotocol = pick_subprotocol(scope.get("subprotocols") or [])
+        if subprotocol is None:
+            await websocket.accept()
+        else:
+            await websocket.accept(subprotocol=subprotocol)
+        wire = SUBPROTOCOLS.get(subprotocol) if subprotocol else None
+        connection = Connection(websocket, self.max_queue, wire)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self._connections[websocket] = connection
+        return connection
+
+    def disconnect(self, websocket: Any) -> None:
+        connection = self._connections.pop(websocket, None)
+        if connection is not None:
+            connection.close()
+
+    def __contains__(self, websocket: Any) -> bool:
+        return websocket in self._connections
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    async def send_personal_message(self, message: Any, websocket: Any) -> bool:
+        """Queue a message for one socket, waiting while its outbox is full"""
+        connection = self._connections.get(websocket)
+        if connection is None:
+            return False
+        return await connection.put(message)
+
+    async def broadcast(self, message: Any, key: Optional[str] = None) -> int:
+        """Queue a message for every socket; returns how many accepted it
+
+        key identifies updates that supersede each other (for example
+        "progress:<job>"); under the coalesce policy only the latest
+        queued update per key is delivered.
+        """
+        delivered = 0
+        # One Message for every socket, so each wire format is encoded once
+        message = message if isinstance(message, Message) else Message(message)
+        for connection in list(self._connections.values()):
+            if self._enqueue(connection, message, key):
+                delivered += 1
+        return delivered
+
+    def _enqueue(
+        self, connection: Connection, message: Message, key: Optional[str]
+    ) -> bool:
+        if connection.offer(message, key if self.policy == "coalesce" else None):
+            return True
+        if self.policy == "disconnect":
+            self.slow_disconnects += 1
+            self._evict(connection)
+        else:
+            connection.dropped += 1
+        return False
+
+    async def _write(self, connection: Connection) -> None:
+        try:
+            while True:
+                first = await connection.next()
+                if connection.wire is None:
+                    batch, frame = [first], first.json()
+                else:
+                    if (
+                        self.batch_delay > 0
+                        and connection.depth == 0
+                        and first.type in STREAMING_TYPES
+                    ):
+                        # Let the next few deltas catch up and share the frame
+                        await asyncio.sleep(self.batch_delay)
+                    batch = [first] + connection.drain(self.batch_max - 1)
+                    frame = encode_batch(batch, connection.wire)
+                if isinstance(frame, bytes):
+                    send = connection.websocket.send_bytes(frame)
+                else:
+                    send = connection.websocket.send_text(frame)
+                await asyncio.wait_for(send, self.send_timeout)
+                connection.sent += len(batch)
+                connection.frames += 1
+                connection.bytes_sent += len(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket closed under us, or a write stalled past send_timeout
+            self._evict(connection)
+
+    def _evict(self, connection: Connection) -> None:
+        self._connections.pop(connection.websocket, None)
+        connection.close()
+        task = asyncio.create_task(self._close_socket(connection.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_socket(websocket: Any) -> None:
+        try:
+            await websocket.close(code=TRY_AGAIN_LATER)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        connections = list(self._connections.values())
+        return {
+            "connections": len(connections),
+            "policy": self.policy,
+            "queued": sum(c.depth for c in connections),
+            "max_depth": max((c.depth for c in connections), default=0),
+            "sent": sum(c.sent for c in connections),
+            "frames": sum(c.frames for c in connections),
+            "bytes_sent": sum(c.bytes_sent for c in connections),
+            "dropped": sum(c.dropped for c in connections),
+            "coalesced": sum(c.coalesced for c in connections),
+            "slow_disconnects": self.slow_disconnects,
+        }
@@ -0,0 +1,155 @@
+"""
+Token-budgeted sheet context for prompts.
+
+Rather than pasting the first 50 rows, build_sheet_context describes the
+whole frame: a profile of every column (dtype, null rate, range, quantiles,
+most common values), totals per period when there is a date column, and a
+sample of rows spread evenly across the sheet (or across time). Sections are
+added in that order of priority until the token budget is used up.
+"""
+
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from holysheet.column_types import date_column, format_value
+from holysheet.sheet_loader import column_letter
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def profile_column(column: pd.Series, top_k: int = 5, letter: str = "") -> str:
+    """One line describing a column"""
+    label = f"{column.name} [{letter}]" if letter else str(column.name)
+    rows = len(column)
+    nulls = int(column.isna().sum())
+    parts = [f"{column.dtype}", f"{nulls / rows:.0%} empty" if rows else "empty"]
+    present = column.dropna()
+    if present.empty:
+        return f"- {label}: " + ", ".join(parts)
+
+    if pd.api.types.is_bool_dtype(column):
+        parts.append(f"true {int(present.sum()):,} of {len(present):,}")
+    elif pd.api.types.is_numeric_dtype(column):
+        q = present.quantile([0.25, 0.5, 0.75])
+        parts.append(
+            f"min {format_value(present.min())}, p25 {format_value(q[0.25])}, median {format_value(q[0.5])}, "
+            f"p75 {format_value(q[0.75])}, max {format_value(present.max())}, "
+            f"mean {format_value(present.mean())}, sum {format_value(present.sum())}"
+        )
+    elif pd.api.types.is_datetime64_any_dtype(column):
+        parts.append(
+            f"from {format_value(present.min())} to {format_value(present.max())}"
+        )
+    else:
+        counts = present.astype(str).value_counts()
+        top = ", ".join(
+            f"{format_value(v)} ({n:,})" for v, n in counts.head(top_k).items()
+        )
+        parts.append(f"{len(counts):,} distinct; top: {top}")
+    return f"- {label}: " + ", ".join(parts)
+
+
+def period_totals(frame: pd.DataFrame, max_columns: int = 3) -> Optional[str]:
+    """Totals of the first numeric columns per year (or month for short spans)"""
+    date_col = date_column(frame)
+    numeric = [
+        c
+        for c in frame.select_dtypes(include=["number"]).columns
+        if not pd.api.types.is_bool_dtype(frame[c])
+    ][:max_columns]
+    if date_col is None or not numeric:
+        return None
+    dates = frame[date_col]
+    if dates.notna().sum() == 0:
+        return None
+    span_days = (dates.max() - dates.min()).days
+    freq, label = ("M", "month") if span_days <= 730 else ("Y", "year")
+    periods = dates.dt.to_period(freq)
+    grouped = frame[numeric].groupby(periods).sum(min_count=1)
+    lines = [f"Totals by {label} ({date_col}): " + " | ".join(map(str, numeric))]
+    for period, row in grouped.iterrows():
+        lines.append(f"{period}: " + " | ".join(format_value(v) for v in row.tolist()))
+    return "\n".join(lines)
+
+
+def sample_positions(frame: pd.DataFrame, n: int) -> List[int]:
+    """Row positions spread evenly over time (by date column) or over the sheet"""
+    if n <= 0 or frame.empty:
+        return []
+    n = min(n, len(frame))
+    date_col = date_column(frame)
+    if date_col is not None and frame[date_col].notna().any():
+        order = np.argsort(frame[date_col].to_numpy(), kind="stable")
+    else:
+        order = np.arange(len(frame))
+    picks = np.unique(np.linspace(0, len(frame) - 1, n).round().astype(int))
+    return sorted(int(p) for p in order[picks])
+
+
+def _render_rows(frame: pd.DataFrame, positions: List[int], first_row: int) -> str:
+    sample = frame.iloc[positions].copy()
+    sample.index = [p + first_row for p in positions]
+    sample.index.name = "Row"
+    for name in sample.columns:
+        sample[name] = [format_value(v) for v in sample[name].tolist()]
+    return sample.to_string()
+
+
+def build_sheet_context(
+    frame: pd.DataFrame,
+    budget_tokens: int = 3000,
+    top_k: int = 5,
+    first_row: int = 2,
+    first_column: int = 1,
+) -> str:
+    """Describe frame for a prompt in at most about budget_tokens tokens
+
+    first_row and first_column locate the frame's first data cell in the
+    sheet, so profiles and sampled rows carry real column letters and row
+    numbers the model can use in formulas.
+    """
+    rows, cols = frame.shape
+    sections = [f"Size: {rows:,} rows x {cols} columns"]
+    used = estimate_tokens(sections[0])
+
+    # Column profiles come first; if they alone overflow, list the rest by name
+    profile_lines = ["Columns:"]
+    for i, name in enumerate(frame.columns):
+        letter = column_letter(first_column + i)
+        line = profile_column(frame.iloc[:, i], top_k=top_k, letter=letter)
+        if used + estimate_tokens("\n".join(profile_lines + [line])) > budget_tokens:
+            rest = [str(c) for c in frame.columns[i:]]
+            profile_lines.append(f"- ... {len(rest)} more columns: {', '.join(rest)}")
+            break
+        profile_lines.append(line)
+    profiles = "\n".join(profile_lines)
+    sections.append(profiles)
+    used += estimate_tokens(profiles)
+
+    totals = period_totals(frame)
+    if totals is not None and used + estimate_tokens(totals) <= budget_tokens:
+        sections.append(totals)
+        used += estimate_tokens(totals)
+
+    remaining = budget_tokens - used
+    if remaining > 0 and rows:
+        # Size the sample from the cost of a few rendered rows
+        probe = _render_rows(frame, sample_positions(frame, 5), first_row)
+        per_row = max(estimate_tokens(probe) / max(probe.count("\n"), 1), 1)
+        n = int(remaining / per_row) - 2
+        if n > 0:
+            positions = sample_positions(frame, n)
+            label = "all rows" if len(positions) == rows else f"{len(positions)} rows"
+            sections.append(
+                f"Sample ({label}, spread across the sheet):\n"
+                + _render_rows(frame, positions, first_row)
+            )
+
+    return "\n\n".join(sections)
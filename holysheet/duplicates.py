@@ -0,0 +1,311 @@
+"""
+Near-duplicate transaction detection.
+
+Comparing every row with every other row is hopeless past a few thousand
+rows, so candidates are found by blocking instead. Each row gets integer
+keys for its day and its amount (in cents, bucketed by the tolerance), and
+a self-join on neighbouring keys pairs up rows at most date_tolerance days
+and amount_tolerance apart. The work grows with rows times block size, not
+rows squared.
+
+Candidate pairs then need similar vendors. Vendors are normalized first
+("AMAZON.COM*MK12" and "Amazon.com" become the same key), and
+different keys are compared by character-trigram Jaccard similarity once
+per distinct pair of spellings. Accepted pairs are merged into clusters,
+which are reported as sheet rows the UI can highlight.
+
+    clusters = find_near_duplicates(frame)
+    clusters[0].rows  # [12, 480]
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from holysheet.column_types import date_column, format_value
+
+VENDOR_HINTS = ("vendor", "payee", "merchant", "description", "name", "memo")
+AMOUNT_HINTS = ("amount", "total", "debit", "credit", "cost", "price", "value")
+
+_NOISE = re.compile(r"[^\w\s]|\d|_")
+_SUFFIXES = re.compile(r"\b(?:inc|llc|ltd|co|corp|com|the)\b")
+
+
+@dataclass
+class DuplicateCluster:
+    """Rows that look like the same transaction entered more than once"""
+
+    rows: List[int]  # sheet rows, ascending
+    similarity: float  # lowest vendor similarity of the pairs that joined it
+    exact: bool  # every cell identical
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+def _hinted(frame: pd.DataFrame, names: List[str], hints) -> Optional[str]:
+    for hint in hints:
+        for name in names:
+            if hint in str(name).lower():
+                return name
+    return None
+
+
+def guess_columns(frame: pd.DataFrame) -> Dict[str, Optional[str]]:
+    """Best guesses for the vendor, amount and date columns
+
+    None when no column name looks like one: a notes or ID column picked
+    only for its type would match rows on meaningless values.
+    """
+    numeric = [
+        c
+        for c in frame.columns
+        if pd.api.types.is_numeric_dtype(frame[c])
+        and not pd.api.types.is_bool_dtype(frame[c])
+    ]
+    text = [
+        c
+        for c in frame.columns
+        if frame[c].dtype == object
+        or isinstance(frame[c].dtype, pd.CategoricalDtype)
+        or pd.api.types.is_string_dtype(frame[c].dtype)
+    ]
+    return {
+        "vendor": _hinted(frame, text, VENDOR_HINTS),
+        "amount": _hinted(frame, numeric, AMOUNT_HINTS),
+        "date": date_column(frame),
+    }
+
+
+def normalize_vendor(values: pd.Series) -> pd.Series:
+    """Case, punctuation, digits and company suffixes removed"""
+    text = values.astype("string").str.casefold()
+    text = text.str.replace(_NOISE, " ", regex=True)
+    text = text.str.replace(_SUFFIXES, " ", regex=True)
+    text = text.str.replace(r"\s+", " ", regex=True).str.strip()
+    return text.mask(text == "")
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    padded = f" {text} "
+    if len(padded) < 3:
+        return frozenset([padded])
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _candidate_pairs(
+    keys: pd.DataFrame, date_tolerance: int, max_block: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Row positions (left < right) sharing a neighbouring (day, bucket) block
+
+    Rows in blocks bigger than max_block (a sheet full of identical
+    same-day amounts) would make the join quadratic again, so they are only
+    matched exactly: same day, amount and vendor key, each group linked to
+    its first row rather than pairwise.
+    """
+    empty = np.array([], dtype="int64")
+    if keys.empty:
+        return empty, empty
+    # One int64 per (day, bucket) so each join is on a single column
+    bucket = keys["bucket"].to_numpy() - keys["bucket"].min() + 1
+    span = int(bucket.max()) + 2
+    block = (keys["day"].to_numpy() - keys["day"].min()) * span + bucket
+    pos = keys["pos"].to_numpy()
+    big = pd.Series(block).groupby(block).transform("size").to_numpy() > max_block
+
+    lefts, rights = [], []
+    if big.any():
+        exact = pd.DataFrame(
+            {
+                "pos": pos[big],
+                "block": block[big],
+                "cents": keys["cents"].to_numpy()[big],
+                "vendor": keys["vendor"].to_numpy()[big],
+            }
+        )
+        first = exact.groupby(["block", "cents", "vendor"])["pos"].transform("min")
+        lefts.append(first.to_numpy())
+        rights.append(exact["pos"].to_numpy())
+
+    left = pd.DataFrame({"a": pos[~big], "block": block[~big]})
+    for day_offset in range(date_tolerance + 1):
+        for bucket_offset in (-1, 0, 1):
+            right = left.rename(columns={"a": "b"})
+            right["block"] = right["block"] - day_offset * span - bucket_offset
+            joined = left.merge(right, on="block")
+            lefts.append(joined["a"].to_numpy())
+            rights.append(joined["b"].to_numpy())
+    a = np.concatenate(lefts)
+    b = np.concatenate(rights)
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    keep = a != b
+    n = int(pos.max()) + 1
+    pairs = np.unique(a[keep] * n + b[keep])
+    return pairs // n, pairs % n
+
+
+def _components(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Smallest member of each row's connected component (label propagation)"""
+    labels = np.arange(n)
+    while True:
+        lowest = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, lowest)
+        np.minimum.at(updated, b, lowest)
+        # Jump to the label's own label to shorten long chains
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def find_near_duplicates(
+    frame: pd.DataFrame,
+    vendor: Optional[str] = None,
+    amount: Optional[str] = None,
+    date: Optional[str] = None,
+    amount_tolerance: float = 0.01,
+    date_tolerance: int = 1,
+    min_similarity: float = 0.6,
+    first_row: int = 2,
+    max_block: int = 200,
+) -> List[DuplicateCluster]:
+    """Clusters of likely duplicate transactions, largest first
+
+    Columns not given are guessed (see guess_columns). Rows are matched on
+    whichever of vendor, amount and date there are columns for; at least
+    two are required.
+    """
+    guessed = guess_columns(frame)
+    vendor = vendor or guessed["vendor"]
+    amount = amount or guessed["amount"]
+    date = date or guessed["date"]
+    if frame.empty or sum(c is not None for c in (vendor, amount, date)) < 2:
+        return []
+
+    n = len(frame)
+    keys = pd.DataFrame({"pos": np.arange(n)})
+    valid = np.ones(n, dtype=bool)
+    if date is not None:
+        dates = pd.to_datetime(frame[date], errors="coerce").to_numpy()
+        valid &= ~pd.isna(dates)
+        keys["day"] = dates.astype("datetime64[D]").astype("int64")
+    else:
+        keys["day"] = 0
+        date_tolerance = 0
+    tolerance_cents = int(round(amount_tolerance * 100))
+    if amount is not None:
+        values = frame[amount].astype("float64").to_numpy()
+        valid &= ~np.isnan(values)
+    else:
+        values = np.zeros(n)
+    cents = np.round(np.nan_to_num(values) * 100).astype("int64")
+    keys["cents"] = cents
+    keys["bucket"] = cents // (tolerance_cents + 1)
+
+    if vendor is not None:
+        # Normalize each distinct spelling once, then map back to rows
+        raw_codes, spellings = pd.factorize(frame[vendor])
+        vendor_codes, names = pd.factorize(
+            normalize_vendor(pd.Series(np.asarray(spellings, dtype=object)))
+        )
+        codes = np.where(raw_codes >= 0, vendor_codes[raw_codes], -1)
+    else:
+        # No vendor criterion: every row counts as the same vendor
+        codes = np.zeros(n, dtype="int64")
+    keys["vendor"] = codes
+    keys = keys[valid]
+    a, b = _candidate_pairs(keys, date_tolerance, max_block)
+
+    # Exact limits (buckets and days only bound the search)
+    keep = np.abs(cents[a] - cents[b]) <= tolerance_cents
+    if date is not None:
+        days = keys["day"].reindex(range(n)).to_numpy()
+        keep &= np.abs(days[a] - days[b]) <= date_tolerance
+    a, b = a[keep], b[keep]
+
+    # Vendor similarity, once per distinct pair of normalized spellings
+    va, vb = codes[a], codes[b]
+    similarity = np.where(va == vb, 1.0, 0.0)
+    similarity[(va < 0) | (vb < 0)] = 0.0
+    different = (va != vb) & (va >= 0) & (vb >= 0)
+    if different.any():
+        shingles: Dict[int, FrozenSet[str]] = {}
+        combos = np.unique(np.stack([va[different], vb[different]], axis=1), axis=0)
+        scores = {}
+        for x, y in combos.tolist():
+            for code in (x, y):
+                if code not in shingles:
+                    shingles[code] = trigrams(names[code])
+            scores[(x, y)] = jaccard(shingles[x], shingles[y])
+        similarity[different] = [
+            scores[pair] for pair in zip(va[different].tolist(), vb[different].tolist())
+        ]
+    accepted = similarity >= min_similarity
+    a, b, similarity = a[accepted], b[accepted], similarity[accepted]
+    if not len(a):
+        return []
+
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    labels = _components(n, a, b)
+    members = np.unique(np.concatenate([a, b]))
+    groups = pd.DataFrame(
+        {
+            "row": members + first_row,
+            "label": labels[members],
+            "same": hashes[members] == hashes[labels[members]],
+        }
+    ).groupby("label")
+    lowest = pd.Series(similarity).groupby(labels[a]).min()
+    rows = groups["row"].agg(list)
+    exact = groups["same"].all()
+    clusters = [
+        DuplicateCluster(
+            rows=rows[label],
+            similarity=round(float(lowest[label]), 2),
+            exact=bool(exact[label]),
+        )
+        for label in rows.index.tolist()
+    ]
+    clusters.sort(key=lambda c: (-len(c), c.rows[0]))
+    return clusters
+
+
+def describe_clusters(
+    frame: pd.DataFrame,
+    clusters: List[DuplicateCluster],
+    columns: Optional[Dict[str, Optional[str]]] = None,
+    limit: int = 10,
+    first_row: int = 2,
+) -> str:
+    """Prompt lines for near (not exact) duplicate clusters"""
+    near = [c for c in clusters if not c.exact]
+    if not near:
+        return "Near-duplicate transactions: none"
+    columns = columns or guess_columns(frame)
+    shown = [c for c in (columns["vendor"], columns["amount"], columns["date"]) if c]
+    lines = [
+        f"Near-duplicate transactions ({', '.join(map(str, shown))}): "
+        f"{len(near):,} clusters, {sum(len(c) for c in near):,} rows"
+    ]
+    for cluster in near[:limit]:
+        positions = [r - first_row for r in cluster.rows]
+        cells = frame.iloc[positions][shown]
+        values = " / ".join(
+            ", ".join(format_value(v) for v in row)
+            for row in cells.itertuples(index=False)
+        )
+        rows = ", ".join(str(r) for r in cluster.rows)
+        lines.append(f"- rows {rows}: {values}")
+    if len(near) > limit:
+        lines.append(f"- ... {len(near) - limit:,} more clusters")
+    return "\n".join(lines)
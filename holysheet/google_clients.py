@@ -0,0 +1,334 @@
+"""
+Shared, thread-safe Google API clients.
+
+build('sheets', 'v4', credentials=creds) parses a large discovery document
+on every call and ties the service to a single httplib2 transport, which is
+not safe to use from several threads. GoogleClientFactory instead:
+
+- reads each discovery document once, from HOLYSHEET_GOOGLE_DISCOVERY_DIR
+  if a copy is there, otherwise from the copy bundled with
+  google-api-python-client, so no network fetch happens at startup
+- builds one service per API on top of a PooledHttp, a pool of keep-alive
+  authorized transports that many threads can use at once
+- refreshes the OAuth access token in a background thread a few minutes
+  before it expires, so requests never stop to refresh it themselves
+"""
+
+import json
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from holysheet.config import Settings
+
+HttpFactory = Callable[[], Any]
+
+
+def load_discovery_document(
+    api: str, version: str, directory: Optional[str] = None
+) -> Optional[str]:
+    """Discovery JSON from directory or the client library's bundled copy"""
+    if directory:
+        path = os.path.join(directory, f"{api}.{version}.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+    try:
+        from googleapiclient import discovery_cache
+
+        return discovery_cache.get_static_doc(api, version)
+    except ImportError:
+        return None
+
+
+_documents: Dict[Tuple[str, str, Optional[str]], Optional[str]] = {}
+_documents_lock = threading.Lock()
+
+
+def discovery_document(
+    api: str, version: str, directory: Optional[str] = None
+) -> Optional[str]:
+    """Cached load_discovery_document (read from disk once per process)"""
+    key = (api, version, directory)
+    with _documents_lock:
+        if key not in _documents:
+            _documents[key] = load_discovery_document(api, version, directory)
+        return _documents[key]
+
+
+class PooledHttp:
+    """httplib2.Http stand-in that spreads requests over a transport pool
+
+    Transports are reused last-in first-out so the ones with warm
+    keep-alive connections are picked first. At most size transports
+    exist; extra callers wait for one to be returned.
+    """
+
+    def __init__(self, factory: HttpFactory, size: int = 8, credentials=None):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._factory = factory
+        self.size = size
+        # Lets googleapiclient and SheetLoader find the credentials
+        self.credentials = credentials
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.waits = 0
+
+    def _checkout(self) -> Any:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+                self.waits += 1
+        if create:
+            try:
+                return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        http = self._checkout()
+        try:
+            return http.request(uri, method, body=body, headers=headers, **kwargs)
+        finally:
+            self._idle.put(http)
+
+    def close(self) -> None:
+        while True:
+            try:
+                http = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            for conn in getattr(http, "connections", {}).values():
+                conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+            "waits": self.waits,
+        }
+
+
+def authorized_http_factory(credentials, timeout: Optional[float] = 60) -> HttpFactory:
+    """Keep-alive authorized transports sharing one credentials object"""
+
+    def factory():
+        import google_auth_httplib2
+        import httplib2
+
+        return google_auth_httplib2.AuthorizedHttp(
+            credentials, http=httplib2.Http(timeout=timeout)
+        )
+
+    return factory
+
+
+def _utcnow() -> datetime:
+    # google-auth keeps expiry as a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class TokenRefresher:
+    """Refreshes OAuth credentials shortly before they expire"""
+
+    def __init__(
+        self,
+        credentials,
+        margin: float = 300.0,
+        interval: float = 60.0,
+        refresh: Optional[Callable[[Any], None]] = None,
+        on_refresh: Optional[Callable[[Any], None]] = None,
+        now: Callable[[], datetime] = _utcnow,
+    ):
+        self.credentials = credentials
+        self.margin = margin
+        self.interval = interval
+        self._refresh = refresh or _refresh_with_httplib2
+        self._on_refresh = on_refresh
+        self._now = now
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.errors = 0
+
+    def due(self) -> bool:
+        if not getattr(self.credentials, "refresh_token", None):
+            return False  # nothing we can refresh with
+        expiry = getattr(self.credentials, "expiry", None)
+        if expiry is None or not getattr(self.credentials, "token", None):
+            return True
+        return (expiry - self._now()).total_seconds() <= self.margin
+
+    def refresh_if_due(self) -> bool:
+        with self._lock:
+            if not self.due():
+                return False
+            try:
+                self._refresh(self.credentials)
+            except Exception:
+                # Try again next tick; requests can still refresh on a 401
+                self.errors += 1
+                return False
+            self.refreshes += 1
+        if self._on_refresh is not None:
+            self._on_refresh(self.credentials)
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.refresh_if_due()
+            self._stop.wait(self.interval)
+
+    def start(self) -> "TokenRefresher":
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="oauth-refresh", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _refresh_with_httplib2(credentials) -> None:
+    import google_auth_httplib2
+    import httplib2
+
+    credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+
+
+def save_token(path: str) -> Callable[[Any], None]:
+    """on_refresh callback that keeps token.json current"""
+
+    def save(credentials) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(credentials.to_json())
+        os.replace(tmp, path)
+
+    return save
+
+
+class GoogleClientFactory:
+    """Builds Google API services once and shares their transport pool"""
+
+    def __init__(
+        self,
+        credentials,
+        pool_size: int = 8,
+        discovery_dir: Optional[str] = None,
+        refresh_margin: float = 300.0,
+        http_factory: Optional[HttpFactory] = None,
+        on_refresh: Optional[Callable[[Any], None]] = None,
+    ):
+        self.credentials = credentials
+        self.discovery_dir = discovery_dir
+        self.http = PooledHttp(
+            http_factory or authorized_http_factory(credentials),
+            size=pool_size,
+            credentials=credentials,
+        )
+        self.refresher = TokenRefresher(
+            credentials, margin=refresh_margin, on_refresh=on_refresh
+        )
+        self._services: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(
+        cls, credentials, settings, token_file: Optional[str] = None
+    ) -> "GoogleClientFactory":
+        return cls(
+            credentials,
+            pool_size=settings.google_http_pool_size,
+            discovery_dir=settings.google_discovery_dir or None,
+            refresh_margin=settings.google_token_refresh_margin,
+            on_refresh=save_token(token_file) if token_file else None,
+        )
+
+    def service(self, api: str, version: str):
+        with self._lock:
+            service = self._services.get((api, version))
+            if service is None:
+                service = self._services[(api, version)] = self._build(api, version)
+            return service
+
+    def _build(self, api: str, version: str):
+        from googleapiclient.discovery import build, build_from_document
+
+        document = discovery_document(api, version, self.discovery_dir)
+        if document is None:
+            return build(api, version, http=self.http, cache_discovery=False)
+        return build_from_document(json.loads(document), http=self.http)
+
+    def sheets(self):
+        return self.service("sheets", "v4")
+
+    def drive(self):
+        return self.service("drive", "v3")
+
+    def start(self) -> "GoogleClientFactory":
+        """Refresh the token now (off the request path) and keep it fresh"""
+        self.refresher.refresh_if_due()
+        self.refresher.start()
+        return self
+
+    def close(self) -> None:
+        self.refresher.stop()
+        self.http.close()
+
+
+_factories: Dict[str, GoogleClientFactory] = {}
+_factories_lock = threading.Lock()
+
+
+def client_factory_for_token(
+    token_file: str = "token.json", settings: Optional[Settings] = None
+) -> GoogleClientFactory:
+    """Process-wide factory for an authorized-user token file"""
+    path = os.path.abspath(token_file)
+    with _factories_lock:
+        factory = _factories.get(path)
+        if factory is None:
+            from google.oauth2.credentials import Credentials
+
+            # Keep the scopes the token was granted with
+            credentials = Credentials.from_authorized_user_file(path)
+            factory = GoogleClientFactory.from_settings(
+                credentials, settings or Settings.from_env(), token_file=path
+            ).start()
+            _factories[path] = factory
+        return factory
+
+
+def client_factory_for_credentials(
+    credentials, settings: Optional[Settings] = None, token_file: Optional[str] = None
+) -> GoogleClientFactory:
+    """Factory for credentials that were just obtained (e.g. an OAuth flow)"""
+    factory = GoogleClientFactory.from_settings(
+        credentials, settings or Settings.from_env(), token_file=token_file
+    ).start()
+    if token_file:
+        with _factories_lock:
+            old = _factories.pop(os.path.abspath(token_file), None)
+            _factories[os.path.abspath(token_file)] = factory
+        if old is not None:
+            old.close()
+    return factory
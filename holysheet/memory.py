@@ -0,0 +1,264 @@
+"""
+Conversation memory within a token budget.
+
+Chat requests used to carry only the newest message, so a follow-up such as
+"and for March?" reached the model with no idea what came before. Sending
+the whole transcript instead would make every request slower and dearer
+than the last. A ConversationMemory sits next to a chat history (a list of
+{"role", "content"} turns) and decides what each request carries:
+
+- the most recent turns, verbatim, up to budget_tokens
+- a rolling summary of everything older, at most summary_tokens
+
+Once the verbatim turns outgrow the budget, compaction folds the oldest of
+them into the summary (see prompts.build_summary_request; without a model
+the turns are abbreviated instead) and keeps about half the budget
+verbatim, so a compaction happens every few turns rather than on each one.
+The prompt stops growing with the length of the chat.
+
+The exact token usage the provider reports for every request, chat or
+summary, is recorded with the estimated history size that went with it.
+
+    memory = ConversationMemory(budget_tokens=4000)
+    history.append({"role": "user", "content": message})
+    request = prompts.build_request(message, history=memory.window(history, message),
+                                    summary=memory.summary)
+    ...
+    memory.record_usage(completion.usage)
+    memory.compact(history, summarize)
+"""
+
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from holysheet.config import Settings
+from holysheet.context import estimate_tokens
+
+MAX_USAGE_ENTRIES = 50
+# Per turn when summarizing without a model
+EXCERPT_CHARS = 240
+
+USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+Turn = Dict[str, Any]
+
+
+def turn_tokens(turn: Turn) -> int:
+    # A few tokens of role and framing per message
+    return estimate_tokens(str(turn.get("content") or "")) + 4
+
+
+def normalize(turns: List[Turn]) -> List[Turn]:
+    """Turns as alternating user/assistant messages, starting with the user
+
+    Empty turns (a failed stream) are skipped, consecutive turns of one role
+    are joined, and unanswered user turns at the end are left out.
+    """
+    messages: List[Turn] = []
+    for turn in turns:
+        role, content = turn.get("role"), str(turn.get("content") or "").strip()
+        if role not in ("user", "assistant") or not content:
+            continue
+        if not messages and role != "user":
+            continue
+        if messages and messages[-1]["role"] == role:
+            messages[-1]["content"] += "\n\n" + content
+        else:
+            messages.append({"role": role, "content": content})
+    while messages and messages[-1]["role"] == "user":
+        messages.pop()
+    return messages
+
+
+def excerpt_summary(summary: str, turns: List[Turn], budget_tokens: int) -> str:
+    """A summary without a model: each turn abbreviated, newest kept"""
+    lines = [summary] if summary else []
+    for turn in normalize(turns):
+        text = " ".join(turn["content"].split())
+        if len(text) > EXCERPT_CHARS:
+            text = text[: EXCERPT_CHARS - 3] + "..."
+        lines.append(f"{turn['role'].capitalize()}: {text}")
+    text = "\n".join(lines)
+    budget_chars = budget_tokens * 4
+    if len(text) > budget_chars:
+        text = "..." + text[-(budget_chars - 3) :]
+    return text
+
+
+class ConversationMemory:
+    """What of a chat history each request sends, and its token usage"""
+
+    def __init__(self, budget_tokens: int = 4000, summary_tokens: int = 600):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        # Leading history entries already folded into the summary
+        self.summarized = 0
+        self.compactions = 0
+        self.usage: List[Dict[str, Any]] = []
+        self.totals = {field: 0 for field in USAGE_FIELDS}
+        self.requests = 0
+        self._last_window = 0
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "ConversationMemory":
+        return cls(
+            budget_tokens=settings.history_token_budget,
+            summary_tokens=settings.history_summary_tokens,
+        )
+
+    def window(self, history: List[Turn], pending: Optional[str] = None) -> List[Turn]:
+        """Recent turns to send verbatim, within the budget
+
+        pending is the message being answered; when it is already the last
+        turn of history it is left out (it goes last in the request).
+        """
+        turns = history[self.summarized :]
+        if (
+            pending is not None
+            and turns
+            and turns[-1].get("role") == "user"
+            and turns[-1].get("content") == pending
+        ):
+            turns = turns[:-1]
+        messages = normalize(turns)
+        used = 0
+        start = len(messages)
+        while start > 0:
+            cost = turn_tokens(messages[start - 1])
+            if used + cost > self.budget_tokens:
+                break
+            used += cost
+            start -= 1
+        # Whole exchanges only: the window starts with a user turn
+        if start < len(messages) and messages[start]["role"] != "user":
+            used -= turn_tokens(messages[start])
+            start += 1
+        self._last_window = used
+        return messages[start:]
+
+    def _plan(self, history: List[Turn]) -> Optional[Tuple[int, List[Turn]]]:
+        """(new summarized count, turns to fold) or None when within budget"""
+        with self._lock:
+            if self._compacting:
+                return None
+            turns = history[self.summarized :]
+            if sum(turn_tokens(t) for t in turns) <= self.budget_tokens:
+                return None
+            # Keep about half the budget verbatim, cut before a user turn
+            keep, cut = 0, len(turns)
+            for i in range(len(turns) - 1, -1, -1):
+                keep += turn_tokens(turns[i])
+                if keep > self.budget_tokens // 2:
+                    break
+                if turns[i].get("role") == "user":
+                    cut = i
+            if cut == 0:
+                return None
+            self._compacting = True
+            return self.summarized + cut, turns[:cut]
+
+    def _apply(self, summarized: int, summary: str) -> None:
+        with self._lock:
+            self.summary = summary.strip()
+            self.summarized = summarized
+            self.compactions += 1
+            self._compacting = False
+
+    def compact(
+        self, history: List[Turn], summarize: Optional[Callable[..., str]] = None
+    ) -> bool:
+        """Fold the oldest turns into the summary when over budget
+
+        summarize(summary, turns) returns the new summary text; without it,
+        or if it fails, the turns are abbreviated instead.
+        """
+        plan = self._plan(history)
+        if plan is None:
+            return False
+        summarized, turns = plan
+        summary = None
+        try:
+            if summarize is not None:
+                summary = summarize(self.summary, turns)
+        except Exception:
+            summary = None
+        finally:
+            self._apply(
+                summarized,
+                summary or excerpt_summary(self.summary, turns, self.summary_tokens),
+            )
+        return True
+
+    async def compact_async(
+        self,
+        history: List[Turn],
+        summarize: Optional[Callable[..., Awaitable[str]]] = None,
+    ) -> bool:
+        """compact() with an async summarize"""
+        plan = self._plan(history)
+        if plan is None:
+            return False
+        summarized, turns = plan
+        summary = None
+        try:
+            if summarize is not None:
+                summary = await summarize(self.summary, turns)
+        except Exception:
+            summary = None
+        finally:
+            self._apply(
+                summarized,
+                summary or excerpt_summary(self.summary, turns, self.summary_tokens),
+            )
+        return True
+
+    def record_usage(self, usage: Optional[Dict[str, Any]], kind: str = "chat") -> None:
+        """Token usage reported for one request (see prompts.usage_metrics)"""
+        if not usage:
+            return
+        entry = {field: int(usage.get(field) or 0) for field in USAGE_FIELDS}
+        with self._lock:
+            for field, value in entry.items():
+                self.totals[field] += value
+            self.requests += 1
+            entry["kind"] = kind
+            if kind == "chat":
+                entry["history_tokens"] = self._last_window
+            self.usage.append(entry)
+            del self.usage[:-MAX_USAGE_ENTRIES]
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "summary": self.summary,
+            "summarized": self.summarized,
+            "compactions": self.compactions,
+            "usage": self.usage,
+            "totals": self.totals,
+            "requests": self.requests,
+        }
+
+    def restore(self, record: Dict[str, Any]) -> None:
+        self.summary = record.get("summary", "")
+        self.summarized = record.get("summarized", 0)
+        self.compactions = record.get("compactions", 0)
+        self.usage = record.get("usage", [])
+        self.totals.update(record.get("totals", {}))
+        self.requests = record.get("requests", 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "summarized_turns": self.summarized,
+            "summary_tokens": estimate_tokens(self.summary) if self.summary else 0,
+            "compactions": self.compactions,
+            "requests": self.requests,
+            **self.totals,
+            "last": self.usage[-1] if self.usage else None,
+        }
@@ -0,0 +1,196 @@
+"""
+Windowed rows of a loaded sheet for the browser grid.
+
+Sending a whole frame to the browser does not scale past a few thousand
+rows. Instead the grid asks for the rows it is about to show: filtering
+(query-tool where conditions plus a free-text search) and sorting run
+against the cached frame on the server, the resulting row order is kept
+per view, and each request slices a small window out of it.
+
+Windows are encoded column by column: numbers stay numbers, dates become
+ISO strings, and categorical columns send small integer codes plus the
+labels used in that window, so a page of a 500k-row sheet costs the same as
+a page of a 50-row one.
+
+    views = PreviewViews()
+    order = views.order(frame, sort="Amount", descending=True)
+    page = rows_window(frame, order, offset=0, limit=200)
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from holysheet.query_tools import QueryTools, ToolError
+
+MAX_LIMIT = 1000
+
+
+def _searchable(series: pd.Series) -> bool:
+    return (
+        series.dtype == object
+        or isinstance(series.dtype, pd.CategoricalDtype)
+        or pd.api.types.is_string_dtype(series.dtype)
+    )
+
+
+def search_mask(frame: pd.DataFrame, text: str) -> np.ndarray:
+    """Rows where any text column contains text (case-insensitive)"""
+    mask = np.zeros(len(frame), dtype=bool)
+    for name in frame.columns:
+        series = frame[name]
+        if not _searchable(series):
+            continue
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Match each label once, then map through the codes
+            hits = pd.Series(series.cat.categories).astype("string")
+            hits = hits.str.contains(text, case=False, regex=False).to_numpy(bool)
+            codes = series.cat.codes.to_numpy()
+            mask |= (codes >= 0) & hits[np.maximum(codes, 0)]
+        else:
+            found = series.astype("string").str.contains(
+                text, case=False, regex=False, na=False
+            )
+            mask |= found.to_numpy(dtype=bool)
+    return mask
+
+
+def view_order(
+    frame: pd.DataFrame,
+    sort: Optional[str] = None,
+    descending: bool = False,
+    where: Optional[List[Dict[str, Any]]] = None,
+    search: Optional[str] = None,
+) -> np.ndarray:
+    """Row positions of frame after filtering and sorting
+
+    Raises ToolError for unknown columns or malformed conditions.
+    """
+    mask = QueryTools(frame).mask(where)
+    if search:
+        mask &= search_mask(frame, search)
+    positions = np.flatnonzero(mask)
+    if sort is None:
+        return positions
+    if sort not in frame.columns:
+        raise ToolError(f"No column {sort!r} to sort by")
+    values = pd.Series(frame[sort].to_numpy()[positions])
+    ordered = values.sort_values(
+        ascending=not descending, kind="stable", na_position="last"
+    )
+    return positions[ordered.index.to_numpy()]
+
+
+def _encode(series: pd.Series) -> Tuple[str, List[Any], Optional[List[str]]]:
+    """(type, JSON-ready values, labels for categorical codes)"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        used, local = np.unique(codes[codes >= 0], return_inverse=True)
+        values = np.full(len(codes), -1)
+        values[codes >= 0] = local
+        labels = [str(series.cat.categories[c]) for c in used]
+        return "category", [None if v < 0 else int(v) for v in values], labels
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return "bool", [None if pd.isna(v) else bool(v) for v in series], None
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        dates = series.dt.tz_localize(None) if series.dt.tz is not None else series
+        whole_days = bool((dates.dropna() == dates.dropna().dt.normalize()).all())
+        text = dates.dt.strftime("%Y-%m-%d" if whole_days else "%Y-%m-%d %H:%M:%S")
+        return "date", [None if pd.isna(v) else v for v in text], None
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        numbers = series.astype("float64").to_numpy()
+        whole = pd.api.types.is_integer_dtype(series.dtype)
+        return (
+            "number",
+            [None if np.isnan(v) else (int(v) if whole else float(v)) for v in numbers],
+            None,
+        )
+    return "text", [None if pd.isna(v) else str(v) for v in series], None
+
+
+def rows_window(
+    frame: pd.DataFrame,
+    order: np.ndarray,
+    offset: int = 0,
+    limit: int = 200,
+    first_row: int = 2,
+) -> Dict[str, Any]:
+    """One window of the view as column arrays plus sheet row numbers"""
+    offset = max(int(offset), 0)
+    limit = min(max(int(limit), 0), MAX_LIMIT)
+    positions = order[offset : offset + limit]
+    window = frame.iloc[positions]
+    columns, data, labels = [], [], {}
+    for i, name in enumerate(frame.columns):
+        kind, values, used = _encode(window.iloc[:, i])
+        columns.append({"name": str(name), "type": kind})
+        data.append(values)
+        if used is not None:
+            labels[str(i)] = used
+    return {
+        "total": int(len(order)),
+        "rows_in_sheet": int(len(frame)),
+        "offset": offset,
+        "rows": (positions + first_row).tolist(),
+        "columns": columns,
+        "data": data,
+        "labels": labels,
+    }
+
+
+def window_frame(
+    frame: pd.DataFrame, order: np.ndarray, offset: int, limit: int, first_row: int = 2
+) -> pd.DataFrame:
+    """The same window as a small DataFrame with a leading sheet row column"""
+    positions = order[max(int(offset), 0) : max(int(offset), 0) + int(limit)]
+    window = frame.iloc[positions].reset_index(drop=True)
+    window.insert(0, "Sheet row", positions + first_row)
+    return window
+
+
+class PreviewViews:
+    """Row orders of the last few views (filter + sort) of each frame
+
+    Scrolling asks for many windows of the same view, so the filter and
+    sort run once per view rather than once per window.
+    """
+
+    def __init__(self, max_views: int = 8):
+        self.max_views = max_views
+        # view key -> (frame, row order)
+        self._views: "OrderedDict[Tuple[Any, ...], Tuple[Any, np.ndarray]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def order(
+        self,
+        frame: pd.DataFrame,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        where: Optional[List[Dict[str, Any]]] = None,
+        search: Optional[str] = None,
+    ) -> np.ndarray:
+        key = (
+            id(frame),
+            sort,
+            bool(descending),
+            json.dumps(where, sort_keys=True, default=str),
+            search or "",
+        )
+        with self._lock:
+            cached = self._views.get(key)
+            # The frame is held with the order so a recycled id can't match
+            if cached is not None and cached[0] is frame:
+                self._views.move_to_end(key)
+                return cached[1]
+        order = view_order(frame, sort, descending, where, search)
+        with self._lock:
+            self._views[key] = (frame, order)
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        return order
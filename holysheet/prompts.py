@@ -0,0 +1,176 @@
+"""
+Prompt assembly with Anthropic prompt caching.
+
+The parts of a request that stay the same across chat turns (instructions
+and the sheet description) go into system blocks ahead of the conversation,
+with a cache_control breakpoint on the last stable block. Follow-up
+questions about the same sheet then read that prefix from the cache instead
+of paying for it again as fresh input tokens.
+
+Earlier turns of the conversation (see holysheet.memory) follow the system
+blocks: a rolling summary of the oldest ones as a last system block, then
+the recent ones verbatim with a second breakpoint on the last of them, so
+the next turn reads the conversation so far from the cache as well.
+"""
+
+from typing import Any, Dict, List, Optional
+
+ANALYST_INSTRUCTIONS = (
+    "You are HolySheet, an assistant for analyzing Google Sheets financial data. "
+    "Please provide specific, actionable advice about the user's data. Include "
+    "exact formulas, cell ranges, or step-by-step instructions where helpful."
+)
+
+EPHEMERAL = {"type": "ephemeral"}
+
+# Quick action buttons: key -> (button label, prompt)
+QUICK_ACTIONS = {
+    "analyze": (
+        "📊 Analyze Data",
+        "Analyze this financial data. What patterns, trends, or insights do you see?",
+    ),
+    "clean": (
+        "🧹 Clean Data",
+        "Help me clean up this data. Identify duplicates, formatting issues, "
+        "missing values, or inconsistencies.",
+    ),
+    "trends": (
+        "📈 Find Trends",
+        "What financial trends can you identify in this data over time? "
+        "Any concerning patterns or opportunities?",
+    ),
+    "formulas": (
+        "🔧 Suggest Formulas",
+        "Suggest useful Excel/Google Sheets formulas for this financial data. "
+        "Include specific cell references.",
+    ),
+}
+
+
+def analysis_report(answers: Dict[str, str], sheet_name: str = "") -> str:
+    """Quick action answers as one Markdown report, in button order"""
+    title = f"# Analysis of {sheet_name}" if sheet_name else "# Sheet analysis"
+    sections = [title]
+    for action, (label, _) in QUICK_ACTIONS.items():
+        if action in answers:
+            sections.append(f"## {label}\n\n{answers[action].strip()}")
+    return "\n\n".join(sections)
+
+
+def sheet_block_text(sheet_context: str, sheet_name: str = "") -> str:
+    return f'Sheet: "{sheet_name}"\n\n{sheet_context}'
+
+
+def build_system(
+    instructions: str = ANALYST_INSTRUCTIONS,
+    sheet_context: Optional[str] = None,
+    sheet_name: str = "",
+) -> List[Dict[str, Any]]:
+    """System blocks with a cache breakpoint after the stable prefix"""
+    blocks: List[Dict[str, Any]] = [{"type": "text", "text": instructions}]
+    if sheet_context is not None:
+        blocks.append(
+            {"type": "text", "text": sheet_block_text(sheet_context, sheet_name)}
+        )
+    blocks[-1]["cache_control"] = EPHEMERAL
+    return blocks
+
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and a "
+    "spreadsheet analysis assistant. Merge the earlier summary and the new turns "
+    "into one concise summary that keeps what later questions may refer to: the "
+    "user's goals, sheets and columns discussed, figures and conclusions reached, "
+    "formulas given and open questions. Reply with the summary only."
+)
+
+
+def summary_block_text(summary: str) -> str:
+    return f"Summary of the earlier conversation:\n{summary}"
+
+
+def with_findings(message: str, findings: str) -> str:
+    """Prefix a request with results computed locally over the whole sheet"""
+    return (
+        "These results were computed over every row of the sheet. Explain them "
+        "and base your answer on them rather than on the sample rows.\n\n"
+        f"{findings}\n\n{message}"
+    )
+
+
+def build_request(
+    message: str,
+    sheet_context: Optional[str] = None,
+    sheet_name: str = "",
+    instructions: str = ANALYST_INSTRUCTIONS,
+    findings: Optional[str] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+    summary: Optional[str] = None,
+) -> Dict[str, Any]:
+    """system= and messages= arguments for messages.create / messages.stream
+
+    findings (see holysheet.analytics) go with the message, after the
+    cached prefix. history is earlier turns (alternating, starting with the
+    user) and summary the digest of turns older than those.
+    """
+    if findings:
+        message = with_findings(message, findings)
+    system = build_system(instructions, sheet_context, sheet_name)
+    if summary:
+        system.append({"type": "text", "text": summary_block_text(summary)})
+    messages = [dict(turn) for turn in history or []]
+    if messages:
+        last = messages[-1]
+        last["content"] = [
+            {"type": "text", "text": last["content"], "cache_control": EPHEMERAL}
+        ]
+    messages.append({"role": "user", "content": message})
+    return {"system": system, "messages": messages}
+
+
+def build_summary_request(
+    summary: str, turns: List[Dict[str, Any]], max_tokens: int = 600
+) -> Dict[str, Any]:
+    """Request folding turns into the running summary"""
+    transcript = "\n\n".join(
+        f"{turn['role'].capitalize()}: {turn['content']}"
+        for turn in turns
+        if turn.get("content")
+    )
+    text = (
+        f"Earlier summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}\n\n"
+        f"Write the updated summary in at most about {max_tokens} tokens."
+    )
+    return {
+        "system": [{"type": "text", "text": SUMMARY_INSTRUCTIONS}],
+        "messages": [{"role": "user", "content": text}],
+    }
+
+
+def usage_metrics(usage) -> Dict[str, Any]:
+    """Token usage of one response, including prompt cache writes and reads"""
+    input_tokens = getattr(usage, "input_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", 0) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    prompt_total = input_tokens + cache_write + cache_read
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cache_creation_input_tokens": cache_write,
+        "cache_read_input_tokens": cache_read,
+        "cache_hit": cache_read > 0,
+        "cache_read_ratio": (
+            round(cache_read / prompt_total, 3) if prompt_total else 0.0
+        ),
+    }
+
+
+def describe_usage(metrics: Dict[str, Any]) -> str:
+    """Short human-readable usage line for the UIs"""
+    text = f"{metrics['input_tokens']:,} in / {metrics['output_tokens']:,} out tokens"
+    if metrics["cache_read_input_tokens"]:
+        text += f", {metrics['cache_read_input_tokens']:,} read from cache"
+    if metrics["cache_creation_input_tokens"]:
+        text += f", {metrics['cache_creation_input_tokens']:,} written to cache"
+    return text
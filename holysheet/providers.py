@@ -0,0 +1,605 @@
+"""
+Language model providers and request routing.
+
+Requests are built once with prompts.build_request (Anthropic messages
+format) and can be answered by:
+
+- AnthropicProvider: a sync or async anthropic client, paced and retried
+  through rate_limit like every other outbound API
+- OpenAICompatibleProvider: any server speaking the OpenAI chat completions
+  API, e.g. LM Studio on localhost:1234 (see scripts/test_lmstudio.py)
+
+ProviderRouter picks the order to try them in. With HOLYSHEET_LLM_PROVIDER
+set to "auto", quick actions and small sheets go to the local model first
+and skip the remote round trip; everything else goes to Anthropic first.
+Whichever provider is not first is the fallback. A provider that fails with
+a connection error or overload is skipped for a short cooldown so later
+requests don't wait on it again.
+
+Given a holysheet.query_tools.QueryTools, AnthropicProvider offers the
+model local query tools: each tool_use reply is answered with the tool
+results and sent back, for at most tools.max_steps rounds. Providers
+without tool support answer from the sheet context alone.
+
+    router = ProviderRouter.from_settings(settings)
+    providers = router.route(AnthropicProvider(client, settings.claude_model),
+                             quick=True, rows=len(frame))
+    completion = await router.complete(request, providers, user=session_id)
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from holysheet import prompts, rate_limit
+from holysheet.query_tools import TOOL_INSTRUCTIONS, tool_result_block
+
+PROVIDER_MODES = ("anthropic", "local", "auto")
+
+
+class ProviderError(Exception):
+    """No provider could answer a request"""
+
+
+class ProviderUnavailable(ConnectionError):
+    """A provider could not be reached (treated like a dropped connection)"""
+
+
+@dataclass
+class Completion:
+    text: str
+    provider: str
+    model: str
+    stop_reason: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    tool_calls: Optional[List[Dict[str, Any]]] = None
+
+
+def quota_project(client) -> str:
+    """Anthropic quotas are per API key; bucket by a digest, never the key"""
+    api_key = getattr(client, "api_key", None) or ""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+_USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+LAST_STEP_NOTE = (
+    "That was the last tool call allowed for this question. Answer now with "
+    "the results you have."
+)
+
+
+def _total_usage(messages) -> Optional[SimpleNamespace]:
+    """Token usage summed over every round of a tool loop"""
+    usages = [m.usage for m in messages if getattr(m, "usage", None) is not None]
+    if not usages:
+        return None
+    return SimpleNamespace(
+        **{f: sum(getattr(u, f, 0) or 0 for u in usages) for f in _USAGE_FIELDS}
+    )
+
+
+def _tool_uses(message) -> List[Any]:
+    return [b for b in message.content if getattr(b, "type", None) == "tool_use"]
+
+
+def _run_tools(tools, uses) -> List[Tuple[str, bool]]:
+    return [tools.run(use.name, use.input) for use in uses]
+
+
+def _continue(request, message, uses, results, last: bool) -> Dict[str, Any]:
+    """request plus the assistant's tool calls and their results"""
+    assistant = []
+    for block in message.content:
+        if block.type == "text":
+            assistant.append({"type": "text", "text": block.text})
+        elif block.type == "tool_use":
+            assistant.append(
+                {
+                    "type": "tool_use",
+                    "id": block.id,
+                    "name": block.name,
+                    "input": block.input,
+                }
+            )
+    answers: List[Dict[str, Any]] = [
+        tool_result_block(use.id, text, is_error)
+        for use, (text, is_error) in zip(uses, results)
+    ]
+    if last:
+        answers.append({"type": "text", "text": LAST_STEP_NOTE})
+    return {
+        **request,
+        "messages": request["messages"]
+        + [
+            {"role": "assistant", "content": assistant},
+            {"role": "user", "content": answers},
+        ],
+    }
+
+
+class AnthropicProvider:
+    """Messages API through an anthropic.Anthropic or AsyncAnthropic client
+
+    complete_sync needs a sync client; complete and stream an async one.
+    """
+
+    name = "anthropic"
+    supports_tools = True
+
+    def __init__(self, client, model: str, max_tokens: int = 2000):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.project = quota_project(client)
+
+    def _create(self, request: Dict[str, Any]):
+        return self.client.messages.create(
+            model=self.model, max_tokens=self.max_tokens, **request
+        )
+
+    def _with_tools(self, request: Dict[str, Any], tools) -> Dict[str, Any]:
+        if tools is None:
+            return request
+        # Part of the instructions block, so still inside the cached prefix
+        system = [dict(block) for block in request.get("system") or []]
+        if system:
+            system[0]["text"] = f"{system[0]['text']}\n\n{TOOL_INSTRUCTIONS}"
+        return {**request, "system": system, "tools": tools.specs}
+
+    def _completion(
+        self, replies, text: Optional[str] = None, tools=None
+    ) -> Completion:
+        message = replies[-1]
+        if text is None:
+            text = "".join(b.text for b in message.content if b.type == "text")
+        usage = _total_usage(replies)
+        return Completion(
+            text=text,
+            provider=self.name,
+            model=self.model,
+            stop_reason=getattr(message, "stop_reason", None),
+            usage=prompts.usage_metrics(usage) if usage is not None else None,
+            tool_calls=[c.to_dict() for c in tools.calls] if tools else None,
+        )
+
+    def _done(self, message, replies, tools) -> bool:
+        return (
+            tools is None or not _tool_uses(message) or len(replies) > tools.max_steps
+        )
+
+    def complete_sync(
+        self, request: Dict[str, Any], user=None, tools=None
+    ) -> Completion:
+        request = self._with_tools(request, tools)
+        replies = []
+        while True:
+            message = rate_limit.call(
+                "anthropic",
+                lambda: self._create(request),
+                user=user,
+                project=self.project,
+            )
+            replies.append(message)
+            if self._done(message, replies, tools):
+                return self._completion(replies, tools=tools)
+            uses = _tool_uses(message)
+            results = _run_tools(tools, uses)
+            last = len(replies) == tools.max_steps
+            request = _continue(request, message, uses, results, last)
+
+    async def complete(
+        self, request: Dict[str, Any], user=None, tools=None
+    ) -> Completion:
+        request = self._with_tools(request, tools)
+        replies = []
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await rate_limit.call_async(
+                "anthropic",
+                lambda: self._create(request),
+                user=user,
+                project=self.project,
+            )
+            replies.append(message)
+            if self._done(message, replies, tools):
+                return self._completion(replies, tools=tools)
+            uses = _tool_uses(message)
+            # pandas over the whole sheet; keep it off the event loop
+            results = await loop.run_in_executor(None, _run_tools, tools, uses)
+            last = len(replies) == tools.max_steps
+            request = _continue(request, message, uses, results, last)
+
+    async def stream(
+        self, request: Dict[str, Any], user=None, tools=None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """("delta", text)..., ("tool", ToolCall dict) between rounds, ("end", ...)"""
+        request = self._with_tools(request, tools)
+        parts: List[str] = []
+        replies = []
+        loop = asyncio.get_running_loop()
+        while True:
+            fresh = True
+            async with AsyncExitStack() as stack:
+                # Rate limited and retried until the stream opens; once text
+                # has been sent an error ends the reply instead
+                async def open_stream():
+                    return await stack.enter_async_context(
+                        self.client.messages.stream(
+                            model=self.model, max_tokens=self.max_tokens, **request
+                        )
+                    )
+
+                stream = await rate_limit.call_async(
+                    "anthropic", open_stream, user=user, project=self.project
+                )
+                async for text in stream.text_stream:
+                    if fresh and parts:
+                        # Text of a new round after a tool call
+                        parts.append("\n\n")
+                        yield "delta", "\n\n"
+                    fresh = False
+                    parts.append(text)
+                    yield "delta", text
+                final = await stream.get_final_message()
+            replies.append(final)
+            if self._done(final, replies, tools):
+                break
+            uses = _tool_uses(final)
+            results = await loop.run_in_executor(None, _run_tools, tools, uses)
+            for call in tools.calls[-len(uses) :]:
+                yield "tool", call.to_dict()
+            last = len(replies) == tools.max_steps
+            request = _continue(request, final, uses, results, last)
+        yield "end", self._completion(replies, "".join(parts), tools)
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content)
+
+
+def to_openai_messages(request: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Anthropic system blocks + messages as chat completions messages"""
+    messages = []
+    system = request.get("system")
+    if system:
+        if not isinstance(system, str):
+            # Separate blocks (instructions, sheet, summary) stay apart
+            system = "\n\n".join(_text([block]) for block in system)
+        messages.append({"role": "system", "content": system})
+    for message in request.get("messages", []):
+        messages.append({"role": message["role"], "content": _text(message["content"])})
+    return messages
+
+
+def _openai_usage(usage: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not usage:
+        return None
+    return prompts.usage_metrics(
+        SimpleNamespace(
+            input_tokens=usage.get("prompt_tokens", 0),
+            output_tokens=usage.get("completion_tokens", 0),
+        )
+    )
+
+
+class OpenAICompatibleProvider:
+    """Chat completions against a local (or any) OpenAI-compatible server"""
+
+    name = "local"
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:1234/v1",
+        model: str = "local-model",
+        max_tokens: int = 2000,
+        api_key: str = "",
+        timeout: float = 60.0,
+        transport=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self._headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._transport = transport  # httpx transport override (tests)
+        self._client = None
+        self._async_client = None
+        self._async_loop = None
+        self._lock = threading.Lock()
+
+    def _body(self, request: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": to_openai_messages(request),
+            "max_tokens": self.max_tokens,
+            "stream": stream,
+        }
+
+    def _sync_client(self):
+        import httpx
+
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    base_url=self.base_url,
+                    headers=self._headers,
+                    timeout=self.timeout,
+                    transport=self._transport,
+                )
+            return self._client
+
+    def _loop_client(self):
+        import httpx
+
+        # httpx.AsyncClient is tied to the loop it first ran on
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self._headers,
+                timeout=self.timeout,
+                transport=self._transport,
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    def _completion(self, data: Dict[str, Any]) -> Completion:
+        choice = data["choices"][0]
+        return Completion(
+            text=choice["message"].get("content") or "",
+            provider=self.name,
+            model=self.model,
+            stop_reason=choice.get("finish_reason"),
+            usage=_openai_usage(data.get("usage")),
+        )
+
+    def complete_sync(self, request: Dict[str, Any], user=None) -> Completion:
+        import httpx
+
+        try:
+            response = self._sync_client().post(
+                "/chat/completions", json=self._body(request)
+            )
+        except httpx.TransportError as e:
+            raise ProviderUnavailable(f"{self.base_url}: {e}") from e
+        response.raise_for_status()
+        return self._completion(response.json())
+
+    async def complete(self, request: Dict[str, Any], user=None) -> Completion:
+        import httpx
+
+        try:
+            response = await self._loop_client().post(
+                "/chat/completions", json=self._body(request)
+            )
+        except httpx.TransportError as e:
+            raise ProviderUnavailable(f"{self.base_url}: {e}") from e
+        response.raise_for_status()
+        return self._completion(response.json())
+
+    async def stream(
+        self, request: Dict[str, Any], user=None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        import httpx
+
+        parts = []
+        stop_reason, usage = None, None
+        try:
+            async with self._loop_client().stream(
+                "POST", "/chat/completions", json=self._body(request, stream=True)
+            ) as response:
+                response.raise_for_status()
+                # Server-sent events: "data: {chunk}" lines, then "data: [DONE]"
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:") :].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices", []):
+                        stop_reason = choice.get("finish_reason") or stop_reason
+                        text = (choice.get("delta") or {}).get("content")
+                        if text:
+                            parts.append(text)
+                            yield "delta", text
+        except httpx.TransportError as e:
+            raise ProviderUnavailable(f"{self.base_url}: {e}") from e
+        yield "end", Completion(
+            "".join(parts), self.name, self.model, stop_reason, _openai_usage(usage)
+        )
+
+
+class ProviderRouter:
+    """Orders providers per request and falls back when one fails"""
+
+    def __init__(
+        self,
+        mode: str = "anthropic",
+        local=None,
+        local_max_rows: int = 2000,
+        cooldown: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if mode not in PROVIDER_MODES:
+            raise ValueError(
+                f"Unknown LLM provider {mode!r}; use one of {', '.join(PROVIDER_MODES)}"
+            )
+        self.mode = mode
+        self.local = local
+        self.local_max_rows = local_max_rows
+        self.cooldown = cooldown
+        self._clock = clock
+        self._down_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self.fallbacks = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "ProviderRouter":
+        local = None
+        if settings.llm_provider != "anthropic":
+            local = OpenAICompatibleProvider(
+                base_url=settings.local_llm_url,
+                model=settings.local_llm_model,
+                max_tokens=settings.max_tokens,
+                api_key=settings.local_llm_api_key,
+                timeout=settings.local_llm_timeout,
+            )
+        return cls(
+            settings.llm_provider,
+            local=local,
+            local_max_rows=settings.local_llm_max_rows,
+            cooldown=settings.llm_failure_cooldown,
+        )
+
+    def prefers_local(self, quick: bool = False, rows: Optional[int] = None) -> bool:
+        if self.mode == "local":
+            return True
+        if self.mode == "auto":
+            return quick or (rows is not None and rows <= self.local_max_rows)
+        return False
+
+    def route(
+        self, anthropic=None, quick: bool = False, rows: Optional[int] = None
+    ) -> List[Any]:
+        """Providers to try in order; the first is preferred, the rest fall back"""
+        order = [anthropic, self.local]
+        if self.prefers_local(quick, rows):
+            order.reverse()
+        return [p for p in order if p is not None]
+
+    def _available(self, providers: List[Any]) -> List[Any]:
+        if not providers:
+            raise ProviderError(
+                "No language model is configured; set ANTHROPIC_API_KEY, send "
+                "your API key first or set HOLYSHEET_LLM_PROVIDER=local"
+            )
+        now = self._clock()
+        with self._lock:
+            healthy = [p for p in providers if self._down_until.get(p.name, 0) <= now]
+            cooling = [p for p in providers if p not in healthy]
+        # Still worth a try when every provider is cooling down
+        return healthy + cooling
+
+    def _attempt(self, provider, index: int) -> None:
+        with self._lock:
+            self.requests[provider.name] = self.requests.get(provider.name, 0) + 1
+            if index:
+                self.fallbacks += 1
+
+    @staticmethod
+    def _tools_for(provider, tools) -> Dict[str, Any]:
+        if tools is None or not getattr(provider, "supports_tools", False):
+            return {}
+        return {"tools": tools}
+
+    def _failed(self, provider, exc: Exception) -> None:
+        retryable, _, _ = rate_limit.classify_error(exc)
+        with self._lock:
+            self.failures[provider.name] = self.failures.get(provider.name, 0) + 1
+            if retryable:
+                # Down or overloaded; bad requests don't bench the provider
+                self._down_until[provider.name] = self._clock() + self.cooldown
+
+    def _no_answer(self, errors: List[Tuple[str, Exception]]) -> ProviderError:
+        detail = "; ".join(f"{name}: {exc}" for name, exc in errors)
+        return ProviderError(detail)
+
+    def complete_sync(
+        self, request: Dict[str, Any], providers: List[Any], user=None, tools=None
+    ) -> Completion:
+        errors = []
+        for index, provider in enumerate(self._available(providers)):
+            self._attempt(provider, index)
+            try:
+                return provider.complete_sync(
+                    request, user=user, **self._tools_for(provider, tools)
+                )
+            except Exception as e:
+                self._failed(provider, e)
+                errors.append((provider.name, e))
+        if len(errors) == 1:
+            raise errors[0][1]
+        raise self._no_answer(errors)
+
+    async def complete(
+        self, request: Dict[str, Any], providers: List[Any], user=None, tools=None
+    ) -> Completion:
+        errors = []
+        for index, provider in enumerate(self._available(providers)):
+            self._attempt(provider, index)
+            try:
+                return await provider.complete(
+                    request, user=user, **self._tools_for(provider, tools)
+                )
+            except Exception as e:
+                self._failed(provider, e)
+                errors.append((provider.name, e))
+        if len(errors) == 1:
+            raise errors[0][1]
+        raise self._no_answer(errors)
+
+    async def stream(
+        self, request: Dict[str, Any], providers: List[Any], user=None, tools=None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """("open", provider), ("delta", text) / ("tool", call)..., ("end", Completion)
+
+        Falls back only until the first event; a reply that has started
+        streaming is never restarted on another model.
+        """
+        errors = []
+        for index, provider in enumerate(self._available(providers)):
+            self._attempt(provider, index)
+            opened = False
+            kwargs = self._tools_for(provider, tools)
+            try:
+                async for event, payload in provider.stream(
+                    request, user=user, **kwargs
+                ):
+                    if not opened:
+                        opened = True
+                        yield "open", provider
+                    yield event, payload
+                return
+            except Exception as e:
+                self._failed(provider, e)
+                if opened:
+                    raise
+                errors.append((provider.name, e))
+        if len(errors) == 1:
+            raise errors[0][1]
+        raise self._no_answer(errors)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            names = set(self.requests) | set(self.failures)
+            return {
+                "mode": self.mode,
+                "fallbacks": self.fallbacks,
+                "providers": {
+                    name: {
+                        "requests": self.requests.get(name, 0),
+                        "failures": self.failures.get(name, 0),
+                        "cooling_down": self._down_until.get(name, 0) > now,
+                    }
+                    for name in sorted(names)
+                },
+            }
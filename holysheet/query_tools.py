@@ -0,0 +1,608 @@
+"""
+Local query tools the model calls instead of reading pasted rows.
+
+The sheet context only carries a sample, so a question like "total spend by
+category in 2022" used to be answered from whichever 50 rows made it into
+the prompt. With tool use the model asks for the computation instead:
+
+    aggregate(where=[{"column": "Date", "op": "between",
+                      "value": ["2022-01-01", "2022-12-31"]}],
+              group_by=["Category"], metrics=[{"column": "Amount", "agg": "sum"}])
+
+QueryTools runs it with pandas over every row of the session's frame and
+returns only the result, capped to max_rows rows and max_chars characters.
+Each call is recorded as a ToolCall with its timing. The loop that sends
+results back to the model lives in holysheet.providers and stops after
+max_steps rounds of tool calls.
+
+With several tables loaded (say the 2021 and 2022 tabs of a workbook) every
+tool takes a table name, aggregate and pivot can stack tables (with a
+"table" column to group by) and join merges two tables on shared columns.
+"""
+
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from holysheet.column_types import format_value
+
+OPS = (
+    "==",
+    "!=",
+    ">",
+    ">=",
+    "<",
+    "<=",
+    "contains",
+    "in",
+    "between",
+    "empty",
+    "not_empty",
+)
+AGGS = ("sum", "mean", "median", "min", "max", "count", "nunique")
+JOINS = ("inner", "left", "right", "outer")
+PERIODS = {"day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+
+TOOL_INSTRUCTIONS = (
+    "The sheet description only shows a sample of the rows. Use the query tools "
+    "to filter, aggregate, rank and pivot the full sheet whenever the answer "
+    "depends on more than the sample, and base numbers on their results."
+)
+
+
+class ToolError(ValueError):
+    """A tool call the frame can't answer (unknown column, bad operator...)"""
+
+
+@dataclass
+class ToolCall:
+    """One executed tool call, for logs and the UI"""
+
+    name: str
+    input: Dict[str, Any]
+    ms: float
+    rows: int = 0  # rows in the full result, before the row cap
+    chars: int = 0  # characters sent back to the model
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _where_schema(columns: List[str]) -> Dict[str, Any]:
+    return {
+        "type": "array",
+        "description": "Conditions every returned row must meet (AND)",
+        "items": {
+            "type": "object",
+            "properties": {
+                "column": {"type": "string", "enum": columns},
+                "op": {"type": "string", "enum": list(OPS)},
+                "value": {
+                    "description": "Compared value; a list for in, [low, high] "
+                    "(inclusive) for between, unused for empty/not_empty. "
+                    "Dates as YYYY-MM-DD."
+                },
+            },
+            "required": ["column", "op"],
+        },
+    }
+
+
+def tool_specs(
+    columns: List[str], tables: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """Anthropic tool definitions, with the frame's column names as enums
+
+    Given more than one table name, every tool also takes a table.
+    """
+    where = _where_schema(columns)
+    column = {"type": "string", "enum": columns}
+    specs = [
+        {
+            "name": "describe",
+            "description": "Row count, type, empty cells and summary statistics "
+            "of columns (all columns when none are given).",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "columns": {"type": "array", "items": column},
+                    "where": where,
+                },
+            },
+        },
+        {
+            "name": "filter_rows",
+            "description": "Rows matching the conditions, with their sheet row "
+            "numbers. Use aggregate instead when only totals are needed.",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "where": where,
+                    "columns": {"type": "array", "items": column},
+                    "limit": {"type": "integer", "minimum": 1},
+                },
+            },
+        },
+        {
+            "name": "aggregate",
+            "description": "Group rows and compute sums, means, counts etc. per "
+            "group. Date columns in group_by are grouped by period.",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "where": where,
+                    "group_by": {"type": "array", "items": column},
+                    "period": {"type": "string", "enum": list(PERIODS)},
+                    "metrics": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "column": column,
+                                "agg": {"type": "string", "enum": list(AGGS)},
+                            },
+                            "required": ["column", "agg"],
+                        },
+                        "description": "Defaults to a row count",
+                    },
+                    "sort_by": {
+                        "type": "string",
+                        "description": "Output column to sort by, descending",
+                    },
+                },
+            },
+        },
+        {
+            "name": "top_k",
+            "description": "The k rows with the largest (or smallest) values in "
+            "a column, with their sheet row numbers.",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "column": column,
+                    "k": {"type": "integer", "minimum": 1},
+                    "smallest": {"type": "boolean"},
+                    "where": where,
+                    "columns": {"type": "array", "items": column},
+                },
+                "required": ["column"],
+            },
+        },
+        {
+            "name": "pivot",
+            "description": "Cross-tabulate: one row per index value, one column "
+            "per columns value, cells aggregated from values.",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "index": column,
+                    "columns": column,
+                    "values": column,
+                    "agg": {"type": "string", "enum": list(AGGS)},
+                    "period": {"type": "string", "enum": list(PERIODS)},
+                    "where": where,
+                },
+                "required": ["index", "columns"],
+            },
+        },
+    ]
+    if not tables or len(tables) < 2:
+        return specs
+    table = {
+        "type": "string",
+        "enum": tables,
+        "description": "Defaults to the active sheet",
+    }
+    stacked = {
+        "type": "array",
+        "items": {"type": "string", "enum": tables},
+        "description": "Stack these tables, with a table column to group by",
+    }
+    for spec in specs:
+        properties = spec["input_schema"]["properties"]
+        properties["table"] = table
+        if spec["name"] in ("aggregate", "pivot"):
+            properties["tables"] = stacked
+    specs.append(
+        {
+            "name": "join",
+            "description": "Rows of two tables merged on shared columns.",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "left": table,
+                    "right": table,
+                    "on": {"type": "array", "items": column},
+                    "how": {"type": "string", "enum": list(JOINS)},
+                    "columns": {"type": "array", "items": {"type": "string"}},
+                    "limit": {"type": "integer", "minimum": 1},
+                },
+                "required": ["left", "right", "on"],
+            },
+        }
+    )
+    return specs
+
+
+def _is_date(series: pd.Series) -> bool:
+    return pd.api.types.is_datetime64_any_dtype(series)
+
+
+class QueryTools:
+    """Pandas implementations of the tools over one frame (and named tables)
+
+    frame is the active sheet; tables maps names to every loaded frame,
+    the active one included, for the table, tables and join arguments.
+    """
+
+    def __init__(
+        self,
+        frame: pd.DataFrame,
+        max_steps: int = 6,
+        max_rows: int = 50,
+        max_chars: int = 4000,
+        first_row: int = 2,
+        tables: Optional[Dict[str, pd.DataFrame]] = None,
+    ):
+        self.frame = frame
+        self.max_steps = max_steps
+        self.max_rows = max_rows
+        self.max_chars = max_chars
+        self.first_row = first_row
+        self.tables = dict(tables or {})
+        self.calls: List[ToolCall] = []
+        self._columns = {str(c): c for c in frame.columns}
+        for table in self.tables.values():
+            for c in table.columns:
+                self._columns.setdefault(str(c), c)
+        if len(self.tables) > 1:
+            self._columns.setdefault("table", "table")
+
+    @classmethod
+    def from_settings(
+        cls,
+        frame: pd.DataFrame,
+        settings,
+        first_row: int = 2,
+        tables: Optional[Dict[str, pd.DataFrame]] = None,
+    ) -> "QueryTools":
+        return cls(
+            frame,
+            max_steps=settings.query_tool_max_steps,
+            max_rows=settings.query_tool_max_rows,
+            max_chars=settings.query_tool_max_chars,
+            first_row=first_row,
+            tables=tables,
+        )
+
+    @property
+    def specs(self) -> List[Dict[str, Any]]:
+        return tool_specs(list(self._columns), list(self.tables))
+
+    def run(self, name: str, args: Dict[str, Any]) -> Tuple[str, bool]:
+        """(result text, is_error) for one tool call; never raises"""
+        handler = getattr(self, f"_tool_{name}", None)
+        started = time.perf_counter()
+        rows, error = 0, None
+        try:
+            if handler is None:
+                raise ToolError(f"Unknown tool {name!r}")
+            result = handler(**(args or {}))
+            rows = len(result)
+            text = self._render(result)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            text = f"Error: {error}"
+        self.calls.append(
+            ToolCall(
+                name=name,
+                input=args or {},
+                ms=round((time.perf_counter() - started) * 1000, 1),
+                rows=rows,
+                chars=len(text),
+                error=error,
+            )
+        )
+        return text, error is not None
+
+    # Helpers
+
+    def _column(self, name: Any) -> Any:
+        try:
+            return self._columns[str(name)]
+        except KeyError:
+            raise ToolError(
+                f"No column {name!r}; columns are {', '.join(self._columns)}"
+            ) from None
+
+    def _value(self, series: pd.Series, value: Any) -> Any:
+        if _is_date(series):
+            try:
+                return pd.Timestamp(value)
+            except (TypeError, ValueError):
+                raise ToolError(f"{value!r} is not a date") from None
+        if pd.api.types.is_numeric_dtype(series) and isinstance(value, str):
+            try:
+                return float(value.replace(",", ""))
+            except ValueError:
+                raise ToolError(f"{value!r} is not a number") from None
+        return value
+
+    def _table(self, table=None, tables=None) -> pd.DataFrame:
+        """The named table, several stacked, or the active sheet"""
+        for name in ([table] if table else []) + list(tables or []):
+            if name not in self.tables:
+                raise ToolError(
+                    f"No table {name!r}; tables are {', '.join(self.tables)}"
+                )
+        if tables:
+            # Only aggregate and pivot stack tables, so row numbers don't matter
+            return pd.concat(
+                [self.tables[name].assign(table=name) for name in tables],
+                ignore_index=True,
+            )
+        return self.tables[table] if table else self.frame
+
+    def _mask(self, frame: pd.DataFrame, condition: Dict[str, Any]) -> pd.Series:
+        column = self._column(condition.get("column"))
+        if column not in frame.columns:
+            raise ToolError(f"This table has no column {column!r}")
+        series = frame[column]
+        op = condition.get("op")
+        value = condition.get("value")
+        if op == "empty":
+            return series.isna()
+        if op == "not_empty":
+            return series.notna()
+        if op == "contains":
+            return series.astype("string").str.contains(
+                str(value), case=False, regex=False, na=False
+            )
+        if op == "in":
+            values = value if isinstance(value, list) else [value]
+            return series.isin([self._value(series, v) for v in values])
+        if op == "between":
+            if not isinstance(value, list) or len(value) != 2:
+                raise ToolError("between needs [low, high]")
+            low, high = (self._value(series, v) for v in value)
+            if _is_date(series) and high == high.normalize():
+                # A date as the upper bound means the whole day
+                return (series >= low) & (series < high + pd.Timedelta(days=1))
+            return (series >= low) & (series <= high)
+        compare = {
+            "==": series.__eq__,
+            "!=": series.__ne__,
+            ">": series.__gt__,
+            ">=": series.__ge__,
+            "<": series.__lt__,
+            "<=": series.__le__,
+        }.get(op)
+        if compare is None:
+            raise ToolError(f"Unknown operator {op!r}; use one of {', '.join(OPS)}")
+        try:
+            return compare(self._value(series, value)).fillna(False)
+        except TypeError:
+            raise ToolError(f"Can't compare {condition['column']} {op} {value!r}")
+
+    def mask(
+        self,
+        where: Optional[List[Dict[str, Any]]],
+        frame: Optional[pd.DataFrame] = None,
+    ) -> np.ndarray:
+        """Boolean array of the rows matching every where condition"""
+        frame = self.frame if frame is None else frame
+        mask = np.ones(len(frame), dtype=bool)
+        for condition in where or []:
+            mask &= self._mask(frame, condition).to_numpy(dtype=bool)
+        return mask
+
+    def _where(
+        self, where: Optional[List[Dict[str, Any]]], frame: pd.DataFrame
+    ) -> pd.DataFrame:
+        if not where:
+            return frame
+        return frame[self.mask(where, frame)]
+
+    def _with_rows(self, frame: pd.DataFrame, columns) -> pd.DataFrame:
+        picked = [self._column(c) for c in columns] if columns else list(frame.columns)
+        out = frame[picked].copy()
+        # Loaded frames keep the default index, so position = sheet row - first_row
+        out.insert(0, "row", np.asarray(frame.index) + self.first_row)
+        return out
+
+    def _keys(self, frame: pd.DataFrame, names, period: Optional[str]) -> List[Any]:
+        keys = []
+        for name in names or []:
+            series = frame[self._column(name)]
+            if _is_date(series) and period:
+                if period not in PERIODS:
+                    raise ToolError(f"Unknown period {period!r}")
+                series = series.dt.to_period(PERIODS[period]).astype(str)
+            keys.append(series)
+        return keys
+
+    def _render(self, result: pd.DataFrame) -> str:
+        """CSV-like text, capped to max_rows rows and max_chars characters"""
+        total = len(result)
+        shown = result.head(self.max_rows)
+        lines = [",".join(str(c) for c in shown.columns)]
+        for row in shown.itertuples(index=False):
+            lines.append(",".join(format_value(v).replace(",", "") for v in row))
+        text = "\n".join(lines)
+        note = f"\n({total:,} row{'' if total == 1 else 's'}" + (
+            f", first {len(shown):,} shown)" if total > len(shown) else ")"
+        )
+        if len(text) + len(note) > self.max_chars:
+            text = text[: self.max_chars - len(note) - 4].rsplit("\n", 1)[0] + "\n..."
+        return text + note
+
+    # Tools
+
+    def _tool_describe(self, columns=None, where=None, table=None) -> pd.DataFrame:
+        frame = self._where(where, self._table(table))
+        picked = [self._column(c) for c in columns] if columns else frame.columns
+        rows = []
+        for name in picked:
+            series = frame[name]
+            row = {
+                "column": name,
+                "type": str(series.dtype),
+                "rows": len(series),
+                "empty": int(series.isna().sum()),
+                "distinct": int(series.nunique()),
+            }
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(
+                series
+            ):
+                row.update(
+                    sum=series.sum(),
+                    mean=series.mean(),
+                    min=series.min(),
+                    max=series.max(),
+                )
+            elif _is_date(series):
+                row.update(min=series.min(), max=series.max())
+            else:
+                top = series.value_counts().head(1)
+                if len(top):
+                    row.update(most_common=top.index[0], count=int(top.iloc[0]))
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def _tool_filter_rows(
+        self, where=None, columns=None, limit=None, table=None
+    ) -> pd.DataFrame:
+        out = self._with_rows(self._where(where, self._table(table)), columns)
+        return out.head(int(limit)) if limit else out
+
+    def _tool_aggregate(
+        self,
+        where=None,
+        group_by=None,
+        metrics=None,
+        period=None,
+        sort_by=None,
+        table=None,
+        tables=None,
+    ) -> pd.DataFrame:
+        frame = self._where(where, self._table(table, tables))
+        metrics = metrics or [{"column": None, "agg": "count"}]
+        named = {}
+        for metric in metrics:
+            agg = metric.get("agg")
+            if agg not in AGGS:
+                raise ToolError(
+                    f"Unknown aggregate {agg!r}; use one of {', '.join(AGGS)}"
+                )
+            name = metric.get("column")
+            if name is None:
+                column = frame.columns[0]
+                label = "rows"
+            else:
+                column = self._column(name)
+                label = f"{agg}({name})"
+            named[label] = (column, "size" if label == "rows" else agg)
+        keys = self._keys(frame, group_by, period)
+        if not keys:
+            out = pd.DataFrame(
+                {
+                    label: [len(frame) if agg == "size" else frame[column].agg(agg)]
+                    for label, (column, agg) in named.items()
+                }
+            )
+        else:
+            grouped = frame.groupby(keys, dropna=False, observed=True, sort=True)
+            out = grouped.agg(**named).reset_index()
+        if sort_by:
+            if sort_by not in out.columns:
+                raise ToolError(
+                    f"sort_by must be one of {', '.join(map(str, out.columns))}"
+                )
+            out = out.sort_values(sort_by, ascending=False, kind="stable")
+        return out
+
+    def _tool_top_k(
+        self, column, k=10, smallest=False, where=None, columns=None, table=None
+    ) -> pd.DataFrame:
+        frame = self._where(where, self._table(table))
+        name = self._column(column)
+        k = min(int(k), self.max_rows)
+        picked = frame.nsmallest(k, name) if smallest else frame.nlargest(k, name)
+        return self._with_rows(picked, columns)
+
+    def _tool_pivot(
+        self,
+        index,
+        columns,
+        values=None,
+        agg="sum",
+        period=None,
+        where=None,
+        table=None,
+        tables=None,
+    ) -> pd.DataFrame:
+        frame = self._where(where, self._table(table, tables))
+        if agg not in AGGS:
+            raise ToolError(f"Unknown aggregate {agg!r}; use one of {', '.join(AGGS)}")
+        rows, cols = self._keys(frame, [index, columns], period)
+        if values is None:
+            table = pd.crosstab(rows, cols)
+        else:
+            table = pd.crosstab(
+                rows, cols, values=frame[self._column(values)], aggfunc=agg
+            )
+        table.columns = [str(c) for c in table.columns]
+        return table.reset_index()
+
+    def _tool_join(
+        self, left, right, on, how="inner", columns=None, limit=None
+    ) -> pd.DataFrame:
+        if how not in JOINS:
+            raise ToolError(f"Unknown join {how!r}; use one of {', '.join(JOINS)}")
+        keys = [self._column(c) for c in (on if isinstance(on, list) else [on])]
+        merged = self._table(left).merge(
+            self._table(right), on=keys, how=how, suffixes=(f" ({left})", f" ({right})")
+        )
+        if columns:
+            missing = [c for c in columns if c not in merged.columns]
+            if missing:
+                raise ToolError(
+                    f"No joined column {missing[0]!r}; columns are "
+                    + ", ".join(map(str, merged.columns))
+                )
+            merged = merged[columns]
+        return merged.head(int(limit)) if limit else merged
+
+
+def describe_tables(tables: Dict[str, pd.DataFrame], active: str = "") -> str:
+    """One line per loaded table for the prompt, so the model can pick one"""
+    lines = ["Tables loaded (query them with the table argument):"]
+    for name, frame in tables.items():
+        columns = ", ".join(str(c) for c in frame.columns[:12])
+        more = (
+            f", ... {len(frame.columns) - 12} more" if len(frame.columns) > 12 else ""
+        )
+        mark = " (active)" if name == active else ""
+        lines.append(f'- "{name}"{mark}: {len(frame):,} rows; {columns}{more}')
+    return "\n".join(lines)
+
+
+def tool_result_block(tool_use_id: str, text: str, is_error: bool) -> Dict[str, Any]:
+    block = {"type": "tool_result", "tool_use_id": tool_use_id, "content": text}
+    if is_error:
+        block["is_error"] = True
+    return block
+
+
+def describe_calls(calls: Optional[List[Dict[str, Any]]]) -> str:
+    """Short human-readable line of the tool calls behind an answer"""
+    if not calls:
+        return ""
+    steps = ", ".join(
+        f"{c['name']} " + ("failed" if c["error"] else f"{c['ms']:g} ms") for c in calls
+    )
+    return f"Queried the sheet {len(calls)}x: {steps}"
@@ -0,0 +1,383 @@
+"""
+Client-side quotas and retries for the Sheets, Drive and Anthropic APIs.
+
+Every outbound call first takes a token from a bucket per API and project,
+and from a per-user bucket when the caller names a user. The buckets refill
+at the published per-minute quota, so bursts queue here instead of coming
+back as 429s. Calls that still fail with 429, 5xx or a dropped connection
+are retried with full-jitter exponential backoff. A retry-after header is
+honoured and also pauses the whole project bucket, so concurrent callers
+back off together rather than piling on.
+
+    result = rate_limit.execute(service.spreadsheets().get(...), "sheets_read")
+    response = await rate_limit.call_async(
+        "anthropic", lambda: client.messages.create(...), user=session_id
+    )
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from holysheet.config import Settings
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504, 529}  # 529: Anthropic overloaded
+_PROJECT = object()  # bucket() sentinel: the project-wide bucket
+_CONNECTION_ERRORS = ("APIConnectionError", "APITimeoutError", "ServerNotFoundError")
+
+
+@dataclass
+class Quota:
+    """Requests per minute for a whole project and for each user (0 = no cap)"""
+
+    project_per_minute: float
+    user_per_minute: float = 0
+
+
+class TokenBucket:
+    """Reservation-based token bucket; waiters are served in arrival order"""
+
+    def __init__(
+        self,
+        per_minute: float,
+        burst_seconds: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.throttled_seconds = 0.0
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Take tokens now, possibly on credit; returns how long to wait"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            self.acquired += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.throttled_seconds += wait
+            return wait
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for seconds (e.g. after a retry-after)"""
+        with self._lock:
+            self._tokens = min(self._tokens, -self.rate * seconds)
+
+    def _enter(self) -> None:
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def _leave(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, sleep: Callable[[float], None] = time.sleep) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            self._enter()
+            try:
+                sleep(wait)
+            finally:
+                self._leave()
+        return wait
+
+    async def acquire_async(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            self._enter()
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave()
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "acquired": self.acquired,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
+
+
+def _header(headers, name: str) -> Optional[str]:
+    if not headers:
+        return None
+    try:
+        value = headers.get(name)
+        if value is None:
+            value = headers.get(name.title())
+        return value
+    except AttributeError:
+        return None
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Seconds to wait from retry-after-ms / retry-after (seconds or HTTP date)"""
+    value = _header(headers, "retry-after-ms")
+    if value is not None:
+        try:
+            return max(float(value) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    value = _header(headers, "retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        if parsed is None:
+            return None
+        return max(parsed.timestamp() - time.time(), 0.0)
+
+
+def classify_error(exc: BaseException) -> Tuple[bool, Optional[int], Optional[float]]:
+    """(retryable, HTTP status, retry-after seconds) for an API exception
+
+    Understands googleapiclient HttpError (exc.resp), anthropic
+    APIStatusError (exc.status_code / exc.response) and httpx HTTPStatusError
+    (exc.response.status_code) without importing any of them.
+    """
+    resp = getattr(exc, "resp", None)
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None)
+    if status is None and resp is not None:
+        status = getattr(resp, "status", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    headers = getattr(response, "headers", None) if response is not None else resp
+    if status is not None:
+        status = int(status)
+        return status in RETRYABLE_STATUS, status, parse_retry_after(headers)
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True, None, None
+    if type(exc).__name__ in _CONNECTION_ERRORS:
+        return True, None, None
+    return False, None, None
+
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 32.0
+
+    def delay(
+        self,
+        attempt: int,
+        retry_after: Optional[float] = None,
+        rng: Callable[[float, float], float] = random.uniform,
+    ) -> float:
+        """Full-jitter backoff; never sooner than the server asked for"""
+        if retry_after is not None:
+            return retry_after + rng(0, self.base_delay)
+        return rng(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class ApiGovernor:
+    """Token buckets and retry scheduling for every outbound API"""
+
+    def __init__(
+        self,
+        quotas: Dict[str, Quota],
+        policy: Optional[RetryPolicy] = None,
+        burst_seconds: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Callable[[float, float], float] = random.uniform,
+    ):
+        self.quotas = quotas
+        self.policy = policy or RetryPolicy()
+        self.burst_seconds = burst_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng
+        self._buckets: Dict[Tuple[str, Hashable, Hashable], TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.retries: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+
+    @classmethod
+    def from_settings(cls, settings) -> "ApiGovernor":
+        sheets_user = settings.sheets_user_requests_per_minute
+        quotas = {
+            "sheets_read": Quota(settings.sheets_read_requests_per_minute, sheets_user),
+            "sheets_write": Quota(
+                settings.sheets_write_requests_per_minute, sheets_user
+            ),
+            "drive": Quota(settings.drive_requests_per_minute),
+            "anthropic": Quota(
+                settings.anthropic_requests_per_minute,
+                settings.anthropic_user_requests_per_minute,
+            ),
+        }
+        policy = RetryPolicy(
+            max_retries=settings.api_max_retries,
+            base_delay=settings.api_backoff_base,
+            max_delay=settings.api_backoff_max,
+        )
+        return cls(quotas, policy, burst_seconds=settings.api_burst_seconds)
+
+    def bucket(
+        self, api: str, project: Hashable = None, user: Any = _PROJECT
+    ) -> Optional[TokenBucket]:
+        """The project bucket, or the bucket of one user when user is given
+
+        user=None is the default user (e.g. the single OAuth token of a
+        script), which still counts against the per-user quota.
+        """
+        quota = self.quotas.get(api)
+        if quota is None:
+            return None
+        if user is _PROJECT:
+            per_minute = quota.project_per_minute
+        else:
+            per_minute = quota.user_per_minute
+        if not per_minute:
+            return None
+        key = (api, project, user)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(
+                    per_minute, self.burst_seconds, self._clock
+                )
+            return bucket
+
+    def _buckets_for(self, api: str, project: Hashable, user: Hashable):
+        buckets = [self.bucket(api, project), self.bucket(api, project, user)]
+        return [b for b in buckets if b is not None]
+
+    def _on_error(self, api: str, exc: BaseException, attempt: int, project) -> float:
+        """Delay before the next attempt, or re-raise when out of retries"""
+        retryable, status, retry_after = classify_error(exc)
+        if not retryable or attempt >= self.policy.max_retries:
+            with self._lock:
+                self.failures[api] = self.failures.get(api, 0) + 1
+            raise exc
+        with self._lock:
+            self.retries[api] = self.retries.get(api, 0) + 1
+        if retry_after is not None:
+            bucket = self.bucket(api, project)
+            if bucket is not None:
+                bucket.pause(retry_after)
+        return self.policy.delay(attempt, retry_after, self._rng)
+
+    def call(
+        self,
+        api: str,
+        fn: Callable[[], Any],
+        user: Hashable = None,
+        project: Hashable = None,
+    ) -> Any:
+        attempt = 0
+        while True:
+            for bucket in self._buckets_for(api, project, user):
+                bucket.acquire(self._sleep)
+            try:
+                return fn()
+            except Exception as exc:
+                delay = self._on_error(api, exc, attempt, project)
+            attempt += 1
+            self._sleep(delay)
+
+    async def call_async(
+        self,
+        api: str,
+        fn: Callable[[], Awaitable[Any]],
+        user: Hashable = None,
+        project: Hashable = None,
+    ) -> Any:
+        attempt = 0
+        while True:
+            for bucket in self._buckets_for(api, project, user):
+                await bucket.acquire_async()
+            try:
+                return await fn()
+            except Exception as exc:
+                delay = self._on_error(api, exc, attempt, project)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def execute(
+        self, request, api: str = "sheets_read", user: Hashable = None, **kwargs
+    ) -> Any:
+        """request.execute(**kwargs) for a googleapiclient request, governed"""
+        return self.call(api, lambda: request.execute(**kwargs), user=user)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = dict(self._buckets)
+            retries, failures = dict(self.retries), dict(self.failures)
+        per_api: Dict[str, Dict[str, Any]] = {}
+        for (api, _, user), bucket in buckets.items():
+            entry = per_api.setdefault(
+                api,
+                {
+                    "waiting": 0,
+                    "max_waiting": 0,
+                    "acquired": 0,
+                    "throttled_seconds": 0.0,
+                },
+            )
+            if user is _PROJECT:
+                entry["acquired"] += bucket.acquired
+            entry["waiting"] += bucket.waiting
+            entry["max_waiting"] = max(entry["max_waiting"], bucket.max_waiting)
+            entry["throttled_seconds"] = round(
+                entry["throttled_seconds"] + bucket.throttled_seconds, 3
+            )
+        for api in set(retries) | set(failures):
+            per_api.setdefault(api, {})
+        for api, entry in per_api.items():
+            entry["retries"] = retries.get(api, 0)
+            entry["failures"] = failures.get(api, 0)
+        return per_api
+
+
+_shared_governor: Optional[ApiGovernor] = None
+_shared_lock = threading.Lock()
+
+
+def get_governor() -> ApiGovernor:
+    """Process-wide governor configured from the environment"""
+    global _shared_governor
+    with _shared_lock:
+        if _shared_governor is None:
+            _shared_governor = ApiGovernor.from_settings(Settings.from_env())
+        return _shared_governor
+
+
+def execute(request, api: str = "sheets_read", user: Hashable = None, **kwargs) -> Any:
+    return get_governor().execute(request, api, user=user, **kwargs)
+
+
+def call(
+    api: str, fn: Callable[[], Any], user: Hashable = None, project: Hashable = None
+) -> Any:
+    return get_governor().call(api, fn, user=user, project=project)
+
+
+async def call_async(
+    api: str,
+    fn: Callable[[], Awaitable[Any]],
+    user: Hashable = None,
+    project: Hashable = None,
+) -> Any:
+    return await get_governor().call_async(api, fn, user=user, project=project)
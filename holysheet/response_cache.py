@@ -0,0 +1,160 @@
+"""
+Persistent response cache for repeatable prompts.
+
+Quick actions send the same prompt against the same data over and over, so
+their answers are memoized on disk in a small SQLite file. The key is a hash
+of everything that determines the answer: model, system blocks, messages and
+a fingerprint of the sheet contents. Entries expire after a TTL and the file
+is kept under a size budget by evicting the least recently used answers.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from holysheet.config import Settings
+
+
+def frame_fingerprint(frame: Optional[pd.DataFrame]) -> str:
+    """Content hash of a DataFrame (values, index, column names and dtypes)"""
+    if frame is None:
+        return ""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in frame.columns]).encode())
+    digest.update(json.dumps([str(t) for t in frame.dtypes]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def make_key(model: str, system: Any, messages: Any, fingerprint: str = "") -> str:
+    payload = json.dumps(
+        {"model": model, "system": system, "messages": messages, "data": fingerprint},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed TTL + size-bounded cache of model responses"""
+
+    def __init__(
+        self,
+        path: str = ".holysheet/responses.sqlite",
+        ttl: float = 24 * 3600,
+        max_bytes: int = 50 * 1024 * 1024,
+        clock=time.time,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "ResponseCache":
+        return cls(
+            path=settings.response_cache_path,
+            ttl=settings.response_cache_ttl,
+            max_bytes=settings.response_cache_max_mb * 1024 * 1024,
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached payload for key, or None if missing or expired"""
+        now = self._clock()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, payload: Dict[str, Any]) -> None:
+        value = json.dumps(payload, default=str)
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        now = self._clock()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC"
+        ).fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_shared_cache: Optional[ResponseCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache configured from the environment"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache.from_settings(Settings.from_env())
+        return _shared_cache
@@ -0,0 +1,461 @@
+"""
+Per-user session state for the FastAPI server.
+
+Each browser session gets its own loaded frames, chat history and API
+clients, so users sharing one server process never see each other's sheets.
+The registry accounts for the memory held by loaded frames, evicts sessions
+that have been idle (and disconnected) for too long, and keeps the total
+resident sheet bytes under a cap by unloading frames of the least recently
+active sessions first.
+
+Each session also has a ConversationMemory (see holysheet.memory) that
+decides which turns of its history go with a chat request and records the
+token usage of every request.
+
+With a shared StateBackend (see holysheet.state) each session's history,
+memory and sheet list, plus an Arrow snapshot of every loaded frame (see
+snapshots.frame_to_bytes), are written through to the backend so another
+worker process can resume the session. Every save stamps the record with a
+new revision; a worker holding an older copy reloads it the next time the
+session is looked up, so a client that moves between workers never sees
+stale history or sheets. Since that lookup (resume, get_or_create) may read
+large frames, async callers run it in a worker thread.
+"""
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from holysheet.memory import ConversationMemory
+from holysheet.sheet_cache import estimate_size
+from holysheet.sheet_loader import range_start_column, range_start_row
+from holysheet.snapshots import frame_from_bytes, frame_to_bytes
+from holysheet.state import StateBackend
+
+
+def _frame_key(session_id: str, name: str) -> str:
+    # Per session: two sessions on the same sheet and range must not collide
+    return f"{session_id}:{name}"
+
+
+class Session:
+    """State owned by one browser session"""
+
+    def __init__(
+        self, session_id: str, now: float, memory: Optional[ConversationMemory] = None
+    ):
+        self.session_id = session_id
+        self.created = now
+        self.last_seen = now
+        self.connections = 0
+        self.frames: Dict[str, pd.DataFrame] = {}
+        self.frame_titles: Dict[str, str] = {}
+        self.frame_bytes: Dict[str, int] = {}
+        self.active_sheet: Optional[str] = None
+        self.history: List[Dict[str, Any]] = []
+        # Stamp of the last record saved or loaded, and of each stored frame
+        self.revision: Optional[str] = None
+        self.frame_stamps: Dict[str, str] = {}
+        self._renewed = now
+        self.memory = memory or ConversationMemory()
+        self.claude = None
+        # Own Google clients (setup_google); None uses the server's
+        self.google = None
+        self.sheets_service = None
+        # name -> (frame it was computed from, value)
+        self._derived: Dict[str, Tuple[pd.DataFrame, Any]] = {}
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self.frame_bytes.values())
+
+    @property
+    def sheet_data(self) -> Optional[pd.DataFrame]:
+        if self.active_sheet is None:
+            return None
+        return self.frames.get(self.active_sheet)
+
+    @property
+    def sheet_name(self) -> str:
+        if self.active_sheet is None:
+            return ""
+        return self.frame_titles.get(self.active_sheet, self.active_sheet)
+
+    @property
+    def first_row(self) -> int:
+        """Sheet row number of the active frame's first data row"""
+        if self.active_sheet is None:
+            return 2
+        # Names are "<spreadsheet id>:<range or tab>"; the header row comes first
+        _, _, range_name = self.active_sheet.partition(":")
+        return range_start_row(range_name) + 1
+
+    @property
+    def first_column(self) -> int:
+        """Sheet column number of the active frame's first column"""
+        if self.active_sheet is None:
+            return 1
+        _, _, range_name = self.active_sheet.partition(":")
+        return range_start_column(range_name)
+
+    @property
+    def tables(self) -> Dict[str, pd.DataFrame]:
+        """Loaded frames by title (tab titles for workbooks), for queries"""
+        tables: Dict[str, pd.DataFrame] = {}
+        for name, frame in self.frames.items():
+            title = self.frame_titles.get(name, name)
+            key, n = title, 2
+            while key in tables:
+                key, n = f"{title} ({n})", n + 1
+            tables[key] = frame
+        return tables
+
+    def set_google(self, google: Any) -> None:
+        """Use this GoogleClientFactory for the session's sheet reads"""
+        self.close_clients()
+        self.google = google
+        self.sheets_service = google.sheets()
+
+    def close_clients(self) -> None:
+        if self.google is not None:
+            self.google.close()
+        self.google = None
+        self.sheets_service = None
+
+    def select(self, sheet: str) -> bool:
+        """Make a loaded frame active by name or title"""
+        for name in self.frames:
+            if sheet in (name, self.frame_titles.get(name)):
+                self.active_sheet = name
+                return True
+        return False
+
+    def derived(self, name: str, compute: Callable[[pd.DataFrame], Any]) -> Any:
+        """compute(active sheet), recomputed only when the frame changes"""
+        frame = self.sheet_data
+        if frame is None:
+            return None
+        cached = self._derived.get(name)
+        if cached is None or cached[0] is not frame:
+            cached = self._derived[name] = (frame, compute(frame))
+        return cached[1]
+
+    def sheet_context(self, build: Callable[[pd.DataFrame], str]) -> Optional[str]:
+        """Context for the active sheet, rebuilt only when the frame changes"""
+        return self.derived("context", build)
+
+    def fingerprint(self, compute: Callable[[pd.DataFrame], str]) -> str:
+        """Content hash of the active sheet, recomputed only when it changes"""
+        return self.derived("fingerprint", compute) or ""
+
+    def to_record(self) -> Dict[str, Any]:
+        """The part of the session other workers need to resume it"""
+        return {
+            "created": self.created,
+            "revision": self.revision,
+            "history": self.history,
+            "memory": self.memory.to_record(),
+            "sheets": self.frame_titles,
+            "frames": self.frame_stamps,
+            "active_sheet": self.active_sheet,
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "sheets": {
+                name: {
+                    "title": self.frame_titles.get(name, name),
+                    "rows": len(frame),
+                    "columns": len(frame.columns),
+                    "bytes": self.frame_bytes.get(name, 0),
+                }
+                for name, frame in self.frames.items()
+            },
+            "active_sheet": self.active_sheet,
+            "history_length": len(self.history),
+            "memory": self.memory.stats(),
+        }
+
+
+class SessionRegistry:
+    """Sessions keyed by token, with idle eviction and a resident-bytes cap"""
+
+    def __init__(
+        self,
+        idle_timeout: float = 30 * 60,
+        max_total_bytes: int = 1024 * 1024 * 1024,
+        clock: Callable[[], float] = time.monotonic,
+        backend: Optional[StateBackend] = None,
+        history_token_budget: int = 4000,
+        history_summary_tokens: int = 600,
+    ):
+        self.idle_timeout = idle_timeout
+        self.max_total_bytes = max_total_bytes
+        self._clock = clock
+        self.backend = backend
+        self.history_token_budget = history_token_budget
+        self.history_summary_tokens = history_summary_tokens
+        self._sessions: Dict[str, Session] = {}
+        self._lock = threading.RLock()
+        self.evicted_sessions = 0
+        self.unloaded_frames = 0
+
+    @classmethod
+    def from_settings(
+        cls, settings, backend: Optional[StateBackend] = None
+    ) -> "SessionRegistry":
+        return cls(
+            idle_timeout=settings.session_idle_timeout,
+            max_total_bytes=settings.session_max_total_mb * 1024 * 1024,
+            backend=backend,
+            history_token_budget=settings.history_token_budget,
+            history_summary_tokens=settings.history_summary_tokens,
+        )
+
+    def _new_session(self, session_id: str) -> Session:
+        memory = ConversationMemory(
+            self.history_token_budget, self.history_summary_tokens
+        )
+        session = self._sessions[session_id] = Session(
+            session_id, self._clock(), memory
+        )
+        return session
+
+    def get(self, session_id: Optional[str]) -> Optional[Session]:
+        if not session_id:
+            return None
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def resume(self, session_id: Optional[str]) -> Optional[Session]:
+        """A known session, restored from the backend if needed; never a new one"""
+        if not session_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sync(session)
+            else:
+                session = self._restore(session_id)
+            if session is not None:
+                session.last_seen = self._clock()
+            return session
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        """Resume a known session token or start a new session"""
+        with self._lock:
+            self.evict_idle()
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None:
+                self._sync(session)
+            elif session_id:
+                session = self._restore(session_id)
+            if session is None:
+                new_id = uuid.uuid4().hex
+                session = self._new_session(new_id)
+            session.last_seen = self._clock()
+            return session
+
+    def touch(self, session: Session) -> None:
+        """Mark the session active, renewing its backend entries now and then"""
+        now = session.last_seen = self._clock()
+        if self.backend is None or now - session._renewed < self.idle_timeout / 10:
+            return
+        session._renewed = now
+        self.backend.expire("session", session.session_id, self.idle_timeout)
+        for name in session.frame_stamps:
+            self.backend.expire(
+                "sheet", _frame_key(session.session_id, name), self.idle_timeout
+            )
+
+    def save(self, session: Session) -> None:
+        """Write the session record through to the backend"""
+        if self.backend is None:
+            return
+        session.revision = uuid.uuid4().hex
+        session._renewed = self._clock()
+        record = json.dumps(session.to_record(), default=str).encode()
+        self.backend.set("session", session.session_id, record, ttl=self.idle_timeout)
+
+    def _sync(self, session: Session) -> None:
+        """Reload a session another worker has saved since this one last did"""
+        if self.backend is None or not self.backend.shared:
+            return
+        raw = self.backend.get("session", session.session_id)
+        if raw is None:
+            return
+        record = json.loads(raw)
+        if record.get("revision") != session.revision:
+            self._apply_record(session, record)
+
+    def _restore(self, session_id: str) -> Optional[Session]:
+        """Rebuild a session another worker saved, with the snapshots still held"""
+        if self.backend is None:
+            return None
+        raw = self.backend.get("session", session_id)
+        if raw is None:
+            return None
+        session = self._new_session(session_id)
+        self._apply_record(session, json.loads(raw))
+        return session
+
+    def _apply_record(self, session: Session, record: Dict[str, Any]) -> None:
+        """Bring session in line with a saved record, reusing unchanged frames"""
+        session.revision = record.get("revision")
+        session.history = record.get("history", [])
+        session.memory.restore(record.get("memory", {}))
+        stamps = record.get("frames", {})
+        for name in list(session.frames):
+            if name not in record.get("sheets", {}):
+                self.detach_frame(session, name)
+        for name, title in record.get("sheets", {}).items():
+            stamp = stamps.get(name)
+            if name in session.frames and session.frame_stamps.get(name) == stamp:
+                session.frame_titles[name] = title
+                continue
+            snapshot = self.backend.get("sheet", _frame_key(session.session_id, name))
+            # Arrow, not pickle: whoever can write the state file must not be
+            # able to run code in every worker
+            frame = frame_from_bytes(snapshot) if snapshot is not None else None
+            if frame is None:
+                continue
+            session.frames[name] = frame
+            session.frame_titles[name] = title
+            session.frame_bytes[name] = estimate_size(frame)
+            if stamp is not None:
+                session.frame_stamps[name] = stamp
+        active = record.get("active_sheet")
+        session.active_sheet = active if active in session.frames else None
+        if session.active_sheet is None:
+            session.active_sheet = next(iter(session.frames), None)
+        self._enforce_budget(keep=session)
+
+    def _store_frame(self, session: Session, name: str, frame: pd.DataFrame) -> None:
+        session.frame_stamps[name] = uuid.uuid4().hex
+        # Only worth the copy when other processes can read it back
+        if self.backend is None or not self.backend.shared:
+            return
+        snapshot = frame_to_bytes(frame)
+        if snapshot is None:
+            # No pyarrow, or no Arrow form: other workers reload the sheet
+            return
+        self.backend.set(
+            "sheet",
+            _frame_key(session.session_id, name),
+            snapshot,
+            ttl=self.idle_timeout,
+        )
+
+    def attach_frame(
+        self, session: Session, name: str, frame: pd.DataFrame, title: str = ""
+    ) -> None:
+        """Load a frame into a session and make it the active sheet"""
+        size = estimate_size(frame)
+        if size > self.max_total_bytes:
+            raise MemoryError(
+                f"Sheet needs {size / 2**20:.0f} MB, over the "
+                f"{self.max_total_bytes / 2**20:.0f} MB server limit"
+            )
+        with self._lock:
+            session.frames[name] = frame
+            session.frame_titles[name] = title or name
+            session.frame_bytes[name] = size
+            session.active_sheet = name
+            session.last_seen = self._clock()
+            self._enforce_budget(keep=session)
+        self._store_frame(session, name, frame)
+        self.save(session)
+
+    def detach_frame(self, session: Session, name: str) -> None:
+        with self._lock:
+            frame = session.frames.pop(name, None)
+            # Don't let memoized results keep an unloaded frame alive
+            session._derived = {
+                key: value
+                for key, value in session._derived.items()
+                if value[0] is not frame
+            }
+            session.frame_titles.pop(name, None)
+            session.frame_bytes.pop(name, None)
+            session.frame_stamps.pop(name, None)
+            if session.active_sheet == name:
+                session.active_sheet = next(iter(session.frames), None)
+
+    def _enforce_budget(self, keep: Session) -> None:
+        """Unload frames of the least recently active other sessions"""
+        if self.total_bytes <= self.max_total_bytes:
+            return
+        others = sorted(
+            (s for s in self._sessions.values() if s is not keep and s.frames),
+            key=lambda s: s.last_seen,
+        )
+        for session in others:
+            for name in list(session.frames):
+                self.detach_frame(session, name)
+                self.unloaded_frames += 1
+                if self.total_bytes <= self.max_total_bytes:
+                    return
+        # Still over: drop this session's older sheets, keeping the active one
+        for name in list(keep.frames):
+            if name != keep.active_sheet:
+                self.detach_frame(keep, name)
+                self.unloaded_frames += 1
+                if self.total_bytes <= self.max_total_bytes:
+                    return
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close_clients()
+        if self.backend is not None:
+            self.backend.delete("session", session_id)
+            for name in session.frame_stamps if session is not None else ():
+                self.backend.delete("sheet", _frame_key(session_id, name))
+
+    def evict_idle(self) -> List[str]:
+        """Drop disconnected sessions idle longer than the timeout"""
+        now = self._clock()
+        with self._lock:
+            expired = [
+                sid
+                for sid, s in self._sessions.items()
+                if s.connections == 0 and now - s.last_seen > self.idle_timeout
+            ]
+            for sid in expired:
+                self._sessions.pop(sid).close_clients()
+            self.evicted_sessions += len(expired)
+        return expired
+
+    async def reap_forever(self, interval: float = 60.0) -> None:
+        """Background task: evict idle sessions every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+            if self.backend is not None:
+                self.backend.purge_expired()
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(s.resident_bytes for s in self._sessions.values())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "connected": sum(1 for s in self._sessions.values() if s.connections),
+                "resident_bytes": self.total_bytes,
+                "max_total_bytes": self.max_total_bytes,
+                "evicted_sessions": self.evicted_sessions,
+                "unloaded_frames": self.unloaded_frames,
+            }
@@ -0,0 +1,329 @@
+"""
+Shared cache for parsed sheet data.
+
+Entries are keyed by (spreadsheet id, range) and remember the spreadsheet
+revision they were loaded at. Within the revalidation window a hit costs no
+network at all; after it, one cheap revision lookup decides whether the
+cached copy is still good. Entries are evicted least-recently-used once the
+total estimated size passes the byte budget.
+
+With a SnapshotStore attached, frames loaded at a known revision are also
+written to disk, and a memory miss at that revision maps the snapshot back
+instead of calling the loader, so the cache survives restarts and is shared
+by every process on the host.
+
+get_or_refresh goes one step further for append-only sheets: instead of
+reloading an out-of-date entry it hands the old copy to a refresher that
+only fetches what changed.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+
+from holysheet import rate_limit
+from holysheet.config import Settings
+from holysheet.snapshots import SnapshotStore
+
+RevisionLookup = Callable[[str], Optional[str]]
+
+
+def estimate_size(value: Any) -> int:
+    """Rough resident size in bytes of a DataFrame or a list of rows"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        total = sys.getsizeof(value)
+        for row in value:
+            total += sys.getsizeof(row)
+            if isinstance(row, (list, tuple)):
+                total += sum(sys.getsizeof(cell) for cell in row)
+        return total
+    return sys.getsizeof(value)
+
+
+def drive_revision_lookup(drive_service, user=None) -> RevisionLookup:
+    """Revision lookup backed by the Drive API file version counter
+
+    user is the rate-limit identity of drive_service's credential.
+    """
+
+    def lookup(spreadsheet_id: str) -> Optional[str]:
+        try:
+            meta = rate_limit.execute(
+                drive_service.files().get(
+                    fileId=spreadsheet_id, fields="version,modifiedTime"
+                ),
+                "drive",
+                user=user,
+            )
+        except Exception:
+            # Missing scope or transient error: treat the revision as unknown
+            return None
+        return meta.get("version") or meta.get("modifiedTime")
+
+    return lookup
+
+
+class _Entry:
+    __slots__ = ("value", "revision", "size", "checked_at")
+
+    def __init__(self, value: Any, revision: Optional[str], size: int, now: float):
+        self.value = value
+        self.revision = revision
+        self.size = size
+        self.checked_at = now
+
+
+class SheetCache:
+    """Byte-budgeted LRU cache of sheet data, validated by revision"""
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        revalidate_after: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        snapshots: Optional[SnapshotStore] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.snapshots = snapshots
+        self.revalidate_after = revalidate_after
+        self._clock = clock
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._revisions: Dict[str, Tuple[Optional[str], float]] = {}
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revision_checks = 0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "SheetCache":
+        return cls(
+            max_bytes=settings.sheet_cache_max_mb * 1024 * 1024,
+            revalidate_after=settings.sheet_cache_revalidate_after,
+            snapshots=SnapshotStore.from_settings(settings),
+        )
+
+    def _current_revision(
+        self, spreadsheet_id: str, revision_lookup: Optional[RevisionLookup]
+    ) -> Optional[str]:
+        """Revision of a spreadsheet, looked up at most once per window"""
+        now = self._clock()
+        known = self._revisions.get(spreadsheet_id)
+        if known is not None and now - known[1] < self.revalidate_after:
+            return known[0]
+        if revision_lookup is None:
+            return None
+        self.revision_checks += 1
+        revision = revision_lookup(spreadsheet_id)
+        self._revisions[spreadsheet_id] = (revision, now)
+        return revision
+
+    def _from_snapshot(
+        self, spreadsheet_id: str, range_name: str, revision: Optional[str]
+    ) -> Optional[pd.DataFrame]:
+        if self.snapshots is None or revision is None:
+            return None
+        return self.snapshots.load(spreadsheet_id, range_name, revision)
+
+    def _to_snapshot(
+        self, spreadsheet_id: str, range_name: str, revision: Optional[str], value: Any
+    ) -> None:
+        if self.snapshots is None or revision is None:
+            return
+        if isinstance(value, pd.DataFrame):
+            self.snapshots.save(spreadsheet_id, range_name, revision, value)
+
+    def get(
+        self,
+        spreadsheet_id: str,
+        range_name: str,
+        revision_lookup: Optional[RevisionLookup] = None,
+    ) -> Optional[Any]:
+        """Cached value if it is still valid, else None"""
+        key = (spreadsheet_id, range_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            now = self._clock()
+            if now - entry.checked_at >= self.revalidate_after:
+                revision = self._current_revision(spreadsheet_id, revision_lookup)
+                if revision is None or revision != entry.revision:
+                    self._drop(key)
+                    self.misses += 1
+                    return None
+                entry.checked_at = now
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(
+        self,
+        spreadsheet_id: str,
+        range_name: str,
+        value: Any,
+        revision: Optional[str] = None,
+    ) -> None:
+        """Store value; oversized values are not cached"""
+        key = (spreadsheet_id, range_name)
+        size = estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = _Entry(value, revision, size, self._clock())
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def get_or_load(
+        self,
+        spreadsheet_id: str,
+        range_name: str,
+        loader: Callable[[], Any],
+        revision_lookup: Optional[RevisionLookup] = None,
+    ) -> Any:
+        """Return the cached value or call loader() and cache its result"""
+        value = self.get(spreadsheet_id, range_name, revision_lookup)
+        if value is not None:
+            return value
+        with self._lock:
+            revision = self._current_revision(spreadsheet_id, revision_lookup)
+        value = self._from_snapshot(spreadsheet_id, range_name, revision)
+        if value is None:
+            value = loader()
+            self._to_snapshot(spreadsheet_id, range_name, revision, value)
+        if value is not None:
+            self.put(spreadsheet_id, range_name, value, revision)
+        return value
+
+    def get_or_refresh(
+        self,
+        spreadsheet_id: str,
+        range_name: str,
+        loader: Callable[[], Any],
+        refresher: Callable[[Any], Any],
+        revision_lookup: Optional[RevisionLookup] = None,
+    ) -> Any:
+        """get_or_load, but an out-of-date copy is passed to refresher(old)
+
+        The old copy comes from memory or, after a restart, from the newest
+        snapshot of the range. refresher returns the up-to-date value, e.g.
+        by fetching only rows appended since (see sheet_loader.refresh_frame).
+        """
+        with self._lock:
+            entry = self._entries.get((spreadsheet_id, range_name))
+            stale = entry.value if entry is not None else None
+        value = self.get(spreadsheet_id, range_name, revision_lookup)
+        if value is not None:
+            return value
+        with self._lock:
+            revision = self._current_revision(spreadsheet_id, revision_lookup)
+        value = self._from_snapshot(spreadsheet_id, range_name, revision)
+        if value is None:
+            if stale is None and self.snapshots is not None:
+                stale = self.snapshots.latest(spreadsheet_id, range_name)
+            value = loader() if stale is None else refresher(stale)
+            self._to_snapshot(spreadsheet_id, range_name, revision, value)
+        if value is not None:
+            self.put(spreadsheet_id, range_name, value, revision)
+        return value
+
+    def get_or_load_many(
+        self,
+        spreadsheet_id: str,
+        range_names: List[str],
+        loader: Callable[[List[str]], Dict[str, Any]],
+        revision_lookup: Optional[RevisionLookup] = None,
+    ) -> Dict[str, Any]:
+        """get_or_load for several ranges; loader(missing) loads the misses at once"""
+        values: Dict[str, Any] = {}
+        missing = []
+        for range_name in range_names:
+            value = self.get(spreadsheet_id, range_name, revision_lookup)
+            if value is None:
+                missing.append(range_name)
+            else:
+                values[range_name] = value
+        if not missing:
+            return values
+        with self._lock:
+            revision = self._current_revision(spreadsheet_id, revision_lookup)
+        unsaved = []
+        for range_name in missing:
+            value = self._from_snapshot(spreadsheet_id, range_name, revision)
+            if value is None:
+                unsaved.append(range_name)
+            else:
+                self.put(spreadsheet_id, range_name, value, revision)
+                values[range_name] = value
+        loaded = loader(unsaved) if unsaved else {}
+        for range_name, value in loaded.items():
+            if value is not None:
+                self._to_snapshot(spreadsheet_id, range_name, revision, value)
+                self.put(spreadsheet_id, range_name, value, revision)
+                values[range_name] = value
+        return {r: values[r] for r in range_names if r in values}
+
+    def invalidate(self, spreadsheet_id: Optional[str] = None) -> None:
+        """Forget one spreadsheet, or everything when no id is given"""
+        with self._lock:
+            keys = [
+                key
+                for key in self._entries
+                if spreadsheet_id is None or key[0] == spreadsheet_id
+            ]
+            for key in keys:
+                self._drop(key)
+            if spreadsheet_id is None:
+                self._revisions.clear()
+            else:
+                self._revisions.pop(spreadsheet_id, None)
+        if self.snapshots is not None:
+            self.snapshots.invalidate(spreadsheet_id)
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "revision_checks": self.revision_checks,
+            "snapshots": self.snapshots.stats() if self.snapshots else None,
+        }
+
+
+_shared_cache: Optional[SheetCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_sheet_cache() -> SheetCache:
+    """Process-wide cache shared by the server and the Streamlit apps"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = SheetCache.from_settings(Settings.from_env())
+        return _shared_cache
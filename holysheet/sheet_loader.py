@@ -0,0 +1,524 @@
+"""
+Full-sheet loading for large tabs.
+
+Instead of a fixed A1:Z1000 range, the real grid size is read from the
+spreadsheet metadata and the tab is fetched in row chunks through concurrent
+values.batchGet calls. Chunks are turned into DataFrames as they arrive and
+only a small window of requests is in flight, so peak memory stays bounded
+no matter how long the ledger is.
+
+load_workbook does the same for several tabs at once: one spreadsheets.get
+returns the title and grid size of every tab, and the chunks of all chosen
+tabs are packed into shared batchGet calls, so a workbook of small tabs
+loads in one values round trip.
+
+refresh_frame updates an append-only ledger in place of a reload: the tail
+rows already loaded are read again as a checksum, and only the rows after
+them are fetched, converted and appended.
+"""
+
+import hashlib
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from holysheet import rate_limit
+from holysheet.column_types import append_rows, convert_like, infer_column_types
+
+HttpFactory = Callable[[], object]
+
+# Bare cell ranges need a colon ("A1:C9", "A:C", "2:40"); "Q1" or "Tax" is a tab
+_CELLS = re.compile(r"^(?:[A-Za-z]{1,3}\d*:[A-Za-z]{1,3}\d*|\d+:\d+)$")
+_CELL = re.compile(r"^[A-Za-z]{1,3}\d+$")
+
+
+def column_letter(index: int) -> str:
+    """1-based column index to A1 letters (1 -> A, 27 -> AA)"""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def column_number(letters: str) -> int:
+    """A1 letters to a 1-based column index (A -> 1, AA -> 27)"""
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + (ord(ch) - ord("A") + 1)
+    return index
+
+
+def quote_sheet_title(title: str) -> str:
+    return "'" + title.replace("'", "''") + "'"
+
+
+def split_range(
+    range_name: Optional[str], single_cells: bool = False
+) -> Tuple[Optional[str], Optional[str]]:
+    """Split "Tab!A1:C9" into (tab, cells); a bare name is treated as a tab
+
+    A bare single cell such as "B5" is a tab name too, unless single_cells
+    (ranges written by the assistant, which always address cells).
+    """
+    if not range_name:
+        return None, None
+    if "!" in range_name:
+        tab, cells = range_name.rsplit("!", 1)
+        if tab.startswith("'") and tab.endswith("'"):
+            tab = tab[1:-1].replace("''", "'")
+        return tab, cells or None
+    if _CELLS.match(range_name) or (single_cells and _CELL.match(range_name)):
+        return None, range_name
+    return range_name, None
+
+
+def range_start_row(range_name: Optional[str]) -> int:
+    """Sheet row number where a range starts (1 when it starts at the top)"""
+    _, cells = split_range(range_name)
+    match = re.match(r"^[A-Za-z]*(\d+)", cells or "")
+    return int(match.group(1)) if match else 1
+
+
+def range_start_column(range_name: Optional[str]) -> int:
+    """Column number where a range starts (1 when it starts at column A)"""
+    _, cells = split_range(range_name)
+    match = re.match(r"^([A-Za-z]+)", cells or "")
+    return column_number(match.group(1)) if match else 1
+
+
+@dataclass
+class TabInfo:
+    title: str
+    sheet_id: int
+    rows: int
+    columns: int
+
+
+@dataclass
+class WorkbookInfo:
+    """Spreadsheet title and every tab's grid size, from one metadata call"""
+
+    title: str
+    tabs: List[TabInfo] = field(default_factory=list)
+
+    def tab(self, title: Optional[str] = None) -> TabInfo:
+        """A tab by title, the first one by default"""
+        if not self.tabs:
+            raise ValueError("Spreadsheet has no tabs")
+        if title is None:
+            return self.tabs[0]
+        for tab in self.tabs:
+            if tab.title == title:
+                return tab
+        raise ValueError(f"No tab named {title!r}")
+
+
+def get_workbook_info(service, spreadsheet_id: str, user=None) -> WorkbookInfo:
+    """Title and tab grid sizes; user is the credential's rate-limit identity"""
+    meta = rate_limit.execute(
+        service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields="properties.title,sheets.properties(sheetId,title,gridProperties)",
+        ),
+        user=user,
+    )
+    tabs = []
+    for sheet in meta.get("sheets", []):
+        props = sheet["properties"]
+        grid = props.get("gridProperties", {})
+        tabs.append(
+            TabInfo(
+                title=props["title"],
+                sheet_id=int(props.get("sheetId", 0)),
+                rows=int(grid.get("rowCount", 0)),
+                columns=int(grid.get("columnCount", 0)),
+            )
+        )
+    return WorkbookInfo(meta.get("properties", {}).get("title", ""), tabs)
+
+
+def get_grid_properties(
+    service, spreadsheet_id: str, sheet_title: Optional[str] = None, user=None
+) -> Tuple[str, int, int]:
+    """(title, row count, column count) of a tab, the first one by default"""
+    tab = get_workbook_info(service, spreadsheet_id, user).tab(sheet_title)
+    return tab.title, tab.rows, tab.columns
+
+
+def chunk_ranges(
+    title: str, rows: int, columns: int, chunk_rows: int, first_row: int = 1
+) -> List[str]:
+    """A1 ranges covering rows first_row..rows in chunks"""
+    last_column = column_letter(max(columns, 1))
+    quoted = quote_sheet_title(title)
+    ranges = []
+    for start in range(first_row, rows + 1, chunk_rows):
+        end = min(start + chunk_rows - 1, rows)
+        ranges.append(f"{quoted}!A{start}:{last_column}{end}")
+    return ranges
+
+
+def default_http_factory(service) -> Optional[HttpFactory]:
+    """Fresh authorized transports for worker threads (httplib2 is not thread-safe)
+
+    None when the service already sits on a thread-safe PooledHttp.
+    """
+    from holysheet.google_clients import PooledHttp
+
+    http = getattr(service, "_http", None)
+    if isinstance(http, PooledHttp):
+        return None
+    credentials = getattr(http, "credentials", None)
+    if credentials is None:
+        return None
+
+    def factory():
+        import google_auth_httplib2
+        import httplib2
+
+        return google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+
+    return factory
+
+
+def unique_columns(header: Sequence[str], width: int) -> List[str]:
+    """Header names padded to width, with blanks named and duplicates suffixed"""
+    names: List[str] = []
+    seen = set()
+    for i in range(width):
+        name = str(header[i]).strip() if i < len(header) and header[i] else ""
+        name = name or f"Column {i + 1}"
+        candidate, n = name, 2
+        while candidate in seen:
+            candidate, n = f"{name} ({n})", n + 1
+        seen.add(candidate)
+        names.append(candidate)
+    return names
+
+
+class ChunkJoiner:
+    """Restores the trailing blank rows the API leaves out of each chunk
+
+    They are only real rows when a later chunk of the same tab has values,
+    so they are held back until then: the blank end of a large grid never
+    turns into empty data rows, while later rows keep their sheet row
+    numbers.
+    """
+
+    def __init__(self) -> None:
+        self._owed: Dict[str, int] = {}
+
+    def add(self, title: str, chunk: List[list], rows: int) -> List[list]:
+        """chunk (rows long in the grid) preceded by the blank rows owed"""
+        owed = self._owed.get(title, 0)
+        if not chunk:
+            self._owed[title] = owed + rows
+            return chunk
+        self._owed[title] = rows - len(chunk)
+        if not owed:
+            return chunk
+        return [[] for _ in range(owed)] + chunk
+
+
+def rows_to_frame(header: Sequence[str], rows: List[list]) -> pd.DataFrame:
+    """Build a frame from ragged rows, padding short rows and naming extra columns"""
+    width = max([len(header)] + [len(row) for row in rows])
+    columns = unique_columns(header, width)
+    padded = [
+        row + [None] * (width - len(row)) if len(row) < width else row for row in rows
+    ]
+    return pd.DataFrame(padded, columns=columns)
+
+
+class SheetLoader:
+    """Loads whole tabs through concurrent, chunked values.batchGet calls"""
+
+    def __init__(
+        self,
+        service,
+        chunk_rows: int = 5000,
+        ranges_per_request: int = 2,
+        max_workers: int = 4,
+        http_factory: Optional[HttpFactory] = None,
+        user=None,
+    ):
+        self.service = service
+        self.chunk_rows = chunk_rows
+        self.ranges_per_request = ranges_per_request
+        self.max_workers = max_workers
+        self.http_factory = http_factory or default_http_factory(service)
+        # Per-user quota bucket of the credential behind service
+        self.user = user
+        self._local = threading.local()
+
+    @classmethod
+    def from_settings(cls, service, settings, user=None) -> "SheetLoader":
+        if settings is None:
+            return cls(service, user=user)
+        return cls(
+            service,
+            chunk_rows=settings.sheet_chunk_rows,
+            max_workers=settings.sheet_read_workers,
+            user=user,
+        )
+
+    def _http(self):
+        if self.http_factory is None:
+            return None
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = self.http_factory()
+        return http
+
+    def _execute(self, request):
+        http = self._http()
+        if http is not None:
+            return rate_limit.execute(request, user=self.user, http=http)
+        return rate_limit.execute(request, user=self.user)
+
+    def _batches(self, tabs: List[TabInfo]) -> List[List[Tuple[str, int, str]]]:
+        """(tab, rows, range) chunks of every tab, packed into batchGet calls
+
+        A call carries up to ranges_per_request full chunks worth of rows, so
+        a long tab still streams in several calls while small tabs share one.
+        """
+        budget = self.chunk_rows * self.ranges_per_request
+        batches: List[List[Tuple[str, int, str]]] = []
+        current: List[Tuple[str, int, str]] = []
+        used = 0
+        for tab in tabs:
+            if tab.rows == 0 or tab.columns == 0:
+                continue
+            for start, cells in enumerate(
+                chunk_ranges(tab.title, tab.rows, tab.columns, self.chunk_rows)
+            ):
+                rows = min(self.chunk_rows, tab.rows - start * self.chunk_rows)
+                if current and used + rows > budget:
+                    batches.append(current)
+                    current, used = [], 0
+                current.append((tab.title, rows, cells))
+                used += rows
+        if current:
+            batches.append(current)
+        return batches
+
+    def _fetch_ranges(self, spreadsheet_id: str, ranges: List[str]) -> List[list]:
+        """Values of each range, in request order"""
+        request = (
+            self.service.spreadsheets()
+            .values()
+            .batchGet(spreadsheetId=spreadsheet_id, ranges=ranges)
+        )
+        result = self._execute(request)
+        return [r.get("values", []) for r in result.get("valueRanges", [])]
+
+    def _read_tabs(
+        self, spreadsheet_id: str, tabs: List[TabInfo]
+    ) -> Dict[str, Optional[pd.DataFrame]]:
+        """Each tab as a frame (first row as header), None for empty tabs"""
+        batches = self._batches(tabs)
+        joiner = ChunkJoiner()
+        headers: Dict[str, Optional[list]] = {}
+        frames: Dict[str, List[pd.DataFrame]] = {}
+        # Keep a bounded window of requests in flight and consume them in order
+        window = max(self.max_workers * 2, 1)
+        pending = iter(batches)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            in_flight: deque = deque()
+
+            def submit_next() -> None:
+                batch = next(pending, None)
+                if batch is not None:
+                    ranges = [cells for _, _, cells in batch]
+                    future = pool.submit(self._fetch_ranges, spreadsheet_id, ranges)
+                    in_flight.append((batch, future))
+
+            for _ in range(window):
+                submit_next()
+            while in_flight:
+                batch, future = in_flight.popleft()
+                chunks = future.result()
+                submit_next()
+                for (title, rows, _), chunk in zip(batch, chunks):
+                    chunk = joiner.add(title, chunk, rows)
+                    if title not in headers:
+                        # A tab's first chunk starts at row 1, the header;
+                        # an empty first chunk means an empty tab
+                        headers[title] = chunk[0] if chunk else None
+                        frames[title] = []
+                        chunk = chunk[1:]
+                    if headers[title] is not None and chunk:
+                        frames[title].append(rows_to_frame(headers[title], chunk))
+
+        result: Dict[str, Optional[pd.DataFrame]] = {}
+        for tab in tabs:
+            header = headers.get(tab.title)
+            if header is None:
+                result[tab.title] = None
+            elif not frames[tab.title]:
+                result[tab.title] = rows_to_frame(header, [])
+            else:
+                result[tab.title] = pd.concat(frames[tab.title], ignore_index=True)
+        return result
+
+    def read_rows(
+        self, spreadsheet_id: str, tab: TabInfo, first_row: int
+    ) -> Tuple[list, List[list]]:
+        """(header, raw rows from first_row to the end of the grid)"""
+        first_row = max(first_row, 2)
+        ranges = chunk_ranges(tab.title, 1, tab.columns, 1)
+        ranges += chunk_ranges(
+            tab.title, tab.rows, tab.columns, self.chunk_rows, first_row
+        )
+        requests = [
+            ranges[i : i + self.ranges_per_request]
+            for i in range(0, len(ranges), self.ranges_per_request)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = pool.map(
+                lambda batch: self._fetch_ranges(spreadsheet_id, batch), requests
+            )
+            chunks = [chunk for result in results for chunk in result]
+        header = chunks[0][0] if chunks and chunks[0] else []
+        joiner = ChunkJoiner()
+        body = [joiner.add(tab.title, chunk, self.chunk_rows) for chunk in chunks[1:]]
+        return header, [row for chunk in body for row in chunk]
+
+    def load(
+        self, spreadsheet_id: str, sheet_title: Optional[str] = None
+    ) -> Optional[pd.DataFrame]:
+        """Whole tab as a DataFrame with the first row as header, or None if empty"""
+        tab = get_workbook_info(self.service, spreadsheet_id, self.user).tab(
+            sheet_title
+        )
+        return self._read_tabs(spreadsheet_id, [tab])[tab.title]
+
+    def load_workbook(
+        self,
+        spreadsheet_id: str,
+        tabs: Optional[Sequence[str]] = None,
+        info: Optional[WorkbookInfo] = None,
+    ) -> Tuple[WorkbookInfo, Dict[str, Optional[pd.DataFrame]]]:
+        """Every tab (or the named ones) as frames keyed by tab title
+
+        Pass info from an earlier get_workbook_info to skip the metadata call.
+        """
+        info = info or get_workbook_info(self.service, spreadsheet_id, self.user)
+        chosen = info.tabs if tabs is None else [info.tab(title) for title in tabs]
+        return info, self._read_tabs(spreadsheet_id, chosen)
+
+
+def load_frame(
+    service,
+    spreadsheet_id: str,
+    range_name: Optional[str] = None,
+    settings=None,
+    typed: bool = True,
+    user=None,
+) -> Optional[pd.DataFrame]:
+    """Load an explicit A1 range, or a whole auto-sized tab when no cells are given
+
+    With typed=True (the default) columns are converted from strings to
+    numeric, datetime and categorical dtypes. user is the rate-limit
+    identity of service's credential (see rate_limit.ApiGovernor.bucket).
+    """
+    tab, cells = split_range(range_name)
+    if cells is None:
+        loader = SheetLoader.from_settings(service, settings, user)
+        frame = loader.load(spreadsheet_id, tab)
+        if frame is None or not typed:
+            return frame
+        return infer_column_types(frame)
+
+    result = rate_limit.execute(
+        service.spreadsheets()
+        .values()
+        .get(spreadsheetId=spreadsheet_id, range=range_name),
+        user=user,
+    )
+    values = result.get("values", [])
+    if not values:
+        return None
+    frame = rows_to_frame(values[0], values[1:])
+    return infer_column_types(frame) if typed else frame
+
+
+def load_workbook(
+    service,
+    spreadsheet_id: str,
+    tabs: Optional[Sequence[str]] = None,
+    settings=None,
+    typed: bool = True,
+    info: Optional[WorkbookInfo] = None,
+    user=None,
+) -> Tuple[WorkbookInfo, Dict[str, pd.DataFrame]]:
+    """Workbook metadata and its non-empty tabs as (typed) frames"""
+    loader = SheetLoader.from_settings(service, settings, user)
+    info, frames = loader.load_workbook(spreadsheet_id, tabs, info)
+    loaded = {
+        title: infer_column_types(frame) if typed else frame
+        for title, frame in frames.items()
+        if frame is not None
+    }
+    return info, loaded
+
+
+def tail_checksum(frame: pd.DataFrame) -> str:
+    """Checksum of a typed frame's values (row order matters, index doesn't)"""
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def refresh_frame(
+    service,
+    spreadsheet_id: str,
+    sheet_title: Optional[str],
+    frame: pd.DataFrame,
+    settings=None,
+    overlap: int = 20,
+    user=None,
+) -> Tuple[Optional[pd.DataFrame], Optional[int]]:
+    """Bring a typed whole-tab frame up to date, assuming the tab only grows
+
+    The last overlap rows already loaded are read again along with
+    everything after them. If they still match (same header, same values),
+    only the new rows are converted and appended, so the cost follows the
+    number of new rows. Returns (frame, rows appended); when anything above
+    the old end changed the tab is loaded in full and rows appended is None.
+    """
+    loader = SheetLoader.from_settings(service, settings, user)
+    tab = get_workbook_info(service, spreadsheet_id, user).tab(sheet_title)
+
+    def reload():
+        full = loader._read_tabs(spreadsheet_id, [tab])[tab.title]
+        return (infer_column_types(full) if full is not None else None), None
+
+    known = len(frame)
+    overlap = min(overlap, known)
+    width = len(frame.columns)
+    header, rows = loader.read_rows(spreadsheet_id, tab, known - overlap + 2)
+    if (
+        len(rows) < overlap
+        or unique_columns(header, width) != list(frame.columns)
+        or any(len(row) > width for row in rows)
+    ):
+        return reload()
+
+    raw = rows_to_frame(header, rows).reindex(columns=frame.columns)
+    tail = convert_like(raw.iloc[:overlap], frame)
+    if tail is None or tail_checksum(tail) != tail_checksum(
+        frame.iloc[known - overlap :]
+    ):
+        return reload()
+    added = convert_like(raw.iloc[overlap:], frame)
+    if added is None:
+        return reload()
+    if added.empty:
+        return frame, 0
+    return append_rows(frame, added), len(added)
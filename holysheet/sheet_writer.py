@@ -0,0 +1,362 @@
+"""
+Diff-based, batched writes for assistant actions.
+
+The assistant answers change requests with blocks like
+
+    ACTION: WRITE
+    RANGE: A2:C4
+    DATA: [["Rent", 1200, "Housing"], ...]
+    EXPLANATION: ...
+
+parse_actions turns them into SheetActions and plan_writes applies them, in
+order, on top of the cached grid. Only cells whose value really changes are
+kept; neighbouring cells are merged into rectangles and the whole plan goes
+out as one values.batchUpdate per spreadsheet (a second one only when plain
+values and formulas are mixed, since the input option is per request).
+Clearing is writing empty strings, so it rides in the same request. A plan
+can be previewed (dry run) before anything is sent.
+"""
+
+import ast
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from holysheet import rate_limit
+from holysheet.sheet_loader import (
+    column_letter,
+    column_number,
+    quote_sheet_title,
+    split_range,
+)
+
+ACTION_TYPES = ("READ", "WRITE", "CLEAR", "FORMULA")
+
+_FIELD = re.compile(r"^(ACTION|RANGE|DATA|EXPLANATION)\s*:\s*(.*)$", re.IGNORECASE)
+_BOUNDS = re.compile(r"^([A-Za-z]*)(\d*)(?::([A-Za-z]*)(\d*))?$")
+
+Cell = Tuple[Optional[str], int, int]  # (tab, row, column), 1-based
+Bounds = Tuple[Optional[int], Optional[int], Optional[int], Optional[int]]
+
+
+@dataclass
+class SheetAction:
+    """One ACTION block from a model response"""
+
+    action: str
+    range: str
+    data: List[List[Any]] = field(default_factory=list)
+    explanation: str = ""
+
+    @property
+    def writes(self) -> bool:
+        return self.action in ("WRITE", "CLEAR", "FORMULA")
+
+
+@dataclass
+class CellChange:
+    tab: Optional[str]
+    row: int
+    column: int
+    before: Optional[str]
+    after: Any
+    formula: bool = False
+
+    @property
+    def a1(self) -> str:
+        cell = f"{column_letter(self.column)}{self.row}"
+        return f"{quote_sheet_title(self.tab)}!{cell}" if self.tab else cell
+
+
+@dataclass
+class WritePlan:
+    """Changed cells and the batchUpdate bodies that write them"""
+
+    changes: List[CellChange]
+    unchanged: int
+    data: Dict[str, List[Dict[str, Any]]]  # value input option -> ValueRanges
+
+    @property
+    def empty(self) -> bool:
+        return not self.changes
+
+    @property
+    def range_count(self) -> int:
+        return sum(len(ranges) for ranges in self.data.values())
+
+    def summary(self) -> str:
+        if self.empty:
+            return "No cells would change"
+        text = f"{len(self.changes):,} cells in {self.range_count:,} ranges"
+        if self.unchanged:
+            text += f" ({self.unchanged:,} unchanged cells skipped)"
+        return text
+
+    def preview(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Before/after rows for a dry run"""
+        return [
+            {"cell": c.a1, "before": c.before, "after": c.after}
+            for c in self.changes[:limit]
+        ]
+
+    def requests(self, spreadsheet_id: str) -> List[Dict[str, Any]]:
+        """Keyword arguments for each values().batchUpdate call"""
+        return [
+            {
+                "spreadsheetId": spreadsheet_id,
+                "body": {"valueInputOption": option, "data": ranges},
+            }
+            for option, ranges in self.data.items()
+            if ranges
+        ]
+
+
+def _clean(value: str) -> str:
+    return value.strip().strip("*`").strip()
+
+
+def _parse_data(text: str, action_range: str) -> List[List[Any]]:
+    start = text.find("[")
+    if start < 0:
+        return []
+    text = text[start:]
+    try:
+        data, _ = json.JSONDecoder().raw_decode(text)
+    except ValueError:
+        try:
+            data = ast.literal_eval(text[: text.rfind("]") + 1])
+        except (ValueError, SyntaxError):
+            raise ValueError(f"Could not parse DATA for {action_range}") from None
+    if not isinstance(data, list):
+        raise ValueError(f"DATA for {action_range} is not a list of rows")
+    return [row if isinstance(row, list) else [row] for row in data]
+
+
+def parse_actions(text: str) -> List[SheetAction]:
+    """SheetActions for every ACTION/RANGE/DATA block in a response"""
+    blocks: List[Dict[str, str]] = []
+    key = None
+    for line in text.splitlines():
+        match = _FIELD.match(_clean(line))
+        if match:
+            key = match.group(1).upper()
+            if key == "ACTION":
+                blocks.append({})
+            if blocks:
+                blocks[-1][key] = match.group(2)
+        elif blocks and key == "DATA":
+            # DATA may span several lines (pretty-printed or fenced JSON)
+            blocks[-1][key] += "\n" + line
+        elif blocks and key == "EXPLANATION" and line.strip():
+            blocks[-1][key] += " " + line.strip()
+        else:
+            key = None
+
+    actions = []
+    for block in blocks:
+        action = _clean(block.get("ACTION", "")).upper()
+        action_range = _clean(block.get("RANGE", ""))
+        if action not in ACTION_TYPES or not action_range:
+            continue
+        data = []
+        if action in ("WRITE", "FORMULA"):
+            data = _parse_data(block.get("DATA", ""), action_range)
+        actions.append(
+            SheetAction(
+                action, action_range, data, _clean(block.get("EXPLANATION", ""))
+            )
+        )
+    return actions
+
+
+def parse_bounds(cells: Optional[str]) -> Bounds:
+    """(first row, first column, last row, last column); None where open"""
+    match = _BOUNDS.match(cells or "")
+    if not cells or not match:
+        raise ValueError(f"Unsupported range {cells!r}")
+    col0, row0, col1, row1 = match.groups()
+    if col1 is None and row1 is None:
+        # A single cell such as "B7"
+        col1, row1 = col0, row0
+    return (
+        int(row0) if row0 else None,
+        column_number(col0) if col0 else None,
+        int(row1) if row1 else None,
+        column_number(col1) if col1 else None,
+    )
+
+
+class _Grid:
+    """Cached values of the range the assistant read, addressed by sheet cell"""
+
+    def __init__(self, values: Optional[List[List[Any]]], range_name: Optional[str]):
+        self.values = values or []
+        self.tab, cells = split_range(range_name)
+        self.known = values is not None
+        if cells:
+            row0, col0, self.last_row, self.last_col = parse_bounds(cells)
+        else:
+            row0, col0, self.last_row, self.last_col = None, None, None, None
+        self.row0 = row0 or 1
+        self.col0 = col0 or 1
+
+    def covers(self, tab: Optional[str], row: int, col: int) -> bool:
+        if not self.known or tab != self.tab:
+            return False
+        if row < self.row0 or col < self.col0:
+            return False
+        if self.last_row is not None and row > self.last_row:
+            return False
+        return self.last_col is None or col <= self.last_col
+
+    def get(self, tab: Optional[str], row: int, col: int) -> Optional[str]:
+        """Current value, "" for an empty cell, None when not loaded"""
+        if not self.covers(tab, row, col):
+            return None
+        r, c = row - self.row0, col - self.col0
+        if r < len(self.values) and c < len(self.values[r]):
+            value = self.values[r][c]
+            return "" if value is None else str(value)
+        return ""
+
+    def extent(self) -> Tuple[int, int]:
+        """Last row and column holding data"""
+        width = max((len(r) for r in self.values), default=0)
+        return self.row0 + len(self.values) - 1, self.col0 + width - 1
+
+
+def _same(before: Optional[str], after: Any) -> bool:
+    if before is None:
+        return False
+    if after is None:
+        after = ""
+    if isinstance(after, bool):
+        return before.upper() == str(after).upper()
+    if isinstance(after, (int, float)):
+        try:
+            return float(before.replace(",", "")) == float(after)
+        except ValueError:
+            return False
+    return before == str(after)
+
+
+def _action_cells(action: SheetAction, grid: _Grid) -> List[Tuple[Cell, Any]]:
+    tab, cells = split_range(action.range, single_cells=True)
+    if tab is None and cells is None:
+        raise ValueError(f"Unsupported range {action.range!r}")
+    if tab is None:
+        # A bare "B2:C9" refers to the tab the assistant was shown
+        tab = grid.tab
+    row0, col0, row1, col1 = parse_bounds(cells) if cells else (None,) * 4
+    row0, col0 = row0 or 1, col0 or 1
+
+    if action.action == "CLEAR":
+        if row1 is None or col1 is None:
+            if tab != grid.tab or not grid.known:
+                raise ValueError(f"Cannot clear open-ended range {action.range!r}")
+            last_row, last_col = grid.extent()
+            row1 = row1 if row1 is not None else last_row
+            col1 = col1 if col1 is not None else last_col
+        return [
+            ((tab, r, c), "")
+            for r in range(row0, row1 + 1)
+            for c in range(col0, col1 + 1)
+        ]
+
+    out = []
+    for i, row in enumerate(action.data):
+        for j, value in enumerate(row):
+            r, c = row0 + i, col0 + j
+            if (row1 is not None and r > row1) or (col1 is not None and c > col1):
+                raise ValueError(f"DATA does not fit in {action.range}")
+            out.append(((tab, r, c), "" if value is None else value))
+    return out
+
+
+def _rectangles(
+    cells: Dict[Tuple[int, int], Any],
+) -> List[Tuple[int, int, int, int, List[List[Any]]]]:
+    """Merge cells into (row0, col0, row1, col1, values) blocks"""
+    runs: List[Tuple[int, int, int, List[Any]]] = []
+    for row, col in sorted(cells):
+        if runs and runs[-1][0] == row and runs[-1][2] == col - 1:
+            r, c0, _, values = runs[-1]
+            runs[-1] = (r, c0, col, values + [cells[(row, col)]])
+        else:
+            runs.append((row, col, col, [cells[(row, col)]]))
+
+    # Stack runs spanning the same columns on consecutive rows
+    blocks: List[Tuple[int, int, int, int, List[List[Any]]]] = []
+    open_blocks: Dict[Tuple[int, int], int] = {}
+    for row, c0, c1, values in runs:
+        index = open_blocks.get((c0, c1))
+        if index is not None and blocks[index][2] == row - 1:
+            r0, _, _, _, rows = blocks[index]
+            blocks[index] = (r0, c0, row, c1, rows + [values])
+        else:
+            open_blocks[(c0, c1)] = len(blocks)
+            blocks.append((row, c0, row, c1, [values]))
+    return blocks
+
+
+def plan_writes(
+    actions: List[SheetAction],
+    current: Optional[List[List[Any]]] = None,
+    current_range: Optional[str] = None,
+) -> WritePlan:
+    """Apply actions in order over the current grid and keep only real changes
+
+    current is the raw values read from current_range; cells outside it are
+    unknown and always written.
+    """
+    grid = _Grid(current, current_range)
+    proposed: Dict[Cell, Tuple[Any, bool]] = {}
+    for action in actions:
+        if not action.writes:
+            continue
+        formula = action.action == "FORMULA"
+        for cell, value in _action_cells(action, grid):
+            proposed[cell] = (value, formula)
+
+    changes = []
+    unchanged = 0
+    grouped: Dict[Tuple[Optional[str], str], Dict[Tuple[int, int], Any]] = {}
+    for (tab, row, col), (value, formula) in proposed.items():
+        before = grid.get(tab, row, col)
+        if _same(before, value):
+            unchanged += 1
+            continue
+        changes.append(CellChange(tab, row, col, before, value, formula))
+        option = "USER_ENTERED" if formula else "RAW"
+        grouped.setdefault((tab, option), {})[(row, col)] = value
+
+    data: Dict[str, List[Dict[str, Any]]] = {}
+    for (tab, option), cells in grouped.items():
+        prefix = f"{quote_sheet_title(tab)}!" if tab else ""
+        for row0, col0, row1, col1, values in _rectangles(cells):
+            a1 = f"{column_letter(col0)}{row0}"
+            if (row0, col0) != (row1, col1):
+                a1 += f":{column_letter(col1)}{row1}"
+            data.setdefault(option, []).append(
+                {"range": prefix + a1, "majorDimension": "ROWS", "values": values}
+            )
+
+    changes.sort(key=lambda c: (c.tab or "", c.row, c.column))
+    return WritePlan(changes, unchanged, data)
+
+
+def apply_plan(
+    service, spreadsheet_id: str, plan: WritePlan, user=None
+) -> Dict[str, int]:
+    """Send a plan; one batchUpdate per value input option
+
+    user is the rate-limit identity of service's credential.
+    """
+    updated = 0
+    requests = plan.requests(spreadsheet_id)
+    for kwargs in requests:
+        request = service.spreadsheets().values().batchUpdate(**kwargs)
+        result = rate_limit.execute(request, "sheets_write", user=user)
+        updated += int(result.get("totalUpdatedCells", 0))
+    return {"requests": len(requests), "updated_cells": updated}
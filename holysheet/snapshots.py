@@ -0,0 +1,244 @@
+"""
+Columnar on-disk snapshots of loaded sheets.
+
+Reading a large tab through the Sheets API takes seconds and counts against
+the quota, and until now every server restart and every new Streamlit
+process paid that again. A SnapshotStore writes each loaded, type-converted
+frame as an uncompressed Arrow IPC file keyed by spreadsheet, range and
+revision. Reading one back memory-maps the file: numeric, date and
+categorical columns point straight into the mapped pages instead of being
+copied, so a cold start costs milliseconds and every process on the host
+shares the same page cache rather than holding a private copy. Such columns
+are read-only, which is fine because cached frames are never modified in
+place.
+
+Snapshots are only used when the spreadsheet revision is known (see
+sheet_cache.drive_revision_lookup); a newer revision simply misses and the
+old file is replaced by the next save. Files are pruned oldest-first once
+the directory passes its byte budget.
+
+frame_to_bytes and frame_from_bytes use the same Arrow IPC format for frames
+kept elsewhere (session snapshots in a shared StateBackend). Unlike pickle,
+reading one back never runs code from the stored bytes.
+
+pyarrow is optional. Without it from_settings returns None and sheets are
+loaded from the API as before.
+
+    store = SnapshotStore(".holysheet/snapshots")
+    store.save("1AbC", "Ledger", "812", frame)
+    frame = store.load("1AbC", "Ledger", "812")
+"""
+
+import glob
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, Optional
+
+import pandas as pd
+
+from holysheet.config import Settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # optional dependency
+    pa = None
+
+SUFFIX = ".arrow"
+
+
+def available() -> bool:
+    """True when pyarrow is installed"""
+    return pa is not None
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def frame_to_bytes(frame: pd.DataFrame) -> Optional[bytes]:
+    """frame as an Arrow IPC stream, or None when it has no Arrow form"""
+    if pa is None:
+        return None
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowException, TypeError, ValueError):
+        # Mixed-type object columns have no Arrow type
+        return None
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def frame_from_bytes(data: bytes) -> Optional[pd.DataFrame]:
+    """The frame written by frame_to_bytes, or None when unreadable"""
+    if pa is None:
+        return None
+    try:
+        table = pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+    except pa.ArrowException:
+        return None
+    return table.to_pandas(split_blocks=True)
+
+
+class SnapshotStore:
+    """Arrow files under directory/<spreadsheet>/<range>.<revision>.arrow"""
+
+    def __init__(self, directory: str, max_bytes: int = 2048 * 1024 * 1024):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for sheet snapshots")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.failures = 0
+        self.pruned = 0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> Optional["SnapshotStore"]:
+        """Store configured by the settings, or None when disabled or unavailable"""
+        if not settings.sheet_snapshot_dir or pa is None:
+            return None
+        return cls(
+            settings.sheet_snapshot_dir,
+            max_bytes=settings.sheet_snapshot_max_mb * 1024 * 1024,
+        )
+
+    def _folder(self, spreadsheet_id: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w-]", "_", spreadsheet_id))
+
+    def path(self, spreadsheet_id: str, range_name: str, revision: str) -> str:
+        name = f"{_digest(range_name)}.{_digest(revision)}{SUFFIX}"
+        return os.path.join(self._folder(spreadsheet_id), name)
+
+    def _read(self, path: str) -> Optional[pd.DataFrame]:
+        try:
+            # Buffers keep the mapping alive for as long as the frame needs it
+            source = pa.memory_map(path, "r")
+            table = pa.ipc.open_file(source).read_all()
+            frame = table.to_pandas(split_blocks=True)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, pa.ArrowException):
+            # Truncated or unreadable file: drop it and load from the API
+            self.failures += 1
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # recently used, so pruned last
+        except OSError:
+            pass
+        self.hits += 1
+        return frame
+
+    def load(
+        self, spreadsheet_id: str, range_name: str, revision: str
+    ) -> Optional[pd.DataFrame]:
+        """The snapshot taken at revision, memory-mapped, or None"""
+        return self._read(self.path(spreadsheet_id, range_name, revision))
+
+    def latest(self, spreadsheet_id: str, range_name: str) -> Optional[pd.DataFrame]:
+        """The range's snapshot at whatever revision it was taken, or None
+
+        Only a starting point for an incremental refresh; the caller can't
+        assume it is current.
+        """
+        prefix = os.path.join(self._folder(spreadsheet_id), _digest(range_name))
+        # save() keeps one revision per range
+        for path in glob.glob(f"{prefix}.*{SUFFIX}"):
+            return self._read(path)
+        return None
+
+    def save(
+        self, spreadsheet_id: str, range_name: str, revision: str, frame: pd.DataFrame
+    ) -> bool:
+        """Write frame as the snapshot at revision; False if it can't be stored"""
+        path = self.path(spreadsheet_id, range_name, revision)
+        try:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowException, TypeError, ValueError):
+            # Mixed-type object columns have no Arrow type
+            self.failures += 1
+            return False
+        if table.nbytes > self.max_bytes:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Uncompressed, so a reader can map the columns as they are
+            with pa.OSFile(temporary, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(temporary, path)
+        except OSError:
+            self.failures += 1
+            self._remove(temporary)
+            return False
+        self.writes += 1
+        # Older revisions of the same range are never read again
+        prefix = os.path.join(os.path.dirname(path), _digest(range_name))
+        for stale in glob.glob(f"{prefix}.*{SUFFIX}"):
+            if stale != path:
+                self._remove(stale)
+        self.prune()
+        return True
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _files(self):
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*", f"*{SUFFIX}")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def prune(self) -> int:
+        """Remove least recently used snapshots until under the byte budget"""
+        with self._lock:
+            files = sorted(self._files())
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                # Mapped files stay readable on POSIX until unmapped
+                self._remove(path)
+                total -= size
+                removed += 1
+            self.pruned += removed
+            return removed
+
+    def invalidate(self, spreadsheet_id: Optional[str] = None) -> None:
+        """Forget one spreadsheet's snapshots, or all of them"""
+        if spreadsheet_id is None:
+            paths = glob.glob(os.path.join(self.directory, "*", f"*{SUFFIX}"))
+        else:
+            paths = glob.glob(os.path.join(self._folder(spreadsheet_id), f"*{SUFFIX}"))
+        for path in paths:
+            self._remove(path)
+
+    def stats(self) -> Dict[str, int]:
+        files = self._files()
+        return {
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "failures": self.failures,
+            "pruned": self.pruned,
+        }
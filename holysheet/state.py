@@ -0,0 +1,194 @@
+"""
+Shared state for running the server with several worker processes.
+
+Sessions and loaded sheets normally live in one process's memory, which pins
+every user to a single event loop. A StateBackend stores them in a place
+every worker can reach, so a WebSocket reconnect (or a second tab) that lands
+on another worker resumes the same session. The memory backend keeps the
+old single-process behaviour; the SQLite backend shares one local file
+between workers on the same machine.
+
+Values are bytes with an optional time to live, grouped by namespace
+("session", "sheet", ...).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+BACKENDS = ("memory", "sqlite")
+
+
+class StateBackend:
+    """Key/value store with per-entry expiry"""
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(
+        self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None
+    ) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    def expire(self, namespace: str, key: str, ttl: Optional[float]) -> None:
+        """Give an existing entry a new time to live"""
+        value = self.get(namespace, key)
+        if value is not None:
+            self.set(namespace, key, value, ttl=ttl)
+
+    def purge_expired(self) -> int:
+        return 0
+
+    @property
+    def shared(self) -> bool:
+        """True when other processes see the same state"""
+        return False
+
+
+class MemoryStateBackend(StateBackend):
+    """Per-process dict; fine for a single worker"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._data: Dict[Tuple[str, str], Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires <= self._clock():
+                del self._data[(namespace, key)]
+                return None
+            return value
+
+    def set(
+        self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None
+    ) -> None:
+        expires = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[(namespace, key)] = (value, expires)
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def expire(self, namespace: str, key: str, ttl: Optional[float]) -> None:
+        now = self._clock()
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is not None and (item[1] is None or item[1] > now):
+                self._data[(namespace, key)] = (item[0], expires)
+
+    def purge_expired(self) -> int:
+        now = self._clock()
+        with self._lock:
+            expired = [
+                k
+                for k, (_, exp) in self._data.items()
+                if exp is not None and exp <= now
+            ]
+            for k in expired:
+                del self._data[k]
+        return len(expired)
+
+
+class SQLiteStateBackend(StateBackend):
+    """One SQLite file shared by all workers on the host (WAL mode)"""
+
+    def __init__(
+        self,
+        path: str = ".holysheet/state.sqlite",
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Workers write concurrently; wait for the lock rather than failing
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " expires REAL, PRIMARY KEY (namespace, key))"
+        )
+        self._db.commit()
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires FROM state WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] <= self._clock():
+            self.delete(namespace, key)
+            return None
+        return bytes(row[0])
+
+    def set(
+        self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None
+    ) -> None:
+        expires = self._clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value, expires)"
+                " VALUES (?, ?, ?, ?)",
+                (namespace, key, sqlite3.Binary(value), expires),
+            )
+            self._db.commit()
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            )
+            self._db.commit()
+
+    def expire(self, namespace: str, key: str, ttl: Optional[float]) -> None:
+        now = self._clock()
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            # Entries that already expired stay expired
+            self._db.execute(
+                "UPDATE state SET expires = ? WHERE namespace = ? AND key = ?"
+                " AND (expires IS NULL OR expires > ?)",
+                (expires, namespace, key, now),
+            )
+            self._db.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM state WHERE expires IS NOT NULL AND expires <= ?",
+                (self._clock(),),
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    @property
+    def shared(self) -> bool:
+        return self.path != ":memory:"
+
+
+def state_backend_from_settings(settings) -> StateBackend:
+    if settings.state_backend == "sqlite":
+        return SQLiteStateBackend(settings.state_path)
+    if settings.state_backend == "memory":
+        return MemoryStateBackend()
+    raise ValueError(
+        f"Unknown state backend {settings.state_backend!r}; "
+        f"expected one of {', '.join(BACKENDS)}"
+    )
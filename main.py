@@ -4,154 +4,955 @@ HolySheet - FastAPI + Tailwind CSS Version
 Clean, fast, real-time Google Sheets analysis with Claude AI
 """
 
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-import json
 import asyncio
-from typing import List
-import uvicorn
-
-# Import our existing backend logic
-import anthropic
-import pandas as pd
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
+import json
 import os
 import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import Optional
+
+import anthropic
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+
+from holysheet import prompts, rate_limit
+from holysheet.analytics import ACTION_SECTIONS, action_findings, analyze_frame
+from holysheet.concurrency import ConcurrencyLimiter, QueueTimeout
+from holysheet.config import Settings
+from holysheet.connections import ConnectionManager
+from holysheet.context import build_sheet_context
+from holysheet.google_clients import (
+    client_factory_for_credentials,
+    client_factory_for_token,
+)
+from holysheet.preview import PreviewViews, rows_window
+from holysheet.providers import AnthropicProvider, Completion, ProviderRouter
+from holysheet.query_tools import QueryTools, ToolError, describe_tables
+from holysheet.response_cache import frame_fingerprint, get_response_cache, make_key
+from holysheet.sessions import Session, SessionRegistry
+from holysheet.sheet_cache import drive_revision_lookup, get_sheet_cache
+from holysheet.sheet_loader import (
+    get_workbook_info,
+    load_frame,
+    load_workbook,
+    refresh_frame,
+    split_range,
+)
+from holysheet.state import state_backend_from_settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Evict idle sessions in the background while the server runs
+    reaper = asyncio.create_task(holysheet_api.sessions.reap_forever())
+    try:
+        yield
+    finally:
+        reaper.cancel()
+
 
-app = FastAPI(title="HolySheet", description="Divine Google Sheets Analysis")
+app = FastAPI(
+    title="HolySheet", description="Divine Google Sheets Analysis", lifespan=lifespan
+)
+# Row windows and page assets compress well (repeated labels, numbers)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # Setup templates and static files
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# WebSocket connection manager for real-time updates
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# WebSocket fan-out with per-connection send queues
+manager = ConnectionManager.from_settings(Settings.from_env())
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+def session_analysis(session: Session):
+    """Whole-sheet findings for the active sheet, with its real row numbers"""
+    first_row, first_column = session.first_row, session.first_column
+    return session.derived(
+        "analysis",
+        lambda frame: analyze_frame(frame, first_row, first_column=first_column),
+    )
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
-
-manager = ConnectionManager()
 
 # Our existing HolySheet logic (converted to async)
 class HolySheetAPI:
-    def __init__(self):
+    def __init__(self, settings: Settings = None):
+        self.settings = settings or Settings.from_env()
         self.claude = None
         self.sheets_service = None
-        
+        self.drive_service = None  # optional, only used for revision checks
+        # Rate-limit identity of the server's own credential
+        self.token_file = None
+        self.sheet_cache = get_sheet_cache()
+        # Caps in-flight Claude calls globally and per WebSocket session
+        self.limiter = ConcurrencyLimiter.from_settings(self.settings)
+        # Anthropic and/or a local OpenAI-compatible model, with fallback
+        self.router = ProviderRouter.from_settings(self.settings)
+        # Per-user frames, history and clients; shared between worker
+        # processes when HOLYSHEET_STATE_BACKEND=sqlite
+        self.state = state_backend_from_settings(self.settings)
+        self.sessions = SessionRegistry.from_settings(self.settings, backend=self.state)
+        # Quick action answers (an SQLite file every worker can read)
+        self.response_cache = get_response_cache()
+
+        # Server-wide defaults; sessions may bring their own clients
+        if os.getenv("ANTHROPIC_API_KEY"):
+            self.setup_claude(os.getenv("ANTHROPIC_API_KEY"))
+
     def setup_claude(self, api_key: str):
         try:
-            self.claude = anthropic.Anthropic(api_key=api_key)
+            # Async client so a long generation never blocks the event loop;
+            # retries happen in rate_limit so they respect the shared quota
+            self.claude = anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
             return True
         except Exception as e:
             return False
-            
+
+    def setup_google_auth(self, token_file: str = "token.json"):
+        """Use an existing OAuth token (created by the Streamlit apps) if present"""
+        try:
+            if not os.path.exists(token_file):
+                return False
+            # Shared, pooled clients; the token is refreshed in the background
+            google = client_factory_for_token(token_file, self.settings)
+            self.sheets_service = google.sheets()
+            self.drive_service = google.drive()
+            self.token_file = token_file
+            return True
+        except Exception as e:
+            return False
+
+    def setup_session_google(self, session: Session, token_info: dict):
+        """Give one session its own Google clients from an authorized-user token
+
+        Returns an error message, or None once the session's client is set.
+        """
+        try:
+            from google.oauth2.credentials import Credentials
+
+            credentials = Credentials.from_authorized_user_info(token_info)
+            google = client_factory_for_credentials(credentials, self.settings)
+        except Exception as e:
+            return f"Google setup error: {str(e)}"
+        session.set_google(google)
+        return None
+
+    def google_user(self, session: Session):
+        """Per-user quota identity of the Google client a session reads with
+
+        Google counts per-user quota per credential: the session's own one,
+        or the server's token file shared by every other session.
+        """
+        if session.sheets_service:
+            return f"session:{session.session_id}"
+        return self.token_file
+
     def extract_sheet_id(self, url_or_id: str):
-        if 'docs.google.com/spreadsheets' in url_or_id:
-            match = re.search(r'/spreadsheets/d/([a-zA-Z0-9-_]+)', url_or_id)
+        if "docs.google.com/spreadsheets" in url_or_id:
+            match = re.search(r"/spreadsheets/d/([a-zA-Z0-9-_]+)", url_or_id)
             return match.group(1) if match else None
         return url_or_id
-    
-    def read_sheet_data(self, sheet_id: str, range_name: str = 'A1:Z1000'):
+
+    def read_sheet_data(
+        self, sheet_id: str, range_name: str = None, service=None, user=None
+    ):
         try:
-            if not self.sheets_service:
+            service = service or self.sheets_service
+            if not service:
                 return None, "Google Sheets not connected"
-            
-            result = self.sheets_service.spreadsheets().values().get(
-                spreadsheetId=sheet_id, range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            if not values:
+            if service is not self.sheets_service:
+                # A session's own credentials: never answered from (or stored
+                # in) the cache filled with the server's
+                df = load_frame(service, sheet_id, range_name, self.settings, user=user)
+                return (
+                    (df, None) if df is not None else (None, "No data found in sheet")
+                )
+
+            def load():
+                return load_frame(
+                    service, sheet_id, range_name, self.settings, user=self.token_file
+                )
+
+            tab, cells = split_range(range_name)
+
+            def refresh(old):
+                # Append-only ledgers: fetch just the rows added since
+                return refresh_frame(
+                    service,
+                    sheet_id,
+                    tab,
+                    old,
+                    self.settings,
+                    self.settings.sheet_refresh_overlap_rows,
+                    user=self.token_file,
+                )[0]
+
+            revision_lookup = None
+            if self.drive_service:
+                revision_lookup = drive_revision_lookup(
+                    self.drive_service, self.token_file
+                )
+            if cells is None and self.settings.sheet_refresh_overlap_rows > 0:
+                df = self.sheet_cache.get_or_refresh(
+                    sheet_id, range_name or "", load, refresh, revision_lookup
+                )
+            else:
+                df = self.sheet_cache.get_or_load(
+                    sheet_id, range_name or "", load, revision_lookup
+                )
+            if df is None:
                 return None, "No data found in sheet"
-            
-            df = pd.DataFrame(values[1:], columns=values[0] if values else [])
             return df, None
-            
+
         except Exception as e:
             return None, f"Error reading sheet: {str(e)}"
-    
-    async def chat_with_claude(self, message: str, sheet_data=None, sheet_name=""):
+
+    async def load_sheet(
+        self, session: Session, url_or_id: str, range_name: str = None
+    ):
+        """Read a sheet off the event loop and attach it to the session"""
+        sheet_id = self.extract_sheet_id(url_or_id)
+        if not sheet_id:
+            return None, "Invalid Google Sheets URL or ID"
+        loop = asyncio.get_running_loop()
+        if not (session.sheets_service or self.sheets_service):
+            await loop.run_in_executor(None, self.setup_google_auth)
+
+        df, error = await loop.run_in_executor(
+            None,
+            self.read_sheet_data,
+            sheet_id,
+            range_name,
+            session.sheets_service,
+            self.google_user(session),
+        )
+        if df is None:
+            return None, error
+
+        title = await loop.run_in_executor(
+            None,
+            self.get_sheet_title,
+            sheet_id,
+            session.sheets_service,
+            self.google_user(session),
+        )
+        name = f"{sheet_id}:{range_name or ''}"
         try:
-            if sheet_data is not None:
-                data_sample = sheet_data.head(50).to_string(index=False)
-                prompt = f"""Sheet: "{sheet_name}"
-                
-Sample data (first 50 rows):
-{data_sample}
+            # May write a snapshot to the state backend, so keep it off the loop
+            await loop.run_in_executor(
+                None, self.sessions.attach_frame, session, name, df, title
+            )
+        except MemoryError as e:
+            return None, str(e)
+        return session.describe()["sheets"][name], None
 
-Total rows: {len(sheet_data)}
-Columns: {list(sheet_data.columns)}
+    def read_workbook(self, sheet_id: str, tabs=None, service=None, user=None):
+        """(workbook info, {tab: frame}, error): one metadata call, then every
+        tab not already cached in shared batchGet calls"""
+        try:
+            service = service or self.sheets_service
+            if not service:
+                return None, None, "Google Sheets not connected"
+            if service is self.sheets_service:
+                user = self.token_file
 
-User request: {message}
+            info = get_workbook_info(service, sheet_id, user)
+            chosen = [tab.title for tab in info.tabs] if not tabs else list(tabs)
 
-Please provide specific, actionable advice about this financial data. Include exact formulas, cell ranges, or step-by-step instructions where helpful."""
-            else:
-                prompt = message
-            
-            response = self.claude.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
+            def load(missing):
+                return load_workbook(
+                    service, sheet_id, missing, self.settings, info=info, user=user
+                )[1]
+
+            if service is not self.sheets_service:
+                # Session credentials bypass the shared cache (see read_sheet_data)
+                frames = {t: f for t, f in load(chosen).items() if f is not None}
+                if not frames:
+                    return None, None, "No data found in workbook"
+                return info, frames, None
+
+            revision_lookup = None
+            if self.drive_service:
+                revision_lookup = drive_revision_lookup(
+                    self.drive_service, self.token_file
+                )
+            # Same cache keys as loading one tab by name
+            frames = self.sheet_cache.get_or_load_many(
+                sheet_id, chosen, load, revision_lookup
+            )
+            if not frames:
+                return None, None, "No data found in workbook"
+            return info, frames, None
+
+        except Exception as e:
+            return None, None, f"Error reading workbook: {str(e)}"
+
+    async def load_workbook(self, session: Session, url_or_id: str, tabs=None):
+        """Load every tab (or the chosen ones) as named tables of the session"""
+        sheet_id = self.extract_sheet_id(url_or_id)
+        if not sheet_id:
+            return None, "Invalid Google Sheets URL or ID"
+        loop = asyncio.get_running_loop()
+        if not (session.sheets_service or self.sheets_service):
+            await loop.run_in_executor(None, self.setup_google_auth)
+
+        info, frames, error = await loop.run_in_executor(
+            None,
+            self.read_workbook,
+            sheet_id,
+            tabs,
+            session.sheets_service,
+            self.google_user(session),
+        )
+        if error:
+            return None, error
+
+        names = []
+        try:
+            for title, df in frames.items():
+                name = f"{sheet_id}:{title}"
+                await loop.run_in_executor(
+                    None, self.sessions.attach_frame, session, name, df, title
+                )
+                names.append(name)
+        except MemoryError as e:
+            return None, str(e)
+        # The first tab is the active sheet; the others are there to query
+        session.active_sheet = names[0]
+        self.sessions.save(session)
+        sheets = session.describe()["sheets"]
+        return {
+            "title": info.title,
+            "active": sheets[names[0]]["title"],
+            "tabs": [sheets[name] for name in names if name in sheets],
+        }, None
+
+    def get_sheet_title(self, sheet_id: str, service=None, user=None):
+        try:
+            service = service or self.sheets_service
+            if service is self.sheets_service:
+                user = self.token_file
+            sheet = rate_limit.execute(
+                service.spreadsheets().get(
+                    spreadsheetId=sheet_id, fields="properties.title"
+                ),
+                user=user,
+            )
+            return sheet.get("properties", {}).get("title", "Unknown Sheet")
+        except Exception:
+            return "Unknown Sheet"
+
+    def sheet_context(self, sheet_data, first_row: int = 2, first_column: int = 1):
+        return build_sheet_context(
+            sheet_data,
+            budget_tokens=self.settings.context_token_budget,
+            first_row=first_row,
+            first_column=first_column,
+        )
+
+    def build_request(
+        self,
+        message: str,
+        sheet_data=None,
+        sheet_name="",
+        session: Optional[Session] = None,
+        action: Optional[str] = None,
+    ):
+        """messages API arguments; instructions + sheet context form the cached prefix
+
+        Quick actions also get findings computed locally over every row.
+        Other chat messages carry the session's earlier turns within the
+        history budget (quick actions stand alone so their answers can be
+        cached).
+        """
+        sheet_context = analysis = None
+        wants_findings = action in ACTION_SECTIONS
+        if sheet_data is None and session is not None:
+            sheet_data, sheet_name = session.sheet_data, session.sheet_name
+            first_row, first_column = session.first_row, session.first_column
+            # Reused across turns while the session's frame is unchanged
+            sheet_context = session.sheet_context(
+                lambda frame: self.sheet_context(frame, first_row, first_column)
+            )
+            if wants_findings:
+                analysis = session_analysis(session)
+        elif sheet_data is not None:
+            sheet_context = self.sheet_context(sheet_data)
+            if wants_findings:
+                analysis = analyze_frame(sheet_data)
+        findings = action_findings(analysis, action) if analysis is not None else None
+        if (
+            session is not None
+            and sheet_context is not None
+            and len(session.frames) > 1
+        ):
+            # Other loaded tabs the query tools can read and join
+            sheet_context += "\n\n" + describe_tables(
+                session.tables, session.sheet_name
+            )
+        history = summary = None
+        if session is not None and action is None:
+            history = session.memory.window(session.history, message)
+            summary = session.memory.summary
+        return prompts.build_request(
+            message,
+            sheet_context,
+            sheet_name,
+            findings=findings,
+            history=history,
+            summary=summary,
+        )
+
+    def cached_answer(
+        self, message: str, session: Session, action: Optional[str] = None
+    ):
+        """(cache key, saved answer or None) for a quick action on the session's sheet
+
+        Keyed on the model the action is routed to first, so answers from
+        different models are never mixed up.
+        """
+        request = self.build_request(message, session=session, action=action)
+        providers = self.providers_for(session, quick=True)
+        model = providers[0].model if providers else self.settings.claude_model
+        key = make_key(
+            model,
+            request["system"],
+            request["messages"],
+            session.fingerprint(frame_fingerprint),
+        )
+        return key, self.response_cache.get(key), model
+
+    def client_for(self, session: Optional[Session] = None):
+        if session is not None and session.claude is not None:
+            return session.claude
+        return self.claude
+
+    def providers_for(
+        self, session: Optional[Session] = None, quick: bool = False, sheet_data=None
+    ):
+        """Providers to try for a request, preferred first"""
+        client = self.client_for(session)
+        anthropic_provider = None
+        if client is not None:
+            anthropic_provider = AnthropicProvider(
+                client, self.settings.claude_model, self.settings.max_tokens
+            )
+        if sheet_data is None and session is not None:
+            sheet_data = session.sheet_data
+        rows = len(sheet_data) if sheet_data is not None else None
+        return self.router.route(anthropic_provider, quick=quick, rows=rows)
+
+    def query_tools_for(self, sheet_data=None, session: Optional[Session] = None):
+        """Local query tools over the whole sheet, or None without one"""
+        tables = None
+        first_row = 2
+        if sheet_data is None and session is not None:
+            sheet_data, tables = session.sheet_data, session.tables
+            first_row = session.first_row
+        if sheet_data is None or not self.settings.query_tools:
+            return None
+        return QueryTools.from_settings(
+            sheet_data, self.settings, first_row=first_row, tables=tables
+        )
+
+    async def answer(
+        self,
+        message: str,
+        sheet_data=None,
+        sheet_name="",
+        session_id=None,
+        session: Optional[Session] = None,
+        action: Optional[str] = None,
+    ) -> Completion:
+        """Completion from the routed provider; errors come back as text"""
+        try:
+            request = self.build_request(
+                message, sheet_data, sheet_name, session, action
+            )
+            providers = self.providers_for(session, action is not None, sheet_data)
+            tools = self.query_tools_for(sheet_data, session)
+            if session is not None:
+                session_id = session.session_id
+
+            async with self.limiter.slot(session_id):
+                completion = await self.router.complete(
+                    request, providers, user=session_id, tools=tools
+                )
+            if session is not None:
+                session.memory.record_usage(completion.usage)
+            return completion
+
+        except QueueTimeout as e:
+            text = f"Error: Server is busy, please try again ({e})"
+        except Exception as e:
+            text = f"Error: {str(e)}"
+        return Completion(text, provider="", model="")
+
+    async def chat_with_claude(
+        self,
+        message: str,
+        sheet_data=None,
+        sheet_name="",
+        session_id=None,
+        session: Optional[Session] = None,
+        action: Optional[str] = None,
+    ):
+        completion = await self.answer(
+            message, sheet_data, sheet_name, session_id, session, action
+        )
+        return completion.text
+
+    async def stream_chat_with_claude(
+        self,
+        message: str,
+        sheet_data=None,
+        sheet_name="",
+        session_id=None,
+        session: Optional[Session] = None,
+        action: Optional[str] = None,
+    ):
+        """Yield (event, payload) pairs: start, delta..., end (or error)"""
+        requested = time.perf_counter()
+        first_token = None
+        try:
+            request = self.build_request(
+                message, sheet_data, sheet_name, session, action
             )
-            
-            return response.content[0].text
-            
+            providers = self.providers_for(session, action is not None, sheet_data)
+            tools = self.query_tools_for(sheet_data, session)
+            if session is not None:
+                session_id = session.session_id
+
+            async with self.limiter.slot(session_id):
+                started = time.perf_counter()
+                # Falls back to the next provider until the reply has started
+                async for event, payload in self.router.stream(
+                    request, providers, user=session_id, tools=tools
+                ):
+                    if event == "open":
+                        yield "start", {
+                            "model": payload.model,
+                            "provider": payload.name,
+                            "queued_ms": round((started - requested) * 1000),
+                        }
+                    elif event == "delta":
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                        yield "delta", {"text": payload}
+                    elif event == "tool":
+                        # A query the model ran on the sheet, with its timing
+                        yield "tool", payload
+                    else:
+                        final = payload
+
+            finished = time.perf_counter()
+            if session is not None:
+                session.memory.record_usage(final.usage)
+            yield "end", {
+                "stop_reason": final.stop_reason,
+                "model": final.model,
+                # Includes prompt cache writes/reads for this request
+                "usage": final.usage,
+                "tool_calls": final.tool_calls,
+                "timing": {
+                    "queued_ms": round((started - requested) * 1000),
+                    "ttft_ms": (
+                        round((first_token - started) * 1000)
+                        if first_token is not None
+                        else None
+                    ),
+                    "total_ms": round((finished - requested) * 1000),
+                },
+            }
+
+        except QueueTimeout as e:
+            yield "error", {"message": f"Server is busy, please try again ({e})"}
         except Exception as e:
-            return f"Error: {str(e)}"
+            yield "error", {"message": f"Error: {str(e)}"}
+
+    async def compact_history(self, session: Session):
+        """Fold the session's oldest turns into its summary once over budget"""
+
+        async def summarize(summary, turns):
+            request = prompts.build_summary_request(
+                summary, turns, self.settings.history_summary_tokens
+            )
+            # Quick, so the local model goes first in auto mode
+            providers = self.providers_for(session, quick=True)
+            async with self.limiter.slot(session.session_id):
+                completion = await self.router.complete(
+                    request, providers, user=session.session_id
+                )
+            session.memory.record_usage(completion.usage, kind="summary")
+            return completion.text
+
+        if await session.memory.compact_async(session.history, summarize):
+            self.sessions.save(session)
+
 
 # Global instance
 holysheet_api = HolySheetAPI()
 
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+
 @app.get("/profile", response_class=HTMLResponse)
 async def profile(request: Request):
     return templates.TemplateResponse("profile.html", {"request": request})
 
+
 @app.get("/account", response_class=HTMLResponse)
 async def account(request: Request):
     return templates.TemplateResponse("account.html", {"request": request})
 
+
+@app.get("/stats")
+async def stats():
+    """Queue depths and counters for monitoring"""
+    return {
+        "chats": holysheet_api.limiter.stats(),
+        "sessions": holysheet_api.sessions.stats(),
+        "sheets": holysheet_api.sheet_cache.stats(),
+        "connections": manager.stats(),
+        "apis": rate_limit.get_governor().stats(),
+        "models": holysheet_api.router.stats(),
+    }
+
+
+@app.get("/api/rows")
+async def rows(
+    session: str,
+    offset: int = 0,
+    limit: int = 200,
+    sort: Optional[str] = None,
+    desc: bool = False,
+    q: Optional[str] = None,
+    where: Optional[str] = None,
+):
+    """A window of the active sheet, filtered and sorted on the server"""
+    # May read the session's frames from the state backend
+    current = await asyncio.get_running_loop().run_in_executor(
+        None, holysheet_api.sessions.resume, session
+    )
+    if current is None or current.sheet_data is None:
+        raise HTTPException(status_code=404, detail="No sheet loaded for this session")
+    try:
+        conditions = json.loads(where) if where else None
+    except ValueError:
+        conditions = False
+    if conditions is False or (
+        conditions is not None
+        and not (
+            isinstance(conditions, list)
+            and all(isinstance(c, dict) for c in conditions)
+        )
+    ):
+        raise HTTPException(
+            status_code=400, detail="where must be a JSON list of conditions"
+        )
+    frame = current.sheet_data
+    views = current.derived("preview", lambda frame: PreviewViews())
+
+    def window():
+        order = views.order(frame, sort, desc, conditions, q)
+        return rows_window(frame, order, offset, limit, current.first_row)
+
+    try:
+        # Sorting a large sheet takes a moment, so keep it off the loop
+        return await asyncio.get_running_loop().run_in_executor(None, window)
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def handle_chat(message_data: dict, websocket: WebSocket, session: Session):
+    session.history.append({"role": "user", "content": message_data["message"]})
+    request_id = message_data.get("request_id") or uuid.uuid4().hex[:12]
+
+    # Quick actions on a loaded sheet are answered from the response cache
+    action = message_data.get("action")
+    if action not in prompts.QUICK_ACTIONS:
+        action = None
+    cache_key = cache_model = None
+    if action is not None and session.sheet_data is not None:
+        # Also computes the action's findings over the whole sheet, off the loop
+        loop = asyncio.get_running_loop()
+        cache_key, cached, cache_model = await loop.run_in_executor(
+            None, holysheet_api.cached_answer, message_data["message"], session, action
+        )
+        if "near_duplicates" in ACTION_SECTIONS.get(action, ()):
+            await send_duplicates(websocket, session, request_id)
+        if cached is not None:
+            await send_cached_answer(
+                message_data, websocket, session, request_id, cached, cache_model
+            )
+            await holysheet_api.compact_history(session)
+            return
+
+    if not message_data.get("stream", False):
+        completion = await holysheet_api.answer(
+            message_data["message"],
+            session=session,
+            action=action,
+        )
+        response = completion.text
+        session.history.append({"role": "assistant", "content": response})
+        holysheet_api.sessions.save(session)
+        # Only answers from the model the key was made for (not a fallback)
+        if cache_key is not None and completion.model == cache_model:
+            holysheet_api.response_cache.put(
+                cache_key, {"text": response, "usage": None}
+            )
+        await manager.send_personal_message(
+            {"type": "chat_response", "message": response}, websocket
+        )
+        # After the reply, so summarizing never delays an answer
+        await holysheet_api.compact_history(session)
+        return
+
+    # Streaming mode: chat_start, chat_delta..., chat_end share one request id
+    parts = []
+    end = None
+    async for event, payload in holysheet_api.stream_chat_with_claude(
+        message_data["message"],
+        session=session,
+        action=action,
+    ):
+        if event == "delta":
+            parts.append(payload["text"])
+        elif event == "end":
+            end = payload
+        await manager.send_personal_message(
+            {"type": f"chat_{event}", "request_id": request_id, **payload}, websocket
+        )
+    text = "".join(parts)
+    session.history.append({"role": "assistant", "content": text})
+    holysheet_api.sessions.save(session)
+    if cache_key is not None and end is not None and end["model"] == cache_model:
+        holysheet_api.response_cache.put(
+            cache_key, {"text": text, "usage": end["usage"]}
+        )
+    await holysheet_api.compact_history(session)
+
+
+async def send_duplicates(websocket: WebSocket, session: Session, request_id: str):
+    """Near-duplicate clusters of the active sheet as row numbers to highlight"""
+    analysis = session_analysis(session)
+    if analysis is None:
+        return
+    await manager.send_personal_message(
+        {
+            "type": "duplicates",
+            "request_id": request_id,
+            "sheet": session.sheet_name,
+            "clusters": [asdict(c) for c in analysis.near_duplicates],
+        },
+        websocket,
+    )
+
+
+async def send_cached_answer(
+    message_data: dict,
+    websocket: WebSocket,
+    session: Session,
+    request_id: str,
+    cached: dict,
+    model: str,
+):
+    session.history.append({"role": "assistant", "content": cached["text"]})
+    holysheet_api.sessions.save(session)
+    if not message_data.get("stream", False):
+        frames = [{"type": "chat_response", "message": cached["text"], "cached": True}]
+    else:
+        frames = [
+            {
+                "type": "chat_start",
+                "request_id": request_id,
+                "model": model,
+                "cached": True,
+            },
+            {"type": "chat_delta", "request_id": request_id, "text": cached["text"]},
+            {
+                "type": "chat_end",
+                "request_id": request_id,
+                "stop_reason": "cached",
+                "cached": True,
+                "usage": cached.get("usage"),
+            },
+        ]
+    for frame in frames:
+        await manager.send_personal_message(frame, websocket)
+
+
+async def handle_load_sheet(message_data: dict, websocket: WebSocket, session: Session):
+    summary, error = await holysheet_api.load_sheet(
+        session, message_data.get("sheet", ""), message_data.get("range") or None
+    )
+    if error:
+        await manager.send_personal_message(
+            {"type": "error", "message": error}, websocket
+        )
+        return
+    await manager.send_personal_message(
+        {"type": "sheet_loaded", "data": summary}, websocket
+    )
+
+
+async def handle_load_workbook(
+    message_data: dict, websocket: WebSocket, session: Session
+):
+    summary, error = await holysheet_api.load_workbook(
+        session, message_data.get("sheet", ""), message_data.get("tabs") or None
+    )
+    if error:
+        await manager.send_personal_message(
+            {"type": "error", "message": error}, websocket
+        )
+        return
+    await manager.send_personal_message(
+        {"type": "workbook_loaded", "data": summary}, websocket
+    )
+
+
+async def handle_select_sheet(
+    message_data: dict, websocket: WebSocket, session: Session
+):
+    """Switch the active sheet (what analytics and the context describe)"""
+    if not session.select(message_data.get("sheet", "")):
+        await manager.send_personal_message(
+            {
+                "type": "error",
+                "message": f"No loaded sheet named {message_data.get('sheet')!r}",
+            },
+            websocket,
+        )
+        return
+    holysheet_api.sessions.save(session)
+    await manager.send_personal_message(
+        {
+            "type": "sheet_loaded",
+            "data": session.describe()["sheets"][session.active_sheet],
+        },
+        websocket,
+    )
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
+    # Resume the browser's session after a reconnect, or start a new one
+    session = await asyncio.get_running_loop().run_in_executor(
+        None,
+        holysheet_api.sessions.get_or_create,
+        websocket.query_params.get("session"),
+    )
+    session.connections += 1
+    await manager.send_personal_message(
+        {"type": "session", "session_id": session.session_id}, websocket
+    )
+    # Requests run as tasks so the receive loop keeps serving this socket
+    pending = set()
+    handlers = {
+        "chat": handle_chat,
+        "load_sheet": handle_load_sheet,
+        "load_workbook": handle_load_workbook,
+        "select_sheet": handle_select_sheet,
+    }
     try:
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
-            
+            holysheet_api.sessions.touch(session)
+
             # Handle different message types
-            if message_data["type"] == "chat":
-                response = await holysheet_api.chat_with_claude(
-                    message_data["message"],
-                    # Add sheet data if available
+            if message_data["type"] == "setup_claude":
+                session.claude = anthropic.AsyncAnthropic(
+                    api_key=message_data["api_key"], max_retries=0
                 )
-                await manager.send_personal_message(json.dumps({
-                    "type": "chat_response",
-                    "message": response
-                }), websocket)
-                
+            elif message_data["type"] == "setup_google":
+                # This browser's own OAuth token (authorized-user JSON)
+                error = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    holysheet_api.setup_session_google,
+                    session,
+                    message_data.get("token") or {},
+                )
+                await manager.send_personal_message(
+                    (
+                        {"type": "error", "message": error}
+                        if error
+                        else {"type": "google_connected"}
+                    ),
+                    websocket,
+                )
+            elif message_data["type"] in handlers:
+                handler = handlers[message_data["type"]]
+                task = asyncio.create_task(handler(message_data, websocket, session))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
+        session.connections -= 1
+        holysheet_api.sessions.touch(session)
+        for task in pending:
+            task.cancel()
+
+
+def parse_args(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the HolySheet server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="worker processes; more than one shares state via SQLite",
+    )
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="restart on code changes (single worker only)",
+    )
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    args = parse_args()
+    if args.workers > 1:
+        # Workers re-import this module and read the environment, so any
+        # worker can resume any session (no sticky routing needed)
+        os.environ.setdefault("HOLYSHEET_STATE_BACKEND", "sqlite")
+        if os.environ["HOLYSHEET_STATE_BACKEND"] == "memory":
+            raise SystemExit(
+                "--workers needs a shared state backend; "
+                "set HOLYSHEET_STATE_BACKEND=sqlite"
+            )
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            ws_per_message_deflate=True,
+        )
+    else:
+        uvicorn.run(
+            "main:app" if args.reload else app,
+            host=args.host,
+            port=args.port,
+            reload=args.reload,
+            ws_per_message_deflate=True,
+        )
@@ -10,27 +10,61 @@ pip install streamlit anthropic google-api-python-client google-auth-oauthlib pa
 import streamlit as st
 import anthropic
 import pandas as pd
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 import json
 import os
+import sys
+
+# Shared backend lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet import prompts, rate_limit
+from holysheet.config import Settings
+from holysheet.context import build_sheet_context
+from holysheet.google_clients import (
+    client_factory_for_credentials,
+    client_factory_for_token,
+)
+from holysheet.memory import ConversationMemory
+from holysheet.providers import AnthropicProvider, ProviderRouter
+from holysheet.query_tools import QueryTools, describe_calls
+from holysheet.sheet_cache import drive_revision_lookup, get_sheet_cache
+from holysheet.sheet_loader import load_frame, range_start_column, range_start_row
+from holysheet.sheet_writer import SheetAction, apply_plan, parse_actions, plan_writes
 
 class ClaudeSheetsAssistant:
     def __init__(self):
+        self.settings = Settings.from_env()
         self.claude = None
+        # Anthropic and/or a local OpenAI-compatible model (HOLYSHEET_LLM_PROVIDER)
+        self.router = ProviderRouter.from_settings(self.settings)
         self.sheets_service = None
+        self.drive_service = None
+        self.google_user = None  # rate-limit identity of the Google token
+        self.sheet_cache = get_sheet_cache()
+        # Which chat turns go with each request (st.session_state.messages)
+        self.memory = ConversationMemory.from_settings(self.settings)
+        self.last_usage = None
+        self.last_tool_calls = None
+        self._context_for = None
+        self._context_range = None
+        self._context_text = None
         
     def setup_claude(self, api_key):
-        self.claude = anthropic.Anthropic(api_key=api_key)
+        self.claude = anthropic.Anthropic(api_key=api_key, max_retries=0)
+        
+    def can_chat(self):
+        return self.claude is not None or self.router.local is not None
         
     def setup_google_auth(self):
         """Setup Google Sheets authentication"""
         # You'll need credentials.json from Google Cloud Console
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
+        scopes = ['https://www.googleapis.com/auth/spreadsheets',
+                  'https://www.googleapis.com/auth/drive.metadata.readonly']
         
         if os.path.exists('token.json'):
-            creds = Credentials.from_authorized_user_file('token.json', scopes)
+            # Keep the scopes the token was granted with; shared across reruns
+            google = client_factory_for_token('token.json', self.settings)
         else:
             flow = Flow.from_client_secrets_file('credentials.json', scopes)
             flow.redirect_uri = 'http://localhost:8080/callback'
@@ -47,34 +81,87 @@ class ClaudeSheetsAssistant:
                 
                 with open('token.json', 'w') as token:
                     token.write(creds.to_json())
+                google = client_factory_for_credentials(creds, self.settings,
+                                                        token_file='token.json')
+            else:
+                return
         
-        self.sheets_service = build('sheets', 'v4', credentials=creds)
+        # Pooled, thread-safe clients built from the bundled discovery documents
+        self.sheets_service = google.sheets()
+        self.drive_service = google.drive()
+        self.google_user = 'token.json'
         
     def read_sheet(self, sheet_id, range_name):
-        """Read data from Google Sheet"""
-        result = self.sheets_service.spreadsheets().values().get(
+        """Typed frame of the range, or None (cached until the sheet changes)
+
+        Same cache entries as main.py and the web app: typed frames only.
+        """
+        def load():
+            return load_frame(self.sheets_service, sheet_id, range_name, self.settings,
+                              user=self.google_user)
+        
+        revision_lookup = None
+        if self.drive_service:
+            revision_lookup = drive_revision_lookup(self.drive_service, self.google_user)
+        return self.sheet_cache.get_or_load(sheet_id, range_name or "", load,
+                                            revision_lookup)
+        
+    def read_values(self, sheet_id, range_name):
+        """Raw cell values of the range, read fresh (never from the shared cache)"""
+        result = rate_limit.execute(self.sheets_service.spreadsheets().values().get(
             spreadsheetId=sheet_id, range=range_name
-        ).execute()
+        ), user=self.google_user)
         return result.get('values', [])
         
+    def plan_actions(self, sheet_id, actions, range_name=None):
+        """Diff actions against the current grid (dry run, nothing is sent)"""
+        current = None
+        if range_name:
+            current = self.read_values(sheet_id, range_name)
+        return plan_writes(actions, current, range_name)
+        
+    def execute_plan(self, sheet_id, plan):
+        """Send only the changed cells, batched into one request"""
+        if plan.empty:
+            return {"requests": 0, "updated_cells": 0}
+        result = apply_plan(self.sheets_service, sheet_id, plan, self.google_user)
+        self.sheet_cache.invalidate(sheet_id)
+        return result
+        
     def write_sheet(self, sheet_id, range_name, values):
         """Write data to Google Sheet"""
-        body = {'values': values}
-        result = self.sheets_service.spreadsheets().values().update(
-            spreadsheetId=sheet_id, range=range_name,
-            valueInputOption='RAW', body=body
-        ).execute()
-        return result
+        plan = self.plan_actions(sheet_id, [SheetAction("WRITE", range_name, values)],
+                                 range_name)
+        return self.execute_plan(sheet_id, plan)
         
     def clear_sheet(self, sheet_id, range_name):
         """Clear a range in Google Sheet"""
-        result = self.sheets_service.spreadsheets().values().clear(
-            spreadsheetId=sheet_id, range=range_name
-        ).execute()
-        return result
+        plan = self.plan_actions(sheet_id, [SheetAction("CLEAR", range_name)], range_name)
+        return self.execute_plan(sheet_id, plan)
+        
+    def providers(self, rows=None, quick=False):
+        anthropic_provider = None
+        if self.claude is not None:
+            anthropic_provider = AnthropicProvider(self.claude, self.settings.claude_model,
+                                                   self.settings.max_tokens)
+        return self.router.route(anthropic_provider, quick=quick, rows=rows)
         
-    def chat_with_claude(self, message, sheet_data=None):
-        """Chat with Claude about the sheet data"""
+    def sheet_context(self, frame, range_name):
+        """Sheet description, rebuilt only when the frame or range changes"""
+        if self._context_for is not frame or self._context_range != range_name:
+            # Sampled rows keep their sheet row numbers for RANGE references
+            self._context_text = build_sheet_context(
+                frame,
+                budget_tokens=self.settings.context_token_budget,
+                first_row=range_start_row(range_name) + 1,
+                first_column=range_start_column(range_name),
+            )
+            self._context_for = frame
+            self._context_range = range_name
+        return self._context_text
+        
+    def chat_with_claude(self, message, sheet_data=None, range_name=None, history=None):
+        """Chat with Claude about the sheet data (and the chat so far)"""
         
         system_prompt = """You are a Google Sheets assistant. You can:
         1. Analyze spreadsheet data
@@ -95,17 +182,44 @@ class ClaudeSheetsAssistant:
         EXPLANATION: What this does
         """
         
-        if sheet_data:
-            message = f"Current sheet data:\n{sheet_data}\n\nUser request: {message}"
-            
-        response = self.claude.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=2000,
-            system=system_prompt,
-            messages=[{"role": "user", "content": message}]
+        sheet_context = tools = None
+        rows = None
+        if sheet_data is not None:
+            rows = len(sheet_data)
+            # Describe the range within the token budget instead of pasting it raw
+            sheet_context = self.sheet_context(sheet_data, range_name)
+            # The model can also query every row of the range locally
+            if self.settings.query_tools:
+                tools = QueryTools.from_settings(sheet_data, self.settings,
+                                                 range_start_row(range_name) + 1)
+        
+        # Instructions + sheet data are the cached prefix; only the request varies
+        request = prompts.build_request(
+            message, sheet_context, range_name or "", instructions=system_prompt,
+            history=self.memory.window(history or [], message),
+            summary=self.memory.summary,
+        )
+        # Anthropic calls are queued against the shared quota and retried on
+        # 429/5xx; a failed provider falls back to the other one
+        completion = self.router.complete_sync(
+            request, self.providers(rows=rows), tools=tools
         )
         
-        return response.content[0].text
+        self.last_usage = completion.usage
+        self.last_tool_calls = completion.tool_calls
+        self.memory.record_usage(completion.usage)
+        return completion.text
+    
+    def compact_history(self, history):
+        """Fold the oldest chat turns into the rolling summary once over budget"""
+        def summarize(summary, turns):
+            request = prompts.build_summary_request(
+                summary, turns, self.settings.history_summary_tokens)
+            completion = self.router.complete_sync(request, self.providers(quick=True))
+            self.memory.record_usage(completion.usage, kind="summary")
+            return completion.text
+        
+        self.memory.compact(history, summarize)
 
 def main():
     st.title("🤖 Claude Sheets Assistant")
@@ -167,26 +281,59 @@ def main():
                 st.error(f"Error reading sheet: {e}")
         
         # Get Claude's response
-        if st.session_state.assistant.claude:
+        if st.session_state.assistant.can_chat():
             try:
-                response = st.session_state.assistant.chat_with_claude(prompt, sheet_data)
+                response = st.session_state.assistant.chat_with_claude(
+                    prompt, sheet_data, range_name, history=st.session_state.messages)
                 
                 # Add Claude's response
                 st.session_state.messages.append({"role": "assistant", "content": response})
+                st.session_state.assistant.compact_history(st.session_state.messages)
                 with st.chat_message("assistant"):
                     st.write(response)
+                    if st.session_state.assistant.last_usage:
+                        st.caption(prompts.describe_usage(st.session_state.assistant.last_usage))
+                    if st.session_state.assistant.last_tool_calls:
+                        st.caption(describe_calls(st.session_state.assistant.last_tool_calls))
                     
-                    # Check if Claude wants to execute an action
+                    # Offer the proposed changes as a reviewable plan
                     if "ACTION:" in response and sheet_id:
-                        if st.button("Execute this action"):
-                            # Parse and execute the action
-                            # (You'd implement action parsing here)
-                            st.success("Action executed!")
+                        try:
+                            actions = parse_actions(response)
+                            plan = st.session_state.assistant.plan_actions(
+                                sheet_id, actions, range_name
+                            )
+                            if not plan.empty:
+                                st.session_state.pending_plan = (sheet_id, plan)
+                        except ValueError as e:
+                            st.warning(f"Could not plan this action: {e}")
                 
             except Exception as e:
                 st.error(f"Error: {e}")
         else:
-            st.error("Please add your Anthropic API key first!")
+            st.error("Please add your Anthropic API key first "
+                         "(or set HOLYSHEET_LLM_PROVIDER=local)!")
+    
+    # Dry-run preview of the pending changes; survives the rerun a button click causes
+    if st.session_state.get('pending_plan'):
+        plan_sheet_id, plan = st.session_state.pending_plan
+        st.subheader("Proposed changes")
+        st.caption(plan.summary())
+        st.dataframe(pd.DataFrame(plan.preview()))
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Execute this action"):
+                try:
+                    result = st.session_state.assistant.execute_plan(plan_sheet_id, plan)
+                    st.session_state.pending_plan = None
+                    st.success(f"Action executed! Updated {result['updated_cells']:,} cells "
+                               f"in {result['requests']} request(s).")
+                except Exception as e:
+                    st.error(f"Error writing to sheet: {e}")
+        with col2:
+            if st.button("Discard"):
+                st.session_state.pending_plan = None
+                st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -8,12 +8,31 @@ Run: streamlit run claude_sheets_webapp.py
 import streamlit as st
 import anthropic
 import pandas as pd
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 import json
 import os
 import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Shared backend lives in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet import prompts, rate_limit
+from holysheet.analytics import ACTION_SECTIONS, action_findings, analyze_frame
+from holysheet.config import Settings
+from holysheet.context import build_sheet_context
+from holysheet.google_clients import client_factory_for_token
+from holysheet.memory import ConversationMemory
+from holysheet.preview import PreviewViews, window_frame
+from holysheet.providers import AnthropicProvider, ProviderRouter
+from holysheet.query_tools import QueryTools, describe_calls, describe_tables
+from holysheet.response_cache import frame_fingerprint, get_response_cache, make_key
+from holysheet.sheet_cache import drive_revision_lookup, get_sheet_cache
+from holysheet.sheet_loader import (get_workbook_info, load_frame, load_workbook,
+                                    range_start_column, range_start_row,
+                                    refresh_frame, split_range)
 
 # Page config
 st.set_page_config(
@@ -24,12 +43,33 @@ st.set_page_config(
 
 class ClaudeSheetsWebApp:
     def __init__(self):
+        self.settings = Settings.from_env()
         self.claude = None
+        # Anthropic and/or a local OpenAI-compatible model (HOLYSHEET_LLM_PROVIDER)
+        self.router = ProviderRouter.from_settings(self.settings)
         self.sheets_service = None
+        self.drive_service = None
+        self.google_user = None  # rate-limit identity of the Google token
+        self.sheet_cache = get_sheet_cache()
+        self.response_cache = get_response_cache()
+        # Which chat turns go with each request (st.session_state.messages)
+        self.memory = ConversationMemory.from_settings(self.settings)
+        self.last_usage = None
+        self.last_tool_calls = None
+        self.tables = {}  # every loaded tab, for the query tools
+        # Sheet row and column of the loaded frame's first data cell
+        self.first_row = 2
+        self.first_column = 1
+        self.last_cached = False
+        self._context_for = None
+        self._context_origin = None
+        self._context_text = None
+        self._fingerprint = None
+        self._analysis = None
         
     def setup_claude(self, api_key):
         try:
-            self.claude = anthropic.Anthropic(api_key=api_key)
+            self.claude = anthropic.Anthropic(api_key=api_key, max_retries=0)
             return True
         except Exception as e:
             st.error(f"Claude setup error: {e}")
@@ -37,10 +77,14 @@ class ClaudeSheetsWebApp:
             
     def setup_google_auth(self, credentials_file):
         try:
-            scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+            scopes = ['https://www.googleapis.com/auth/spreadsheets.readonly',
+                      'https://www.googleapis.com/auth/drive.metadata.readonly']
             
             if os.path.exists('token.json'):
-                creds = Credentials.from_authorized_user_file('token.json', scopes)
+                # Keep the scopes the token was granted with; older tokens
+                # without Drive metadata access just skip revision checks.
+                # The factory is shared across reruns and keeps the token fresh
+                google = client_factory_for_token('token.json', self.settings)
             else:
                 flow = Flow.from_client_secrets_file(credentials_file, scopes)
                 flow.redirect_uri = 'http://localhost:8501'
@@ -70,13 +114,28 @@ class ClaudeSheetsWebApp:
                         
                 return False
             
-            self.sheets_service = build('sheets', 'v4', credentials=creds)
+            # Pooled, thread-safe clients built from the bundled discovery documents
+            self.sheets_service = google.sheets()
+            self.drive_service = google.drive()
+            self.google_user = 'token.json'
             return True
             
         except Exception as e:
             st.error(f"Google setup error: {e}")
             return False
     
+    def can_chat(self):
+        return self.claude is not None or self.router.local is not None
+    
+    def providers(self, sheet_data=None, quick=False):
+        """Providers to try, preferred first (quick actions may go local)"""
+        anthropic_provider = None
+        if self.claude is not None:
+            anthropic_provider = AnthropicProvider(self.claude, self.settings.claude_model,
+                                                   self.settings.max_tokens)
+        rows = len(sheet_data) if sheet_data is not None else None
+        return self.router.route(anthropic_provider, quick=quick, rows=rows)
+    
     def extract_sheet_id(self, url_or_id):
         """Extract sheet ID from URL or return if already ID"""
         if 'docs.google.com/spreadsheets' in url_or_id:
@@ -84,62 +143,218 @@ class ClaudeSheetsWebApp:
             return match.group(1) if match else None
         return url_or_id
     
-    def read_sheet_data(self, sheet_id, range_name='A1:Z1000'):
-        """Read data from Google Sheet"""
+    def read_sheet_data(self, sheet_id, range_name=None):
+        """Read data from Google Sheet (served from the shared cache when unchanged)"""
         try:
-            result = self.sheets_service.spreadsheets().values().get(
-                spreadsheetId=sheet_id, range=range_name
-            ).execute()
+            def load():
+                return load_frame(self.sheets_service, sheet_id, range_name, self.settings,
+                                  user=self.google_user)
             
-            values = result.get('values', [])
-            if not values:
-                return None, "No data found in sheet"
+            tab, cells = split_range(range_name)
+            
+            def refresh(old):
+                # Append-only ledgers: fetch just the rows added since
+                return refresh_frame(self.sheets_service, sheet_id, tab, old, self.settings,
+                                     self.settings.sheet_refresh_overlap_rows,
+                                     user=self.google_user)[0]
             
-            # Convert to DataFrame for better display
-            df = pd.DataFrame(values[1:], columns=values[0] if values else [])
+            revision_lookup = None
+            if self.drive_service:
+                revision_lookup = drive_revision_lookup(self.drive_service, self.google_user)
+            if cells is None and self.settings.sheet_refresh_overlap_rows > 0:
+                df = self.sheet_cache.get_or_refresh(sheet_id, range_name or "", load,
+                                                     refresh, revision_lookup)
+            else:
+                df = self.sheet_cache.get_or_load(sheet_id, range_name or "", load,
+                                                 revision_lookup)
+            if df is None:
+                return None, "No data found in sheet"
             return df, None
             
         except Exception as e:
             return None, f"Error reading sheet: {str(e)}"
     
+    def read_workbook(self, sheet_id):
+        """(title, {tab: frame}, error) for every tab of a spreadsheet
+
+        One metadata call for the title and all tab sizes, then the tabs
+        that aren't cached yet in shared batchGet calls.
+        """
+        try:
+            info = get_workbook_info(self.sheets_service, sheet_id, self.google_user)
+            
+            def load(missing):
+                return load_workbook(self.sheets_service, sheet_id, missing,
+                                     self.settings, info=info,
+                                     user=self.google_user)[1]
+            
+            revision_lookup = None
+            if self.drive_service:
+                revision_lookup = drive_revision_lookup(self.drive_service, self.google_user)
+            frames = self.sheet_cache.get_or_load_many(
+                sheet_id, [tab.title for tab in info.tabs], load, revision_lookup
+            )
+            if not frames:
+                return None, None, "No data found in workbook"
+            return info.title, frames, None
+            
+        except Exception as e:
+            return None, None, f"Error reading workbook: {str(e)}"
+    
     def get_sheet_info(self, sheet_id):
         """Get sheet metadata"""
         try:
-            sheet = self.sheets_service.spreadsheets().get(spreadsheetId=sheet_id).execute()
+            sheet = rate_limit.execute(
+                self.sheets_service.spreadsheets().get(spreadsheetId=sheet_id,
+                                                       fields='properties.title'),
+                user=self.google_user,
+            )
             return sheet.get('properties', {}).get('title', 'Unknown Sheet')
         except:
             return 'Unknown Sheet'
     
-    def chat_with_claude(self, message, sheet_data=None, sheet_name=""):
-        """Send message to Claude with optional sheet data"""
-        try:
-            if sheet_data is not None:
-                # Limit data size for API
-                data_sample = sheet_data.head(50).to_string(index=False)
-                prompt = f"""Sheet: "{sheet_name}"
-                
-Sample data (first 50 rows):
-{data_sample}
-
-Total rows: {len(sheet_data)}
-Columns: {list(sheet_data.columns)}
+    def set_origin(self, range_name=None):
+        """Locate the loaded frame in the sheet from the range it was read from"""
+        self.first_row = range_start_row(range_name) + 1
+        self.first_column = range_start_column(range_name)
+    
+    def sheet_context(self, sheet_data):
+        """Sheet description, reused while the frame is unchanged"""
+        origin = (self.first_row, self.first_column)
+        if self._context_for is not sheet_data or self._context_origin != origin:
+            self._context_text = build_sheet_context(
+                sheet_data, budget_tokens=self.settings.context_token_budget,
+                first_row=self.first_row, first_column=self.first_column
+            )
+            self._fingerprint = None
+            self._analysis = None
+            self._context_for = sheet_data
+            self._context_origin = origin
+        return self._context_text
+    
+    def sheet_fingerprint(self, sheet_data):
+        """Content hash of the loaded frame, computed once per frame"""
+        if sheet_data is None:
+            return ""
+        self.sheet_context(sheet_data)
+        if self._fingerprint is None:
+            self._fingerprint = frame_fingerprint(sheet_data)
+        return self._fingerprint
+    
+    def sheet_analysis(self, sheet_data):
+        """Duplicates, gaps, outliers and trends over every row, once per frame"""
+        self.sheet_context(sheet_data)
+        if self._analysis is None:
+            self._analysis = analyze_frame(sheet_data, self.first_row,
+                                           first_column=self.first_column)
+        return self._analysis
+    
+    def chat_with_claude(self, message, sheet_data=None, sheet_name="",
+                         use_cache=False, refresh=False, action=None, history=None):
+        """Send message to Claude with optional sheet data
 
-User request: {message}
+        With use_cache, identical requests on unchanged data are answered from
+        the on-disk response cache; refresh skips the lookup and re-asks.
+        A quick action also sends its findings computed over the whole sheet,
+        and the model can query every row through the local query tools.
+        history (the chat so far) adds earlier turns within the token budget.
+        """
+        answer = self.answer(message, sheet_data, sheet_name, use_cache, refresh,
+                             action, history)
+        self.last_usage = answer["usage"]
+        self.last_tool_calls = answer["tool_calls"]
+        self.last_cached = answer["cached"]
+        return answer["text"]
+    
+    def answer(self, message, sheet_data=None, sheet_name="", use_cache=False,
+               refresh=False, action=None, history=None):
+        """chat_with_claude without touching last_*, so calls can run in threads
 
-Please provide specific, actionable advice about this financial data. Include exact formulas, cell ranges, or step-by-step instructions where helpful."""
-            else:
-                prompt = message
+        Returns a dict with text, usage, tool_calls and cached.
+        """
+        answer = {"text": "", "usage": None, "tool_calls": None, "cached": False}
+        try:
+            sheet_context = findings = tools = None
+            if sheet_data is not None:
+                # Whole-sheet profile + spread sample, sized to the token budget
+                sheet_context = self.sheet_context(sheet_data)
+                tables = self.tables if len(self.tables) > 1 else None
+                if tables:
+                    active = next((t for t, f in tables.items() if f is sheet_data), "")
+                    sheet_context += "\n\n" + describe_tables(tables, active)
+                if self.settings.query_tools:
+                    tools = QueryTools.from_settings(sheet_data, self.settings,
+                                                     first_row=self.first_row,
+                                                     tables=tables)
+                if action in ACTION_SECTIONS:
+                    findings = action_findings(self.sheet_analysis(sheet_data), action)
+            earlier = summary = None
+            if history is not None:
+                earlier = self.memory.window(history, message)
+                summary = self.memory.summary
+            request = prompts.build_request(message, sheet_context, sheet_name,
+                                            findings=findings, history=earlier,
+                                            summary=summary)
+            providers = self.providers(sheet_data, quick=use_cache)
             
-            response = self.claude.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            cache_key = None
+            if use_cache and providers:
+                cache_key = make_key(providers[0].model, request["system"],
+                                     request["messages"], self.sheet_fingerprint(sheet_data))
+                cached = None if refresh else self.response_cache.get(cache_key)
+                if cached is not None:
+                    answer.update(text=cached["text"], cached=True)
+                    return answer
+            
+            # Anthropic calls are queued against the shared quota and retried
+            # on 429/5xx; a failed provider falls back to the other one
+            completion = self.router.complete_sync(request, providers, tools=tools)
             
-            return response.content[0].text
+            self.memory.record_usage(completion.usage)
+            answer.update(text=completion.text, usage=completion.usage,
+                          tool_calls=completion.tool_calls)
+            # A fallback answer is not saved under the preferred model's key
+            if cache_key is not None and completion.model == providers[0].model:
+                self.response_cache.put(cache_key, {"text": completion.text,
+                                                    "usage": completion.usage})
+            return answer
             
         except Exception as e:
-            return f"Error: {str(e)}"
+            answer["text"] = f"Error: {str(e)}"
+            return answer
+    
+    def run_analyses(self, actions, sheet_data, sheet_name="", refresh=False):
+        """Run quick actions concurrently; yield (action, answer) as each finishes
+
+        The sheet context, fingerprint and findings are built once up front,
+        so every call shares them (and the same cached prompt prefix).
+        At most analysis_concurrency calls are in flight.
+        """
+        self.sheet_fingerprint(sheet_data)
+        if any(action in ACTION_SECTIONS for action in actions):
+            self.sheet_analysis(sheet_data)
+        workers = max(1, min(len(actions), self.settings.analysis_concurrency))
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix="analysis") as pool:
+            futures = {
+                pool.submit(self.answer, prompts.QUICK_ACTIONS[action][1], sheet_data,
+                            sheet_name, use_cache=True, refresh=refresh,
+                            action=action): action
+                for action in actions
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def compact_history(self, history):
+        """Fold the oldest chat turns into the rolling summary once over budget"""
+        def summarize(summary, turns):
+            request = prompts.build_summary_request(
+                summary, turns, self.settings.history_summary_tokens)
+            completion = self.router.complete_sync(request, self.providers(quick=True))
+            self.memory.record_usage(completion.usage, kind="summary")
+            return completion.text
+        
+        self.memory.compact(history, summarize)
 
 def main():
     st.title("🤖 Claude Sheets Assistant")
@@ -199,16 +414,38 @@ def main():
                 help="Example: https://docs.google.com/spreadsheets/d/1ABC..."
             )
             
-            range_input = st.text_input("Range", value="A1:Z1000", 
-                                       help="e.g., A1:Z1000 or Sheet1!A1:C100")
+            range_input = st.text_input("Range (optional)", value="",
+                                       help="Leave blank to load the whole first tab, "
+                                            "or e.g. Sheet1, Sheet1!A1:C100")
+            
+            all_tabs = st.checkbox("Load every tab", value=False,
+                                   help="Load all tabs as tables Claude can compare "
+                                        "and join (e.g. 2021 vs 2022)")
             
             if st.button("📥 Load Sheet") and sheet_input:
                 sheet_id = st.session_state.app.extract_sheet_id(sheet_input)
-                if sheet_id:
+                if sheet_id and all_tabs:
+                    with st.spinner("Loading every tab..."):
+                        title, tables, error = st.session_state.app.read_workbook(sheet_id)
+                        
+                        if tables:
+                            st.session_state.app.tables = tables
+                            st.session_state.app.set_origin()
+                            first = next(iter(tables))
+                            st.session_state.current_sheet_data = tables[first]
+                            st.session_state.current_sheet_name = f"{title} / {first}"
+                            st.success(f"✅ Loaded {len(tables)} tabs of {title}")
+                            for tab, frame in tables.items():
+                                st.write(f"📊 {tab}: {len(frame)} rows, {len(frame.columns)} columns")
+                        else:
+                            st.error(error)
+                elif sheet_id:
                     with st.spinner("Loading sheet data..."):
                         df, error = st.session_state.app.read_sheet_data(sheet_id, range_input)
                         
                         if df is not None:
+                            st.session_state.app.tables = {}
+                            st.session_state.app.set_origin(range_input)
                             st.session_state.current_sheet_data = df
                             st.session_state.current_sheet_name = st.session_state.app.get_sheet_info(sheet_id)
                             st.success(f"✅ Loaded: {st.session_state.current_sheet_name}")
@@ -236,20 +473,29 @@ def main():
                 st.write(prompt)
             
             # Get Claude's response
-            if st.session_state.app.claude:
+            if st.session_state.app.can_chat():
                 with st.chat_message("assistant"):
                     with st.spinner("Claude is thinking..."):
                         response = st.session_state.app.chat_with_claude(
                             prompt, 
                             st.session_state.current_sheet_data,
-                            st.session_state.current_sheet_name
+                            st.session_state.current_sheet_name,
+                            history=st.session_state.messages
                         )
                         st.write(response)
+                        if st.session_state.app.last_usage:
+                            st.caption(prompts.describe_usage(st.session_state.app.last_usage))
+                        if st.session_state.app.last_tool_calls:
+                            st.caption(describe_calls(st.session_state.app.last_tool_calls))
+                        elif st.session_state.app.last_cached:
+                            st.caption("⚡ Saved answer")
                         
                         # Add to chat history
                         st.session_state.messages.append({"role": "assistant", "content": response})
+                        st.session_state.app.compact_history(st.session_state.messages)
             else:
-                st.error("Please add your Anthropic API key first!")
+                st.error("Please add your Anthropic API key first "
+                         "(or set HOLYSHEET_LLM_PROVIDER=local)!")
     
     with col2:
         st.header("📊 Sheet Preview")
@@ -261,8 +507,37 @@ def main():
             df = st.session_state.current_sheet_data
             st.write(f"**{len(df)} rows × {len(df.columns)} columns**")
             
-            # Show data preview
-            st.dataframe(df, use_container_width=True, height=400)
+            # Show data preview: one filtered, sorted page goes to the browser
+            # instead of the whole frame
+            search_col, sort_col, order_col = st.columns([2, 1, 1])
+            search = search_col.text_input("Filter rows", key="preview_search")
+            sort = sort_col.selectbox("Sort by", ["(sheet order)"] + list(df.columns),
+                                      key="preview_sort")
+            descending = order_col.checkbox("Descending", key="preview_desc")
+            views = st.session_state.setdefault("preview_views", PreviewViews())
+            order = views.order(df, None if sort == "(sheet order)" else sort,
+                                descending, None, search.strip() or None)
+            page_size = 200
+            pages = max((len(order) + page_size - 1) // page_size, 1)
+            if st.session_state.get("preview_page", 1) > pages:
+                st.session_state.preview_page = pages  # the filter got narrower
+            page = st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages,
+                                   value=1, key="preview_page")
+            st.caption(f"{len(order):,} matching rows")
+            first_row = st.session_state.app.first_row
+            st.dataframe(window_frame(df, order, (page - 1) * page_size, page_size,
+                                      first_row),
+                         use_container_width=True, height=400, hide_index=True)
+            
+            # Rows flagged by the last Clean/Analyze quick action
+            if st.session_state.get("show_duplicates"):
+                clusters = st.session_state.app.sheet_analysis(df).near_duplicates
+                st.subheader(f"🔁 Possible Duplicates ({len(clusters)} groups)")
+                if clusters:
+                    rows = [row for cluster in clusters for row in cluster.rows]
+                    flagged = df.iloc[[row - first_row for row in rows]]
+                    flagged.insert(0, "Sheet row", rows)
+                    st.dataframe(flagged, use_container_width=True, hide_index=True)
             
             # Quick stats for financial data
             numeric_cols = df.select_dtypes(include=['number']).columns
@@ -279,42 +554,69 @@ def main():
             st.info("👆 Load a Google Sheet from the sidebar to see data preview")
     
     # Quick action buttons
-    if st.session_state.current_sheet_data is not None and st.session_state.app.claude:
+    if st.session_state.current_sheet_data is not None and st.session_state.app.can_chat():
         st.header("🚀 Quick Actions")
         
-        col1, col2, col3, col4 = st.columns(4)
+        refresh = st.checkbox("🔄 Fresh answers", value=False,
+                              help="Skip the saved answer and ask Claude again")
         
-        with col1:
-            if st.button("📊 Analyze Data"):
-                prompt = "Analyze this financial data. What patterns, trends, or insights do you see?"
-                st.session_state.messages.append({"role": "user", "content": prompt})
-                response = st.session_state.app.chat_with_claude(prompt, st.session_state.current_sheet_data, st.session_state.current_sheet_name)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.rerun()
+        columns = st.columns(len(prompts.QUICK_ACTIONS))
         
-        with col2:
-            if st.button("🧹 Clean Data"):
-                prompt = "Help me clean up this data. Identify duplicates, formatting issues, missing values, or inconsistencies."
-                st.session_state.messages.append({"role": "user", "content": prompt})
-                response = st.session_state.app.chat_with_claude(prompt, st.session_state.current_sheet_data, st.session_state.current_sheet_name)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.rerun()
+        for column, (action, (label, prompt)) in zip(columns, prompts.QUICK_ACTIONS.items()):
+            with column:
+                if st.button(label, key=f"quick_{action}"):
+                    st.session_state.messages.append({"role": "user", "content": prompt})
+                    st.session_state.show_duplicates = (
+                        "near_duplicates" in ACTION_SECTIONS.get(action, ())
+                    )
+                    # Same prompt on the same data: reuse the saved answer
+                    response = st.session_state.app.chat_with_claude(
+                        prompt, st.session_state.current_sheet_data,
+                        st.session_state.current_sheet_name,
+                        use_cache=True, refresh=refresh, action=action
+                    )
+                    st.session_state.messages.append({"role": "assistant", "content": response})
+                    st.rerun()
         
-        with col3:
-            if st.button("📈 Find Trends"):
-                prompt = "What financial trends can you identify in this data over time? Any concerning patterns or opportunities?"
-                st.session_state.messages.append({"role": "user", "content": prompt})
-                response = st.session_state.app.chat_with_claude(prompt, st.session_state.current_sheet_data, st.session_state.current_sheet_name)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.rerun()
+        # Several analyses at once: concurrent calls, one combined report
+        labels = {action: label for action, (label, _) in prompts.QUICK_ACTIONS.items()}
+        selected = st.multiselect("Run together", list(labels),
+                                  default=list(labels), format_func=labels.get)
+        if st.button("⚡ Run all analyses", disabled=not selected):
+            app = st.session_state.app
+            started = time.perf_counter()
+            slots = {action: st.empty() for action in selected}
+            for action, slot in slots.items():
+                slot.info(f"⏳ {labels[action]}...")
+            answers = {}
+            # Each result is shown as soon as its call finishes
+            for action, answer in app.run_analyses(
+                    selected, st.session_state.current_sheet_data,
+                    st.session_state.current_sheet_name, refresh=refresh):
+                answers[action] = answer["text"]
+                with slots[action].container():
+                    with st.expander(f"✅ {labels[action]}", expanded=True):
+                        st.markdown(answer["text"])
+                        if answer["usage"]:
+                            st.caption(prompts.describe_usage(answer["usage"]))
+                        elif answer["cached"]:
+                            st.caption("⚡ Saved answer")
+            elapsed = time.perf_counter() - started
+            report = prompts.analysis_report(answers, st.session_state.current_sheet_name)
+            st.session_state.analysis_report = report
+            st.session_state.show_duplicates = any(
+                "near_duplicates" in ACTION_SECTIONS.get(action, ()) for action in selected
+            )
+            st.session_state.messages.append({
+                "role": "user",
+                "content": "Run analyses: " + ", ".join(labels[a] for a in selected),
+            })
+            st.session_state.messages.append({"role": "assistant", "content": report})
+            st.success(f"{len(answers)} analyses in {elapsed:.1f}s")
         
-        with col4:
-            if st.button("🔧 Suggest Formulas"):
-                prompt = "Suggest useful Excel/Google Sheets formulas for this financial data. Include specific cell references."
-                st.session_state.messages.append({"role": "user", "content": prompt})
-                response = st.session_state.app.chat_with_claude(prompt, st.session_state.current_sheet_data, st.session_state.current_sheet_name)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.rerun()
+        if st.session_state.get("analysis_report"):
+            st.download_button("📄 Download report", st.session_state.analysis_report,
+                               file_name="holysheet-report.md", mime="text/markdown")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,6 +4,8 @@ class HolySheetApp {
         this.ws = null;
         this.isConnected = false;
         this.currentSheetData = null;
+        this.streams = new Map();  // request_id -> in-progress assistant bubble
+        this.grid = new SheetGrid(this);
         this.init();
     }
 
@@ -15,9 +17,17 @@ class HolySheetApp {
 
     setupWebSocket() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws`;
+        // Resume the server-side session (loaded sheets, history) after reconnects
+        const sessionId = sessionStorage.getItem('holysheet-session');
+        const query = sessionId ? `?session=${encodeURIComponent(sessionId)}` : '';
+        const wsUrl = `${protocol}//${window.location.host}/ws${query}`;
         
-        this.ws = new WebSocket(wsUrl);
+        // Batched frames: MessagePack when the decoder loaded, JSON otherwise
+        const protocols = window.MessagePack
+            ? ['holysheet.msgpack', 'holysheet.json']
+            : ['holysheet.json'];
+        this.ws = new WebSocket(wsUrl, protocols);
+        this.ws.binaryType = 'arraybuffer';
         
         this.ws.onopen = () => {
             this.isConnected = true;
@@ -26,8 +36,13 @@ class HolySheetApp {
         };
         
         this.ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            this.handleMessage(data);
+            const data = typeof event.data === 'string'
+                ? JSON.parse(event.data)
+                : MessagePack.decode(new Uint8Array(event.data));
+            // A batch is an array of messages in send order
+            for (const message of Array.isArray(data) ? data : [data]) {
+                this.handleMessage(message);
+            }
         };
         
         this.ws.onclose = () => {
@@ -94,7 +109,7 @@ class HolySheetApp {
         statusEl.className = `px-3 py-1 rounded-full text-sm bg-${color}-100 text-${color}-700`;
     }
 
-    sendChatMessage(message) {
+    sendChatMessage(message, action = null) {
         // Add user message to chat
         this.addChatMessage(message, 'user');
         
@@ -103,21 +118,56 @@ class HolySheetApp {
             this.ws.send(JSON.stringify({
                 type: 'chat',
                 message: message,
-                sheet_data: this.currentSheetData
+                stream: true,
+                request_id: Math.random().toString(36).slice(2, 14),
+                // Quick actions may be answered from the server's response cache
+                ...(action ? { action } : {})
             }));
         }
     }
 
     handleMessage(data) {
         switch (data.type) {
+            case 'session':
+                sessionStorage.setItem('holysheet-session', data.session_id);
+                break;
             case 'chat_response':
                 this.addChatMessage(data.message, 'assistant');
                 break;
+            case 'chat_start':
+                this.streams.set(data.request_id, this.addChatMessage('', 'assistant'));
+                break;
+            case 'chat_delta':
+                this.appendToStream(data.request_id, data.text);
+                break;
+            case 'chat_tool':
+                this.noteToolCall(data.request_id, data);
+                break;
+            case 'chat_end':
+                this.finishStream(data.request_id, data);
+                break;
+            case 'chat_error':
+                this.finishStream(data.request_id, data);
+                this.addChatMessage(data.message, 'assistant');
+                break;
             case 'sheet_loaded':
                 this.displaySheetData(data.data);
+                // Switching tabs of a loaded workbook keeps the tab list
+                if (this.workbook && this.workbook.tabs.some(tab => tab.title === data.data.title)) {
+                    this.displayTabs();
+                } else {
+                    this.workbook = null;
+                }
+                break;
+            case 'workbook_loaded':
+                this.displayWorkbook(data.data);
+                break;
+            case 'duplicates':
+                this.displayDuplicates(data.clusters);
                 break;
             case 'error':
                 this.showError(data.message);
+                this.addChatMessage(data.message, 'assistant');
                 break;
         }
     }
@@ -146,6 +196,50 @@ class HolySheetApp {
         
         // Scroll to bottom
         chatContainer.scrollTop = chatContainer.scrollHeight;
+        return bubble;
+    }
+
+    appendToStream(requestId, text) {
+        let bubble = this.streams.get(requestId);
+        if (!bubble) {
+            bubble = this.addChatMessage('', 'assistant');
+            this.streams.set(requestId, bubble);
+        }
+        bubble.textContent += text;
+
+        const chatContainer = document.getElementById('chat-container');
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    }
+
+    noteToolCall(requestId, call) {
+        // The model queried the sheet; show what ran and how long it took
+        let bubble = this.streams.get(requestId);
+        if (!bubble) {
+            bubble = this.addChatMessage('', 'assistant');
+            this.streams.set(requestId, bubble);
+        }
+        const note = call.error
+            ? `${call.name}: ${call.error}`
+            : `${call.name}: ${call.rows.toLocaleString()} rows in ${call.ms} ms`;
+        bubble.title = (bubble.title ? bubble.title + '\n' : '') + note;
+    }
+
+    finishStream(requestId, data) {
+        const bubble = this.streams.get(requestId);
+        this.streams.delete(requestId);
+        if (!bubble) return;
+
+        if (data.cached) {
+            bubble.title = 'Saved answer for this sheet (no tokens used)';
+        } else if (data.timing && data.usage) {
+            const tools = bubble.title ? bubble.title + '\n' : '';
+            bubble.title = tools + `First token ${data.timing.ttft_ms} ms, total ${data.timing.total_ms} ms, ` +
+                `${data.usage.input_tokens} in / ${data.usage.output_tokens} out tokens` +
+                (data.usage.cache_read_input_tokens
+                    ? `, ${data.usage.cache_read_input_tokens} read from cache` : '');
+        } else if (!bubble.textContent) {
+            bubble.parentElement.remove();
+        }
     }
 
     loadSheet() {
@@ -155,14 +249,25 @@ class HolySheetApp {
             return;
         }
 
+        if (!this.isConnected) {
+            this.showError('Not connected to the server');
+            return;
+        }
+
         // Show loading state
         this.showLoading('Loading sheet...');
-        
-        // For now, simulate loading (you'll implement actual Google Sheets API)
-        setTimeout(() => {
-            this.showQuickActions();
-            this.showSuccess('Sheet loaded successfully!');
-        }, 1000);
+
+        // The server reads the sheet and keeps it in this browser's session;
+        // a whole workbook is loaded as named tables the chat can compare
+        const allTabs = document.getElementById('all-tabs');
+        this.ws.send(JSON.stringify({
+            type: allTabs && allTabs.checked ? 'load_workbook' : 'load_sheet',
+            sheet: sheetUrl
+        }));
+    }
+
+    selectSheet(title) {
+        this.ws.send(JSON.stringify({ type: 'select_sheet', sheet: title }));
     }
 
     performQuickAction(action) {
@@ -174,7 +279,7 @@ class HolySheetApp {
         };
         
         if (actions[action]) {
-            this.sendChatMessage(actions[action]);
+            this.sendChatMessage(actions[action], action);
         }
     }
 
@@ -199,9 +304,283 @@ class HolySheetApp {
 
     displaySheetData(data) {
         const dataContainer = document.getElementById('data-container');
-        // Implement data table display
-        dataContainer.innerHTML = '<div class="text-green-600">Sheet data loaded!</div>';
+        dataContainer.innerHTML = '';
+        const summary = document.createElement('div');
+        summary.className = 'text-green-600 font-medium';
+        summary.textContent = `${data.title}: ${data.rows.toLocaleString()} rows × ${data.columns} columns`;
+        dataContainer.appendChild(summary);
         this.currentSheetData = data;
+        this.duplicateRows = new Set();
+        this.grid.open();
+        this.showQuickActions();
+        this.showSuccess('Sheet loaded successfully!');
+    }
+
+    displayWorkbook(workbook) {
+        const active = workbook.tabs.find(tab => tab.title === workbook.active);
+        this.displaySheetData(active || workbook.tabs[0]);
+        this.workbook = workbook;
+        this.displayTabs();
+    }
+
+    displayTabs() {
+        const workbook = this.workbook;
+        const dataContainer = document.getElementById('data-container');
+        const list = document.createElement('div');
+        list.className = 'mt-2 text-sm';
+        const heading = document.createElement('div');
+        heading.className = 'font-medium text-gray-700';
+        heading.textContent = `${workbook.title}: ${workbook.tabs.length} tabs loaded`;
+        list.appendChild(heading);
+        workbook.tabs.forEach(tab => {
+            const button = document.createElement('button');
+            button.className = 'mr-2 mt-1 px-2 py-1 rounded bg-gray-100 hover:bg-gray-200';
+            button.textContent = `${tab.title} (${tab.rows.toLocaleString()})`;
+            button.addEventListener('click', () => this.selectSheet(tab.title));
+            list.appendChild(button);
+        });
+        dataContainer.appendChild(list);
+    }
+
+    displayDuplicates(clusters) {
+        // Sheet rows of likely duplicates, kept for highlighting
+        this.duplicateRows = new Set(clusters.flatMap(c => c.rows));
+        this.grid.render();
+        const dataContainer = document.getElementById('data-container');
+        const previous = document.getElementById('duplicate-clusters');
+        if (previous) {
+            previous.remove();
+        }
+        const list = document.createElement('div');
+        list.id = 'duplicate-clusters';
+        list.className = 'mt-2 text-sm';
+        const heading = document.createElement('div');
+        heading.className = 'font-medium text-amber-700';
+        heading.textContent = clusters.length
+            ? `Possible duplicates: ${clusters.length.toLocaleString()} groups, ${this.duplicateRows.size.toLocaleString()} rows`
+            : 'No possible duplicates found';
+        list.appendChild(heading);
+        clusters.slice(0, 20).forEach(cluster => {
+            const item = document.createElement('div');
+            item.className = 'bg-amber-50 rounded px-2 py-1 mt-1';
+            const kind = cluster.exact ? 'identical' : `similarity ${cluster.similarity}`;
+            item.textContent = `Rows ${cluster.rows.join(', ')} (${kind})`;
+            list.appendChild(item);
+        });
+        dataContainer.appendChild(list);
+    }
+}
+
+// Virtualized sheet preview. The server filters and sorts the cached frame
+// and hands out windows of rows; only the visible rows exist in the DOM and
+// only a few windows are kept, so a 500k-row sheet scrolls like a small one.
+class SheetGrid {
+    constructor(app) {
+        this.app = app;
+        this.rowHeight = 24;
+        this.columnWidth = 140;
+        this.pageSize = 200;
+        this.maxPages = 8;
+        this.maxHeight = 8000000;  // browsers cap element heights
+        this.pages = new Map();    // page -> window, least recently used first
+        this.pending = new Set();
+        this.view = { sort: null, desc: false, q: '' };
+        this.generation = 0;
+        this.total = 0;
+        this.columns = [];
+        this.rowEls = [];
+
+        this.root = document.getElementById('sheet-grid');
+        this.header = document.getElementById('grid-header');
+        this.viewport = document.getElementById('grid-viewport');
+        this.spacer = document.getElementById('grid-spacer');
+        this.body = document.getElementById('grid-rows');
+        this.status = document.getElementById('grid-status');
+        if (!this.root) return;
+
+        this.viewport.addEventListener('scroll', () => {
+            this.header.scrollLeft = this.viewport.scrollLeft;
+            if (!this.scheduled) {
+                this.scheduled = requestAnimationFrame(() => {
+                    this.scheduled = null;
+                    this.render();
+                });
+            }
+        });
+        let typing = null;
+        document.getElementById('grid-search').addEventListener('input', (e) => {
+            clearTimeout(typing);
+            typing = setTimeout(() => this.setView({ q: e.target.value.trim() }), 300);
+        });
+    }
+
+    open() {
+        if (!this.root) return;
+        this.root.classList.remove('hidden');
+        this.columns = [];
+        this.setView({ sort: null, desc: false });
+    }
+
+    setView(changes) {
+        Object.assign(this.view, changes);
+        this.generation += 1;
+        this.pages.clear();
+        this.pending.clear();
+        this.viewport.scrollTop = 0;
+        this.fetchPage(0);
+    }
+
+    url(page) {
+        const params = new URLSearchParams({
+            session: sessionStorage.getItem('holysheet-session') || '',
+            offset: page * this.pageSize,
+            limit: this.pageSize
+        });
+        if (this.view.sort) {
+            params.set('sort', this.view.sort);
+            params.set('desc', this.view.desc);
+        }
+        if (this.view.q) params.set('q', this.view.q);
+        return `/api/rows?${params}`;
+    }
+
+    async fetchPage(page) {
+        if (this.pages.has(page) || this.pending.has(page)) return;
+        const generation = this.generation;
+        this.pending.add(page);
+        try {
+            const response = await fetch(this.url(page));
+            const data = await response.json();
+            if (generation !== this.generation) return;
+            if (!response.ok) throw new Error(data.detail || response.statusText);
+            this.pages.set(page, data);
+            while (this.pages.size > this.maxPages) {
+                this.pages.delete(this.pages.keys().next().value);
+            }
+            if (data.total !== this.total || data.columns.length !== this.columns.length) {
+                this.total = data.total;
+                this.columns = data.columns;
+                this.renderHeader();
+            }
+            this.status.textContent = data.total === data.rows_in_sheet
+                ? `${data.total.toLocaleString()} rows`
+                : `${data.total.toLocaleString()} of ${data.rows_in_sheet.toLocaleString()} rows`;
+            this.render();
+        } catch (error) {
+            this.status.textContent = error.message;
+        } finally {
+            if (generation === this.generation) this.pending.delete(page);
+        }
+    }
+
+    renderHeader() {
+        this.header.innerHTML = '';
+        const width = 64 + this.columns.length * this.columnWidth;
+        this.header.appendChild(this.cell('Row', 64, 'text-gray-400'));
+        this.columns.forEach(column => {
+            const arrow = this.view.sort === column.name ? (this.view.desc ? ' ▼' : ' ▲') : '';
+            const cell = this.cell(column.name + arrow, this.columnWidth, 'cursor-pointer hover:bg-gray-50');
+            cell.title = `${column.name} (${column.type}), click to sort`;
+            cell.addEventListener('click', () => this.sortBy(column.name));
+            this.header.appendChild(cell);
+        });
+        this.spacer.style.height = `${Math.min(this.total * this.rowHeight, this.maxHeight)}px`;
+        this.spacer.style.width = `${width}px`;
+        this.body.innerHTML = '';
+        this.rowEls = [];
+    }
+
+    sortBy(name) {
+        // Ascending, then descending, then back to sheet order
+        if (this.view.sort !== name) {
+            this.setView({ sort: name, desc: false });
+        } else if (!this.view.desc) {
+            this.setView({ desc: true });
+        } else {
+            this.setView({ sort: null, desc: false });
+        }
+        this.renderHeader();
+    }
+
+    cell(text, width, extra = '') {
+        const cell = document.createElement('div');
+        cell.className = `shrink-0 px-2 truncate ${extra}`;
+        cell.style.width = `${width}px`;
+        cell.style.lineHeight = `${this.rowHeight}px`;
+        cell.textContent = text;
+        return cell;
+    }
+
+    rowElement(index) {
+        while (this.rowEls.length <= index) {
+            const row = document.createElement('div');
+            row.className = 'flex border-b border-gray-100';
+            row.style.height = `${this.rowHeight}px`;
+            row.appendChild(this.cell('', 64, 'text-gray-400'));
+            this.columns.forEach(() => row.appendChild(this.cell('', this.columnWidth)));
+            this.body.appendChild(row);
+            this.rowEls.push(row);
+        }
+        return this.rowEls[index];
+    }
+
+    format(data, column, offset) {
+        const value = data.data[column][offset];
+        if (value === null || value === undefined) return '';
+        if (data.columns[column].type === 'category') return data.labels[column][value];
+        if (data.columns[column].type === 'number') return value.toLocaleString();
+        return String(value);
+    }
+
+    render() {
+        if (!this.columns.length) return;
+        const { scrollTop, clientHeight } = this.viewport;
+        const visible = Math.ceil(clientHeight / this.rowHeight) + 1;
+        // Past maxHeight the scrollbar maps onto rows proportionally
+        const scrollable = this.spacer.offsetHeight - clientHeight;
+        const lastFirst = Math.max(this.total - visible + 1, 0);
+        const scaled = this.total * this.rowHeight > this.maxHeight;
+        const first = scrollable > 0
+            ? Math.min(Math.floor(scaled ? scrollTop / scrollable * lastFirst : scrollTop / this.rowHeight), lastFirst)
+            : 0;
+        const top = scaled ? scrollTop : first * this.rowHeight;
+        this.body.style.transform = `translateY(${top}px)`;
+
+        for (let i = 0; i < visible; i++) {
+            const row = this.rowElement(i);
+            const index = first + i;
+            if (index >= this.total) {
+                row.style.display = 'none';
+                continue;
+            }
+            row.style.display = '';
+            const page = Math.floor(index / this.pageSize);
+            const data = this.pages.get(page);
+            const cells = row.children;
+            if (!data) {
+                this.fetchPage(page);
+                for (const cell of cells) cell.textContent = '';
+                cells[0].textContent = '…';
+                continue;
+            }
+            // Keep the pages in use at the recent end of the map
+            this.pages.delete(page);
+            this.pages.set(page, data);
+            const offset = index - page * this.pageSize;
+            const sheetRow = data.rows[offset];
+            cells[0].textContent = sheetRow;
+            for (let c = 0; c < this.columns.length; c++) {
+                cells[c + 1].textContent = this.format(data, c, offset);
+            }
+            const duplicate = this.app.duplicateRows && this.app.duplicateRows.has(sheetRow);
+            row.classList.toggle('bg-amber-50', Boolean(duplicate));
+        }
+        for (let i = visible; i < this.rowEls.length; i++) {
+            this.rowEls[i].style.display = 'none';
+        }
+        // Fetch the next window before the scroll reaches it
+        const next = Math.floor((first + visible + this.pageSize / 4) / this.pageSize);
+        if (next * this.pageSize < this.total) this.fetchPage(next);
     }
 }
 
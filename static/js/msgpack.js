@@ -0,0 +1,131 @@
+// HolySheet - MessagePack decoder for the "holysheet.msgpack" WebSocket frames
+//
+// Served with the app instead of from a CDN. Decode-only: the server packs
+// with msgpack-python, the client always sends JSON text.
+(function () {
+    const utf8 = new TextDecoder('utf-8');
+
+    class Reader {
+        constructor(bytes) {
+            this.bytes = bytes;
+            this.view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+            this.pos = 0;
+        }
+
+        take(length) {
+            if (this.pos + length > this.bytes.length) {
+                throw new RangeError('MessagePack: unexpected end of data');
+            }
+            const start = this.pos;
+            this.pos += length;
+            return start;
+        }
+
+        uint(size) {
+            const at = this.take(size);
+            switch (size) {
+                case 1: return this.view.getUint8(at);
+                case 2: return this.view.getUint16(at);
+                case 4: return this.view.getUint32(at);
+                default: return Number(this.view.getBigUint64(at));
+            }
+        }
+
+        int(size) {
+            const at = this.take(size);
+            switch (size) {
+                case 1: return this.view.getInt8(at);
+                case 2: return this.view.getInt16(at);
+                case 4: return this.view.getInt32(at);
+                default: return Number(this.view.getBigInt64(at));
+            }
+        }
+
+        str(length) {
+            const at = this.take(length);
+            return utf8.decode(this.bytes.subarray(at, at + length));
+        }
+
+        bin(length) {
+            const at = this.take(length);
+            return this.bytes.slice(at, at + length);
+        }
+
+        array(length) {
+            const items = new Array(length);
+            for (let i = 0; i < length; i++) {
+                items[i] = this.value();
+            }
+            return items;
+        }
+
+        map(length) {
+            const object = {};
+            for (let i = 0; i < length; i++) {
+                const key = this.value();
+                object[key] = this.value();
+            }
+            return object;
+        }
+
+        ext(length) {
+            const type = this.int(1);
+            return { type, data: this.bin(length) };
+        }
+
+        value() {
+            const byte = this.uint(1);
+            if (byte <= 0x7f) return byte;
+            if (byte >= 0xe0) return byte - 0x100;
+            if (byte >= 0xa0 && byte <= 0xbf) return this.str(byte & 0x1f);
+            if (byte >= 0x90 && byte <= 0x9f) return this.array(byte & 0x0f);
+            if (byte >= 0x80 && byte <= 0x8f) return this.map(byte & 0x0f);
+            switch (byte) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return this.bin(this.uint(1));
+                case 0xc5: return this.bin(this.uint(2));
+                case 0xc6: return this.bin(this.uint(4));
+                case 0xc7: return this.ext(this.uint(1));
+                case 0xc8: return this.ext(this.uint(2));
+                case 0xc9: return this.ext(this.uint(4));
+                case 0xca: return this.view.getFloat32(this.take(4));
+                case 0xcb: return this.view.getFloat64(this.take(8));
+                case 0xcc: return this.uint(1);
+                case 0xcd: return this.uint(2);
+                case 0xce: return this.uint(4);
+                case 0xcf: return this.uint(8);
+                case 0xd0: return this.int(1);
+                case 0xd1: return this.int(2);
+                case 0xd2: return this.int(4);
+                case 0xd3: return this.int(8);
+                case 0xd4: return this.ext(1);
+                case 0xd5: return this.ext(2);
+                case 0xd6: return this.ext(4);
+                case 0xd7: return this.ext(8);
+                case 0xd8: return this.ext(16);
+                case 0xd9: return this.str(this.uint(1));
+                case 0xda: return this.str(this.uint(2));
+                case 0xdb: return this.str(this.uint(4));
+                case 0xdc: return this.array(this.uint(2));
+                case 0xdd: return this.array(this.uint(4));
+                case 0xde: return this.map(this.uint(2));
+                case 0xdf: return this.map(this.uint(4));
+                default:
+                    throw new RangeError(`MessagePack: unknown type 0x${byte.toString(16)}`);
+            }
+        }
+    }
+
+    function decode(bytes) {
+        const reader = new Reader(bytes);
+        const value = reader.value();
+        if (reader.pos !== bytes.length) {
+            throw new RangeError('MessagePack: trailing bytes after value');
+        }
+        return value;
+    }
+
+    window.MessagePack = { decode };
+})();
@@ -0,0 +1,18 @@
+"""
+Shared fixtures
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet import rate_limit
+
+
+@pytest.fixture(autouse=True)
+def unthrottled_apis(monkeypatch):
+    """Fake services answer instantly; don't pace them at real API quotas"""
+    monkeypatch.setattr(rate_limit, "_shared_governor", rate_limit.ApiGovernor({}))
@@ -0,0 +1,121 @@
+"""
+In-memory stand-ins for the Google Sheets API client used across tests
+"""
+
+import re
+import threading
+
+A1 = re.compile(
+    r"^(?:(?:'((?:[^']|'')*)'|([^!']+))!)?([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$"
+)
+
+
+def column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - ord("A") + 1)
+    return index
+
+
+class _Request:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self, http=None, num_retries=0):
+        return self.fn()
+
+
+class FakeSheetsService:
+    """Serves spreadsheets().get / values().get / batchGet / batchUpdate from lists"""
+
+    def __init__(self, tabs):
+        # tabs: {title: [[row], ...]} in tab order
+        self.tabs = tabs
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _record(self, name, **kwargs):
+        with self._lock:
+            self.calls.append((name, kwargs))
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range=None, fields=None, **kwargs):
+        if range is not None:
+            self._record("values.get", range=range)
+            return _Request(lambda: {"range": range, "values": self._slice(range)})
+        self._record("spreadsheets.get", fields=fields)
+        return _Request(self._metadata)
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        self._record("values.batchGet", ranges=list(ranges))
+        return _Request(
+            lambda: {
+                "valueRanges": [{"range": r, "values": self._slice(r)} for r in ranges]
+            }
+        )
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        self._record("values.batchUpdate", body=body)
+        return _Request(lambda: self._write(body["data"]))
+
+    def _write(self, data):
+        updated = 0
+        for value_range in data:
+            match = A1.match(value_range["range"])
+            title = (match.group(1) or match.group(2) or next(iter(self.tabs))).replace(
+                "''", "'"
+            )
+            rows = self.tabs[title]
+            first_col = column_index(match.group(3)) - 1
+            first_row = int(match.group(4)) - 1
+            for i, values in enumerate(value_range["values"]):
+                while len(rows) <= first_row + i:
+                    rows.append([])
+                row = rows[first_row + i]
+                for j, value in enumerate(values):
+                    while len(row) <= first_col + j:
+                        row.append("")
+                    row[first_col + j] = value
+                    updated += 1
+        return {"totalUpdatedCells": updated}
+
+    def _metadata(self):
+        sheets = []
+        for i, (title, rows) in enumerate(self.tabs.items()):
+            width = max((len(r) for r in rows), default=0)
+            sheets.append(
+                {
+                    "properties": {
+                        "sheetId": i,
+                        "title": title,
+                        "gridProperties": {"rowCount": len(rows), "columnCount": width},
+                    }
+                }
+            )
+        return {"properties": {"title": "Fake Workbook"}, "sheets": sheets}
+
+    def _slice(self, range_name):
+        match = A1.match(range_name)
+        title = match.group(1) or match.group(2)
+        if title is None:
+            title = next(iter(self.tabs))
+        title = title.replace("''", "'")
+        rows = self.tabs[title]
+        first_col = column_index(match.group(3)) - 1
+        first_row = int(match.group(4)) - 1
+        last_col = column_index(match.group(5)) if match.group(5) else first_col + 1
+        last_row = int(match.group(6)) if match.group(6) else first_row + 1
+        out = []
+        for row in rows[first_row:last_row]:
+            cells = row[first_col:last_col]
+            while cells and cells[-1] in ("", None):
+                cells = cells[:-1]
+            out.append(cells)
+        while out and not out[-1]:
+            out.pop()
+        return out
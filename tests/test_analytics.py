@@ -0,0 +1,105 @@
+"""
+Tests for the whole-sheet analytics behind the quick actions
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.analytics import (
+    action_findings,
+    analyze_frame,
+    duplicate_groups,
+    format_issues,
+    missing_values,
+    outliers,
+    period_growth,
+)
+from holysheet.column_types import infer_column_types
+
+
+def ledger():
+    rows = [
+        ["2024-01-05", "Food", "12.50", "A-1"],
+        ["2024-01-05", "Food", "12.50", "A-1"],
+        ["2024-02-01", "Rent ", "1200", "A-2"],
+        ["2024-02-03", "food", "", "A-3"],
+        ["2024-03-01", "Travel", "40", "n/a"],
+    ]
+    rows += [["2024-03-15", "Food", str(30 + i % 7), f"B-{i}"] for i in range(60)]
+    return pd.DataFrame(rows, columns=["Date", "Category", "Amount", "Ref"])
+
+
+def test_missing_values_cite_sheet_rows():
+    frame = infer_column_types(ledger())
+    [amount] = missing_values(frame)
+    assert amount["column"] == "Amount" and amount["letter"] == "C"
+    assert amount["missing"] == 1
+    assert amount["rows"] == [5]  # header is row 1
+
+    # A range starting at B10: the header is on row 10, columns from B
+    [amount] = missing_values(frame, first_row=11, first_column=2)
+    assert amount["letter"] == "D" and amount["rows"] == [14]
+
+
+def test_format_issues():
+    frame = pd.DataFrame(
+        {
+            "Amount": ["10", "12.5", "n/a", "14", "TBD", "9"],
+            "Category": ["Food", "Food", "food", "Rent", " Rent", "Food"],
+        }
+    )
+    issues = {(i["column"], i["issue"]): i for i in format_issues(frame)}
+
+    bad = issues[("Amount", "not a number")]
+    assert bad["count"] == 2 and bad["rows"] == [4, 6]
+    assert set(bad["values"]) == {"n/a", "TBD"}
+    assert issues[("Category", "leading or trailing spaces")]["rows"] == [6]
+    spelling = issues[("Category", "spelled differently from the usual value")]
+    assert spelling["rows"] == [4]
+    assert spelling["values"] == ["food -> Food"]
+
+
+def test_duplicate_groups_over_all_rows():
+    frame = ledger()
+    frame.loc[len(frame)] = frame.iloc[10].tolist()  # far from its twin
+    assert duplicate_groups(frame) == [[2, 3], [12, 67]]
+
+
+def test_outliers_by_robust_z_score():
+    rng = np.random.default_rng(1)
+    amounts = rng.normal(100, 5, 1000)
+    amounts[[17, 803]] = [950, -400]
+    [found] = outliers(pd.DataFrame({"Amount": amounts}))
+    # Strongest first; a normal sample has a few mild ones of its own
+    assert [row for row, _, _ in found["cells"][:2]] == [19, 805]
+    assert all(abs(z) < 6 for _, _, z in found["cells"][2:])
+
+
+def test_period_growth_includes_empty_months():
+    frame = pd.DataFrame(
+        {
+            "Date": pd.to_datetime(["2024-01-10", "2024-01-20", "2024-03-05"]),
+            "Amount": [100.0, 100.0, 300.0],
+        }
+    )
+    table = period_growth(frame)
+    assert [str(p) for p in table.index] == ["2024-01", "2024-02", "2024-03"]
+    assert table["rows"].tolist() == [2, 0, 1]
+    assert np.isnan(table["Amount growth %"].iloc[2])  # no sales in February
+
+
+def test_findings_per_quick_action():
+    analysis = analyze_frame(infer_column_types(ledger()))
+    clean = action_findings(analysis, "clean")
+    assert "Computed over all 65 rows" in clean
+    assert "- rows 2, 3" in clean
+    assert "Totals by period" not in clean
+
+    trends = action_findings(analysis, "trends")
+    assert "2024-03: 61 |" in trends
+    assert action_findings(analysis, "formulas") is None
@@ -0,0 +1,88 @@
+"""
+Tests for vectorized column type inference
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.column_types import append_rows, convert_like, infer_column_types
+from holysheet.sheet_loader import rows_to_frame
+
+
+def test_currency_percent_dates_and_categories():
+    frame = pd.DataFrame(
+        {
+            "Date": ["2024-01-05", "2024-02-10", "2024-03-15", "2024-03-20"],
+            "Amount": ["$1,234.56", "(45.00)", "$10", "-3.5"],
+            "Rate": ["5%", "12.5%", "0%", "100%"],
+            "Category": ["Rent", "Food", "Rent", "Food"],
+            "Memo": ["a", "b", "c", "d"],
+            "Zip": ["02134", "10001", "94105", "60601"],
+            "Qty": ["1", "2", "3", "4"],
+        }
+    )
+    typed = infer_column_types(frame)
+
+    assert pd.api.types.is_datetime64_any_dtype(typed["Date"])
+    assert typed["Amount"].tolist() == [1234.56, -45.0, 10.0, -3.5]
+    assert typed["Rate"].tolist() == [0.05, 0.125, 0.0, 1.0]
+    assert isinstance(typed["Category"].dtype, pd.CategoricalDtype)
+    assert not isinstance(typed["Memo"].dtype, pd.CategoricalDtype)
+    assert typed["Zip"].tolist()[0] == "02134"  # leading zeros stay text
+    assert typed["Qty"].dtype == "int8"
+    assert typed.select_dtypes(include=["number"]).columns.tolist() == [
+        "Amount",
+        "Rate",
+        "Qty",
+    ]
+
+
+def test_us_dates_and_blanks():
+    frame = pd.DataFrame({"When": ["01/31/2023", "", "02/28/2023", None]})
+    typed = infer_column_types(frame)
+    assert pd.api.types.is_datetime64_any_dtype(typed["When"])
+    assert typed["When"].isna().sum() == 2
+
+
+def test_appended_rows_keep_the_inferred_date_format():
+    frame = pd.DataFrame({"When": ["25/03/2024", "31/03/2024", "13/04/2024"]})
+    typed = infer_column_types(frame)
+    assert typed.attrs["date_formats"] == {"When": "%d/%m/%Y"}
+
+    # Every new day is <= 12, so mm/dd would fit them too
+    new = convert_like(pd.DataFrame({"When": ["05/04/2024", "01/12/2024"]}), typed)
+    assert new["When"].dt.month.tolist() == [4, 12]
+    assert append_rows(typed, new).attrs == typed.attrs
+
+    # Without a recorded format the column is inferred again from scratch
+    typed.attrs = {}
+    assert convert_like(pd.DataFrame({"When": ["05/04/2024"]}), typed) is None
+
+
+def test_ragged_rows_and_duplicate_headers():
+    frame = rows_to_frame(
+        ["Amount", "Amount", ""],
+        [["1", "2"], ["3", "4", "x", "extra"], ["5"]],
+    )
+    assert list(frame.columns) == ["Amount", "Amount (2)", "Column 3", "Column 4"]
+    typed = infer_column_types(frame)
+    assert typed["Amount"].tolist() == [1, 3, 5]
+    assert typed["Amount (2)"].isna().sum() == 1
+
+
+def test_memory_shrinks_on_ledger():
+    rows = 5000
+    frame = pd.DataFrame(
+        {
+            "Amount": [f"${i:,}.25" for i in range(rows)],
+            "Category": [["Rent", "Food", "Travel"][i % 3] for i in range(rows)],
+        },
+        dtype=object,
+    )
+    before = frame.memory_usage(deep=True).sum()
+    after = infer_column_types(frame).memory_usage(deep=True).sum()
+    assert after * 3 < before
@@ -0,0 +1,74 @@
+"""
+Tests for the Claude call concurrency limiter
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.concurrency import ConcurrencyLimiter, QueueTimeout
+
+
+def test_global_limit_allows_parallel_sessions():
+    """Different sessions run side by side up to the global cap"""
+    limiter = ConcurrencyLimiter(max_concurrent=3, max_per_session=1)
+    peak = 0
+
+    async def work(session):
+        nonlocal peak
+        async with limiter.slot(session):
+            peak = max(peak, limiter.active)
+            await asyncio.sleep(0.05)
+
+    async def run():
+        await asyncio.gather(*(work(i) for i in range(6)))
+
+    asyncio.run(run())
+    assert peak == 3
+    assert limiter.stats()["sessions"] == 0
+
+
+def test_per_session_limit_serializes_one_session():
+    limiter = ConcurrencyLimiter(max_concurrent=10, max_per_session=1)
+    peak = 0
+
+    async def work():
+        nonlocal peak
+        async with limiter.slot("same"):
+            peak = max(peak, limiter.active)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(work() for _ in range(4)))
+
+    asyncio.run(run())
+    assert peak == 1
+
+
+def test_queue_timeout():
+    limiter = ConcurrencyLimiter(
+        max_concurrent=1, max_per_session=1, queue_timeout=0.05
+    )
+
+    async def hold():
+        async with limiter.slot("a"):
+            await asyncio.sleep(0.3)
+
+    async def late():
+        await asyncio.sleep(0.01)
+        async with limiter.slot("b"):
+            pass
+
+    async def run():
+        holder = asyncio.create_task(hold())
+        with pytest.raises(QueueTimeout):
+            await late()
+        await holder
+
+    asyncio.run(run())
+    assert limiter.timeouts == 1
+    assert limiter.active == 0 and limiter.waiting == 0
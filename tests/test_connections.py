@@ -0,0 +1,188 @@
+"""
+Tests for the WebSocket connection manager
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.connections import ConnectionManager, pick_subprotocol
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0, gate=None, subprotocols=()):
+        self.delay = delay
+        self.gate = gate
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.subprotocol = None
+        self.received = []
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, text):
+        if self.gate is not None:
+            await self.gate.wait()
+        await asyncio.sleep(self.delay)
+        self.received.append(text)
+
+    async def send_bytes(self, data):
+        await self.send_text(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+async def drain():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_stalled_client_does_not_delay_others():
+    async def run():
+        manager = ConnectionManager(max_queue=4, policy="drop")
+        stalled = FakeSocket(gate=asyncio.Event())
+        fast = [FakeSocket() for _ in range(3)]
+        for ws in [stalled] + fast:
+            await manager.connect(ws)
+        for i in range(10):
+            await manager.broadcast(f"update {i}")
+            await drain()
+        return manager, stalled, fast
+
+    manager, stalled, fast = asyncio.run(run())
+    for ws in fast:
+        assert ws.received == [f"update {i}" for i in range(10)]
+    assert stalled.received == []
+    assert manager.stats()["dropped"] == 5  # one in the writer, four queued
+
+
+def test_coalesce_keeps_latest_keyed_update():
+    async def run():
+        manager = ConnectionManager(max_queue=8, policy="coalesce")
+        gate = asyncio.Event()
+        ws = FakeSocket(gate=gate)
+        await manager.connect(ws)
+        await manager.broadcast("start")
+        await drain()  # the writer is now blocked sending "start"
+        for pct in range(0, 101, 10):
+            await manager.broadcast(f"progress {pct}", key="progress:job")
+        await manager.broadcast("done")
+        gate.set()
+        await drain()
+        return manager, ws
+
+    manager, ws = asyncio.run(run())
+    assert ws.received == ["start", "progress 100", "done"]
+    assert manager.stats()["coalesced"] == 10
+
+
+def test_disconnect_policy_closes_slow_client():
+    async def run():
+        manager = ConnectionManager(max_queue=2, policy="disconnect")
+        ws = FakeSocket(gate=asyncio.Event())
+        await manager.connect(ws)
+        for i in range(5):
+            await manager.broadcast(str(i))
+        await drain()
+        return manager, ws
+
+    manager, ws = asyncio.run(run())
+    assert ws not in manager
+    assert ws.closed_with == 1013
+    assert manager.stats()["slow_disconnects"] == 1
+
+
+def test_personal_messages_wait_instead_of_dropping():
+    async def run():
+        manager = ConnectionManager(max_queue=2, policy="drop")
+        ws = FakeSocket(delay=0.001)
+        await manager.connect(ws)
+        for i in range(20):
+            await manager.send_personal_message(str(i), ws)
+        await asyncio.sleep(0.1)
+        manager.disconnect(ws)
+        return manager, ws
+
+    manager, ws = asyncio.run(run())
+    assert ws.received == [str(i) for i in range(20)]
+    assert len(manager) == 0
+
+
+def test_stalled_write_times_out():
+    async def run():
+        manager = ConnectionManager(send_timeout=0.05)
+        ws = FakeSocket(gate=asyncio.Event())
+        await manager.connect(ws)
+        await manager.send_personal_message("hello", ws)
+        await asyncio.sleep(0.1)
+        return manager, ws
+
+    manager, ws = asyncio.run(run())
+    assert ws not in manager
+    assert ws.closed_with == 1013
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        ConnectionManager(policy="block")
+
+
+def test_negotiated_clients_get_batched_frames_with_merged_deltas():
+    async def run():
+        manager = ConnectionManager(batch_delay=0.01)
+        ws = FakeSocket(subprotocols=["holysheet.json"])
+        legacy = FakeSocket()
+        await manager.connect(ws)
+        await manager.connect(legacy)
+        for part in ["Hel", "lo", "!"]:
+            delta = {"type": "chat_delta", "request_id": "r1", "text": part}
+            await manager.send_personal_message(delta, ws)
+            await manager.send_personal_message(delta, legacy)
+        await manager.send_personal_message({"type": "chat_end"}, ws)
+        await asyncio.sleep(0.05)
+        return manager, ws, legacy
+
+    manager, ws, legacy = asyncio.run(run())
+    assert ws.subprotocol == "holysheet.json"
+    assert [json.loads(frame) for frame in ws.received] == [
+        [
+            {"type": "chat_delta", "request_id": "r1", "text": "Hello!"},
+            {"type": "chat_end"},
+        ]
+    ]
+    # No subprotocol: one plain JSON frame per message, as before
+    assert legacy.subprotocol is None
+    assert [json.loads(frame)["text"] for frame in legacy.received] == [
+        "Hel",
+        "lo",
+        "!",
+    ]
+    assert manager.stats()["sent"] == 7
+    assert manager.stats()["frames"] == 4
+
+
+def test_msgpack_frames_are_binary_and_encoded_once():
+    msgpack = pytest.importorskip("msgpack")
+
+    async def run():
+        manager = ConnectionManager()
+        sockets = [FakeSocket(subprotocols=["holysheet.msgpack"]) for _ in range(2)]
+        for ws in sockets:
+            await manager.connect(ws)
+        await manager.broadcast({"type": "progress", "done": 3, "total": 10})
+        await asyncio.sleep(0.05)
+        return sockets
+
+    sockets = asyncio.run(run())
+    frames = [ws.received[0] for ws in sockets]
+    assert frames[0] is frames[1]
+    assert msgpack.unpackb(frames[0]) == {"type": "progress", "done": 3, "total": 10}
+    assert pick_subprotocol(["chat", "holysheet.json"]) == "holysheet.json"
+    assert pick_subprotocol(["chat"]) is None
@@ -0,0 +1,60 @@
+"""
+Tests for the token-budgeted sheet context builder
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.context import build_sheet_context, estimate_tokens, sample_positions
+
+
+def ledger(rows=20000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range("2019-01-01", periods=rows, freq="3h"),
+            "Category": pd.Categorical(rng.choice(["Rent", "Food", "Travel"], rows)),
+            "Amount": rng.normal(100, 25, rows).round(2),
+            "Memo": [f"memo {i}" for i in range(rows)],
+        }
+    )
+
+
+def test_context_fits_budget_and_covers_whole_sheet():
+    frame = ledger()
+    context = build_sheet_context(frame, budget_tokens=1500)
+
+    assert estimate_tokens(context) <= 1500 * 1.1
+    assert "20,000 rows x 4 columns" in context
+    assert "- Amount [C]: float64" in context
+    assert "median" in context
+    assert "Totals by year (Date)" in context
+    assert "2021" in context  # aggregates reach past the first rows
+    assert "Sample (" in context
+
+
+def test_small_sheet_includes_all_rows():
+    frame = pd.DataFrame({"Vendor": ["Acme", "Beta"], "Amount": [1.5, 2.0]})
+    context = build_sheet_context(frame, budget_tokens=2000)
+    assert "Sample (all rows" in context
+    assert "Acme" in context and "Beta" in context
+
+
+def test_sample_positions_spread_over_time():
+    frame = ledger(1000).sample(frac=1, random_state=1)
+    positions = sample_positions(frame, 10)
+    dates = frame["Date"].iloc[positions].sort_values()
+    assert dates.iloc[0] == frame["Date"].min()
+    assert dates.iloc[-1] == frame["Date"].max()
+
+
+def test_tiny_budget_still_names_all_columns():
+    frame = pd.DataFrame({f"c{i}": range(5) for i in range(200)})
+    context = build_sheet_context(frame, budget_tokens=300)
+    assert "more columns" in context
+    assert "c199" in context
@@ -0,0 +1,134 @@
+"""
+Tests for near-duplicate transaction detection
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.duplicates import (
+    describe_clusters,
+    find_near_duplicates,
+    guess_columns,
+    normalize_vendor,
+)
+
+
+def transactions():
+    return pd.DataFrame(
+        {
+            "Date": pd.to_datetime(
+                [
+                    "2024-03-01",
+                    "2024-03-02",
+                    "2024-03-01",
+                    "2024-03-05",
+                    "2024-03-01",
+                    "2024-03-01",
+                    "2024-03-10",
+                    "2024-03-10",
+                ]
+            ),
+            "Vendor": [
+                "Amazon.com",
+                "AMAZON.COM*MK12",
+                "Starbucks",
+                "Amazon.com",
+                "Shell Oil",
+                "Amazon.com",
+                "Rent",
+                "Rent",
+            ],
+            "Amount": [45.99, 46.00, 5.25, 45.99, 30.0, 45.99, 1200.0, 1200.0],
+        }
+    )
+
+
+def test_guesses_columns_and_normalizes_vendors():
+    frame = transactions()
+    assert guess_columns(frame) == {
+        "vendor": "Vendor",
+        "amount": "Amount",
+        "date": "Date",
+    }
+    names = normalize_vendor(pd.Series(["AMAZON.COM*MK12", "Amazon.com, Inc.", "  "]))
+    assert names.tolist()[:2] == ["amazon mk", "amazon"]
+    assert pd.isna(names[2])
+
+
+def test_clusters_similar_vendors_within_tolerances():
+    clusters = find_near_duplicates(transactions())
+
+    assert [c.rows for c in clusters] == [[2, 3, 7], [8, 9]]
+    assert clusters[0].similarity == 0.67 and not clusters[0].exact
+    assert clusters[1].similarity == 1.0 and clusters[1].exact
+    # Four days later is outside the one-day tolerance
+    assert all(5 not in c.rows for c in clusters)
+
+    strict = find_near_duplicates(transactions(), amount_tolerance=0)
+    assert [c.rows for c in strict] == [[2, 7], [8, 9]]
+    wide = find_near_duplicates(transactions(), date_tolerance=4)
+    assert wide[0].rows == [2, 3, 5, 7]
+
+
+def test_matches_on_the_columns_there_are():
+    frame = transactions()
+    assert find_near_duplicates(frame[["Date"]]) == []
+    assert find_near_duplicates(frame.iloc[0:0]) == []
+    undated = find_near_duplicates(frame[["Vendor", "Amount"]])
+    assert undated[0].rows == [2, 3, 5, 7]
+    no_vendor = find_near_duplicates(frame[["Date", "Amount"]])
+    assert [c.rows for c in no_vendor] == [[2, 3, 7], [8, 9]]
+
+
+def test_unhinted_columns_are_not_guessed():
+    frame = transactions().rename(columns={"Vendor": "Note", "Amount": "Ref"})
+    frame["Note"] = list("abcdefgh")
+    assert guess_columns(frame) == {"vendor": None, "amount": None, "date": "Date"}
+    # Only the date criterion is left, which is not enough
+    assert find_near_duplicates(frame) == []
+
+    frame = transactions().rename(columns={"Vendor": "Note"})
+    frame["Note"] = list("abcdefgh")
+    clusters = find_near_duplicates(frame)
+    assert [c.rows for c in clusters] == [[2, 3, 7], [8, 9]]
+    assert not clusters[1].exact
+
+
+def test_describe_lists_only_near_duplicates():
+    frame = transactions()
+    text = describe_clusters(frame, find_near_duplicates(frame))
+
+    assert text.startswith(
+        "Near-duplicate transactions (Vendor, Amount, Date): 1 clusters, 3 rows"
+    )
+    assert "- rows 2, 3, 7: Amazon.com, 45.99" in text
+    assert "rows 8, 9" not in text
+
+
+def test_large_sheets_stay_fast():
+    rng = np.random.default_rng(0)
+    n = 200_000
+    letters = [chr(65 + i) for i in range(26)]
+    vendors = np.array(
+        [f"Shop {a}{b}{c}" for a in letters for b in letters for c in "AB"]
+    )
+    frame = pd.DataFrame(
+        {
+            "Date": pd.Timestamp("2022-01-01")
+            + pd.to_timedelta(rng.integers(0, 730, n), unit="D"),
+            "Vendor": vendors[rng.integers(0, len(vendors), n)],
+            # Every amount identical: blocks far over max_block
+            "Amount": np.full(n, 10.0),
+        }
+    )
+    start = time.perf_counter()
+    clusters = find_near_duplicates(frame)
+    assert time.perf_counter() - start < 20
+    rows = frame.iloc[[r - 2 for r in clusters[0].rows]]
+    assert rows["Vendor"].nunique() == 1 and rows["Date"].nunique() == 1
@@ -0,0 +1,165 @@
+"""
+Tests for the pooled Google API client factory
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet import google_clients
+from holysheet.google_clients import (
+    GoogleClientFactory,
+    PooledHttp,
+    TokenRefresher,
+    discovery_document,
+)
+
+
+class FakeHttp:
+    """Answers every request with a canned JSON body"""
+
+    created = 0
+
+    def __init__(self, body=None, delay=0.0):
+        FakeHttp.created += 1
+        self.body = body or {}
+        self.delay = delay
+        self.requests = []
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        self.requests.append((method, uri))
+        time.sleep(self.delay)
+        return SimpleNamespace(status=200, reason="OK"), json.dumps(self.body).encode()
+
+
+def test_pool_caps_transports_and_reuses_them():
+    made = []
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    class Counting(FakeHttp):
+        def request(self, *args, **kwargs):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            try:
+                return super().request(*args, **kwargs)
+            finally:
+                with lock:
+                    active -= 1
+
+    def factory():
+        made.append(Counting(delay=0.02))
+        return made[-1]
+
+    pool = PooledHttp(factory, size=3)
+    threads = [
+        threading.Thread(target=pool.request, args=("https://x/",)) for _ in range(12)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(made) == 3
+    assert peak == 3
+    assert sum(len(h.requests) for h in made) == 12
+    assert pool.stats()["idle"] == 3
+
+
+def test_pool_prefers_most_recently_used_transport():
+    made = []
+    pool = PooledHttp(lambda: made.append(FakeHttp()) or made[-1], size=4)
+    for _ in range(5):
+        pool.request("https://x/")
+    assert len(made) == 1
+
+
+def test_discovery_document_is_read_once(tmp_path, monkeypatch):
+    (tmp_path / "sheets.v4.json").write_text('{"name": "local copy"}')
+    reads = []
+    real = google_clients.load_discovery_document
+
+    def counting(*args):
+        reads.append(args)
+        return real(*args)
+
+    monkeypatch.setattr(google_clients, "load_discovery_document", counting)
+    monkeypatch.setattr(google_clients, "_documents", {})
+    for _ in range(3):
+        doc = discovery_document("sheets", "v4", str(tmp_path))
+    assert json.loads(doc) == {"name": "local copy"}
+    assert len(reads) == 1
+
+
+def test_factory_builds_services_once_on_pooled_http():
+    pytest.importorskip("googleapiclient")
+    body = {"properties": {"title": "Budget"}}
+    factory = GoogleClientFactory(
+        credentials=None, pool_size=2, http_factory=lambda: FakeHttp(body)
+    )
+    sheets = factory.sheets()
+    assert factory.sheets() is sheets
+    assert sheets._http is factory.http
+
+    result = sheets.spreadsheets().get(spreadsheetId="abc").execute()
+    assert result == body
+    assert factory.http.stats()["created"] == 1
+
+
+class FakeCredentials:
+    def __init__(self, expires_in):
+        self.token = "old"
+        self.refresh_token = "refresh"
+        self.expiry = datetime(2024, 1, 1) + timedelta(seconds=expires_in)
+
+
+def test_refresher_refreshes_before_expiry():
+    now = datetime(2024, 1, 1)
+    creds = FakeCredentials(expires_in=3600)
+    refreshed = []
+    saved = []
+
+    def refresh(c):
+        c.token = "new"
+        c.expiry = now + timedelta(hours=1)
+        refreshed.append(c)
+
+    refresher = TokenRefresher(
+        creds, margin=300, refresh=refresh, on_refresh=saved.append, now=lambda: now
+    )
+    assert refresher.refresh_if_due() is False
+
+    now += timedelta(minutes=56)
+    assert refresher.refresh_if_due() is True
+    assert creds.token == "new"
+    assert saved == [creds]
+    assert refresher.refresh_if_due() is False
+
+
+def test_refresher_survives_refresh_errors():
+    def fail(c):
+        raise OSError("network down")
+
+    refresher = TokenRefresher(
+        FakeCredentials(expires_in=0), refresh=fail, now=lambda: datetime(2024, 1, 1)
+    )
+    assert refresher.refresh_if_due() is False
+    assert refresher.errors == 1
+
+
+def test_loader_reuses_the_pool_instead_of_new_transports():
+    from holysheet.sheet_loader import default_http_factory
+
+    pool = PooledHttp(FakeHttp, size=2, credentials=object())
+    assert default_http_factory(SimpleNamespace(_http=pool)) is None
@@ -0,0 +1,114 @@
+"""
+Tests for token-budgeted conversation memory
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet import prompts
+from holysheet.memory import ConversationMemory, normalize, turn_tokens
+
+
+def chat(turns, words=40):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i} " + "x " * words})
+        history.append({"role": "assistant", "content": f"answer {i} " + "y " * words})
+    return history
+
+
+def test_window_keeps_recent_whole_exchanges_within_budget():
+    history = chat(10)
+    memory = ConversationMemory(budget_tokens=200)
+    history.append({"role": "user", "content": "and now?"})
+
+    window = memory.window(history, "and now?")
+
+    assert window[0]["role"] == "user"
+    assert window[-1]["role"] == "assistant"
+    assert window[-1]["content"].startswith("answer 9")
+    assert sum(turn_tokens(t) for t in window) <= 200
+    assert len(window) < 20
+
+
+def test_normalize_alternates_roles():
+    turns = [
+        {"role": "assistant", "content": "welcome"},
+        {"role": "user", "content": "a"},
+        {"role": "user", "content": "b"},
+        {"role": "assistant", "content": ""},
+        {"role": "assistant", "content": "c"},
+        {"role": "user", "content": "unanswered"},
+    ]
+    assert normalize(turns) == [
+        {"role": "user", "content": "a\n\nb"},
+        {"role": "assistant", "content": "c"},
+    ]
+
+
+def test_compaction_folds_old_turns_into_summary():
+    history = chat(10)
+    memory = ConversationMemory(budget_tokens=200, summary_tokens=100)
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append(len(turns))
+        return "talked about questions 0 to 7"
+
+    assert memory.compact(history, summarize)
+    assert memory.summary == "talked about questions 0 to 7"
+    kept = history[memory.summarized :]
+    assert kept[0]["role"] == "user"
+    assert sum(turn_tokens(t) for t in kept) <= 100
+    assert calls == [memory.summarized]
+    # Within budget again, so nothing to do
+    assert not memory.compact(history, summarize)
+
+    # A failing summarizer falls back to abbreviated turns
+    history.extend(chat(10))
+
+    async def broken(summary, turns):
+        raise RuntimeError("no model")
+
+    assert asyncio.run(memory.compact_async(history, broken))
+    assert "Assistant: answer" in memory.summary
+    assert len(memory.summary) <= 100 * 4
+
+
+def test_usage_is_recorded_per_request():
+    memory = ConversationMemory()
+    memory.window(chat(2))
+    memory.record_usage({"input_tokens": 900, "output_tokens": 50})
+    memory.record_usage({"input_tokens": 300, "output_tokens": 80}, kind="summary")
+    memory.record_usage(None)
+
+    stats = memory.stats()
+    assert stats["requests"] == 2
+    assert stats["input_tokens"] == 1200
+    assert stats["output_tokens"] == 130
+    assert memory.usage[0]["history_tokens"] > 0
+    assert stats["last"]["kind"] == "summary"
+
+    restored = ConversationMemory()
+    restored.restore(memory.to_record())
+    assert restored.stats() == stats
+
+
+def test_request_carries_history_and_summary():
+    history = [
+        {"role": "user", "content": "total for March?"},
+        {"role": "assistant", "content": "1,200"},
+    ]
+    request = prompts.build_request(
+        "and April?", "sheet", "Ledger", history=history, summary="Budget review"
+    )
+
+    assert request["system"][-1]["text"].endswith("Budget review")
+    assert "cache_control" in request["system"][-2]
+    assert [m["role"] for m in request["messages"]] == ["user", "assistant", "user"]
+    # Second breakpoint after the conversation so far
+    assert request["messages"][1]["content"][0]["cache_control"]
+    assert history[1]["content"] == "1,200"
@@ -0,0 +1,79 @@
+"""
+Tests for windowed sheet previews
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.preview import PreviewViews, rows_window, view_order, window_frame
+from holysheet.query_tools import ToolError
+
+
+def ledger(rows=1000):
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range("2024-01-01", periods=rows, freq="D"),
+            "Vendor": pd.Categorical(
+                ["Acme", "Shell", "Starbucks", None] * (rows // 4)
+            ),
+            "Memo": [f"memo {i}" for i in range(rows)],
+            "Amount": np.arange(rows) * 1.5,
+        }
+    )
+
+
+def test_window_is_columnar_with_sheet_rows_and_local_labels():
+    frame = ledger()
+    page = rows_window(frame, view_order(frame), offset=500, limit=3)
+
+    assert page["total"] == 1000 and page["offset"] == 500
+    assert page["rows"] == [502, 503, 504]
+    assert [c["type"] for c in page["columns"]] == [
+        "date",
+        "category",
+        "text",
+        "number",
+    ]
+    dates, vendors, memos, amounts = page["data"]
+    assert dates == ["2025-05-15", "2025-05-16", "2025-05-17"]
+    assert [page["labels"]["1"][v] for v in vendors] == ["Acme", "Shell", "Starbucks"]
+    assert memos[0] == "memo 500" and amounts[0] == 750.0
+    assert rows_window(frame, view_order(frame), limit=10**6)["rows"][-1] == 1001
+
+
+def test_filters_search_and_sort_push_down():
+    frame = ledger()
+    order = view_order(
+        frame,
+        sort="Amount",
+        descending=True,
+        where=[{"column": "Vendor", "op": "==", "value": "Shell"}],
+        search="memo 9",
+    )
+    page = rows_window(frame, order, limit=2)
+    assert page["total"] == 28  # memo 9, 9x, 9xx rows that are Shell
+    assert page["rows"] == [999, 995]
+
+    # Missing vendors sort last either way
+    vendor_order = view_order(frame, sort="Vendor")
+    assert pd.isna(frame["Vendor"].iloc[vendor_order[-1]])
+    assert window_frame(frame, order, 0, 2)["Sheet row"].tolist() == [999, 995]
+
+    with pytest.raises(ToolError):
+        view_order(frame, sort="Nope")
+
+
+def test_views_remember_order_per_view():
+    frame = ledger()
+    views = PreviewViews(max_views=2)
+    first = views.order(frame, sort="Amount")
+    assert views.order(frame, sort="Amount") is first
+    views.order(frame, search="acme")
+    views.order(frame, sort="Date")
+    assert views.order(frame, sort="Amount") is not first
@@ -0,0 +1,62 @@
+"""
+Tests for cached prompt assembly
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.prompts import (
+    analysis_report,
+    build_request,
+    describe_usage,
+    usage_metrics,
+)
+
+
+def test_sheet_context_is_cached_prefix():
+    request = build_request("Total by month?", "Size: 10 rows", "Budget")
+    system = request["system"]
+    assert system[0]["text"].startswith("You are HolySheet")
+    assert "cache_control" not in system[0]
+    assert system[1]["text"] == 'Sheet: "Budget"\n\nSize: 10 rows'
+    assert system[1]["cache_control"] == {"type": "ephemeral"}
+    assert request["messages"] == [{"role": "user", "content": "Total by month?"}]
+
+
+def test_prefix_is_identical_across_turns():
+    first = build_request("q1", "ctx", "Budget")
+    second = build_request("q2", "ctx", "Budget")
+    assert first["system"] == second["system"]
+
+
+def test_without_sheet_instructions_are_cached():
+    request = build_request("hello")
+    assert len(request["system"]) == 1
+    assert request["system"][0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_usage_metrics():
+    usage = SimpleNamespace(
+        input_tokens=20,
+        output_tokens=300,
+        cache_creation_input_tokens=0,
+        cache_read_input_tokens=1980,
+    )
+    metrics = usage_metrics(usage)
+    assert metrics["cache_hit"] is True
+    assert metrics["cache_read_ratio"] == 0.99
+    assert "1,980 read from cache" in describe_usage(metrics)
+
+    # Older SDKs report no cache fields at all
+    metrics = usage_metrics(SimpleNamespace(input_tokens=5, output_tokens=1))
+    assert metrics["cache_hit"] is False
+
+
+def test_analysis_report_follows_button_order():
+    report = analysis_report({"trends": "Rising.", "analyze": "Mostly rent."}, "Budget")
+    assert report.startswith("# Analysis of Budget")
+    assert report.index("Analyze Data") < report.index("Find Trends")
+    assert "Clean Data" not in report
@@ -0,0 +1,174 @@
+"""
+Tests for LLM providers and routing
+"""
+
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet import prompts
+from holysheet.providers import (
+    AnthropicProvider,
+    OpenAICompatibleProvider,
+    ProviderError,
+    ProviderRouter,
+    to_openai_messages,
+)
+
+
+class FakeMessages:
+    def __init__(self, text="remote answer", error=None):
+        self.text = text
+        self.error = error
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=self.text)],
+            stop_reason="end_turn",
+            usage=SimpleNamespace(input_tokens=10, output_tokens=2),
+        )
+
+
+class AsyncFakeMessages(FakeMessages):
+    async def create(self, **kwargs):
+        return FakeMessages.create(self, **kwargs)
+
+
+def anthropic_provider(messages):
+    return AnthropicProvider(SimpleNamespace(messages=messages), "claude-test")
+
+
+def chat_completion(request):
+    body = json.loads(request.content)
+    if body["stream"]:
+        chunks = [
+            {"choices": [{"delta": {"content": "lo"}}]},
+            {"choices": [{"delta": {"content": "cal"}, "finish_reason": "stop"}]},
+        ]
+        lines = [f"data: {json.dumps(c)}\n\n" for c in chunks] + ["data: [DONE]\n\n"]
+        return httpx.Response(200, text="".join(lines))
+    return httpx.Response(
+        200,
+        json={
+            "model": "llama-3.2-3b",
+            "choices": [
+                {"message": {"content": "local answer"}, "finish_reason": "stop"}
+            ],
+            "usage": {"prompt_tokens": 7, "completion_tokens": 2},
+        },
+    )
+
+
+def local_provider(handler=chat_completion):
+    return OpenAICompatibleProvider(transport=httpx.MockTransport(handler))
+
+
+def refuse(request):
+    raise httpx.ConnectError("connection refused", request=request)
+
+
+REQUEST = prompts.build_request("total?", "Amount column", "Ledger")
+
+
+def test_request_converted_to_chat_completions_messages():
+    messages = to_openai_messages(REQUEST)
+    assert [m["role"] for m in messages] == ["system", "user"]
+    assert "Amount column" in messages[0]["content"]
+    assert messages[1]["content"] == "total?"
+
+
+def test_local_provider_sync_async_and_stream():
+    local = local_provider()
+    completion = local.complete_sync(REQUEST)
+    assert completion.text == "local answer"
+    assert completion.model == "local-model"
+    assert completion.usage["input_tokens"] == 7
+
+    async def run():
+        answer = await local.complete(REQUEST)
+        events = [e async for e in local.stream(REQUEST)]
+        return answer, events
+
+    answer, events = asyncio.run(run())
+    assert answer.text == "local answer"
+    assert events[:2] == [("delta", "lo"), ("delta", "cal")]
+    assert events[-1][1].text == "local" and events[-1][1].stop_reason == "stop"
+
+
+def test_auto_routes_quick_actions_and_small_sheets_local():
+    router = ProviderRouter("auto", local=local_provider(), local_max_rows=100)
+    remote = anthropic_provider(FakeMessages())
+    assert [p.name for p in router.route(remote, quick=True)] == ["local", "anthropic"]
+    assert [p.name for p in router.route(remote, rows=50)] == ["local", "anthropic"]
+    assert [p.name for p in router.route(remote, rows=5000)] == ["anthropic", "local"]
+    assert [p.name for p in router.route(remote)] == ["anthropic", "local"]
+    assert [p.name for p in ProviderRouter().route(remote, quick=True)] == ["anthropic"]
+
+
+def test_falls_back_and_cools_down_unreachable_provider():
+    now = [0.0]
+    router = ProviderRouter(
+        "local", local=local_provider(refuse), cooldown=30, clock=lambda: now[0]
+    )
+    messages = FakeMessages()
+    providers = router.route(anthropic_provider(messages), quick=True)
+
+    assert router.complete_sync(REQUEST, providers).text == "remote answer"
+    assert router.stats()["providers"]["local"]["cooling_down"] is True
+    # While cooling down the remote model is tried first
+    assert [p.name for p in router._available(providers)] == ["anthropic", "local"]
+
+    now[0] = 31.0
+    assert [p.name for p in router._available(providers)] == ["local", "anthropic"]
+    assert router.fallbacks == 1
+
+
+def test_bad_request_falls_back_without_cooldown():
+    def bad_request(request):
+        return httpx.Response(400, json={"error": "context too long"})
+
+    router = ProviderRouter("local", local=local_provider(bad_request))
+    providers = router.route(anthropic_provider(FakeMessages()))
+    assert router.complete_sync(REQUEST, providers).provider == "anthropic"
+    assert router.stats()["providers"]["local"]["cooling_down"] is False
+
+
+def test_single_provider_error_is_raised_as_is():
+    router = ProviderRouter()
+    error = ValueError("invalid x-api-key")
+    with pytest.raises(ValueError):
+        router.complete_sync(REQUEST, [anthropic_provider(FakeMessages(error=error))])
+    with pytest.raises(ProviderError):
+        router.complete_sync(REQUEST, [])
+
+
+def test_stream_falls_back_before_first_token():
+    router = ProviderRouter("local", local=local_provider(refuse))
+    remote = AnthropicProvider(
+        SimpleNamespace(messages=AsyncFakeMessages()), "claude-test"
+    )
+
+    async def stream_remote(request, user=None):
+        yield "delta", "remote"
+        yield "end", remote._completion([await remote.client.messages.create()])
+
+    remote.stream = stream_remote
+
+    async def collect():
+        return [e async for e in router.stream(REQUEST, router.route(remote))]
+
+    events = asyncio.run(collect())
+    assert events[0] == ("open", remote)
+    assert events[1] == ("delta", "remote")
+    assert events[-1][1].provider == "anthropic"
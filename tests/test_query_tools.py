@@ -0,0 +1,231 @@
+"""
+Tests for the local query tools and the tool-use loop
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.providers import AnthropicProvider, ProviderRouter
+from holysheet.query_tools import QueryTools, describe_calls, describe_tables
+
+
+def ledger():
+    return pd.DataFrame(
+        {
+            "Date": pd.to_datetime(
+                ["2021-12-31", "2022-01-05", "2022-03-10", "2022-12-31", "2023-01-01"]
+            ),
+            "Category": ["Food", "Food", "Rent", "Food", "Rent"],
+            "Amount": [5.0, 12.5, 1200.0, 7.5, 1250.0],
+        }
+    )
+
+
+def test_aggregate_filters_and_groups_every_row():
+    tools = QueryTools(ledger())
+    text, is_error = tools.run(
+        "aggregate",
+        {
+            "where": [
+                {
+                    "column": "Date",
+                    "op": "between",
+                    "value": ["2022-01-01", "2022-12-31"],
+                }
+            ],
+            "group_by": ["Category"],
+            "metrics": [{"column": "Amount", "agg": "sum"}],
+            "sort_by": "sum(Amount)",
+        },
+    )
+
+    assert not is_error
+    assert text == "Category,sum(Amount)\nRent,1200\nFood,20\n(2 rows)"
+    call = tools.calls[0]
+    assert (call.name, call.rows, call.chars, call.error) == (
+        "aggregate",
+        2,
+        len(text),
+        None,
+    )
+    assert call.ms >= 0
+
+
+def test_top_k_pivot_and_describe():
+    tools = QueryTools(ledger())
+
+    text, _ = tools.run("top_k", {"column": "Amount", "k": 2, "columns": ["Amount"]})
+    assert text.splitlines()[:3] == ["row,Amount", "6,1250", "4,1200"]
+
+    text, _ = tools.run(
+        "pivot",
+        {"index": "Date", "columns": "Category", "values": "Amount", "period": "year"},
+    )
+    assert text.splitlines()[:4] == [
+        "Date,Food,Rent",
+        "2021,5,-",
+        "2022,20,1200",
+        "2023,-,1250",
+    ]
+
+    text, _ = tools.run("describe", {"columns": ["Category"]})
+    assert "Category,str" in text or "Category,object" in text
+    assert text.splitlines()[1].endswith("Food,3")
+
+
+def test_results_are_capped_and_errors_reported():
+    frame = pd.DataFrame({"Amount": range(1000)})
+    tools = QueryTools(frame, max_rows=5, max_chars=60)
+
+    text, is_error = tools.run("filter_rows", {})
+    assert not is_error and len(text) <= 60
+    assert text.endswith("(1,000 rows, first 5 shown)")
+    assert tools.calls[-1].rows == 1000
+
+    text, is_error = tools.run(
+        "filter_rows", {"where": [{"column": "Nope", "op": "==", "value": 1}]}
+    )
+    assert is_error and "No column 'Nope'" in text
+    text, is_error = tools.run("drop_table", {})
+    assert is_error and tools.calls[-1].error == "Unknown tool 'drop_table'"
+    assert describe_calls([c.to_dict() for c in tools.calls]).startswith(
+        "Queried the sheet 3x: filter_rows "
+    )
+
+
+def test_unexpected_failures_come_back_as_tool_errors():
+    tools = QueryTools(ledger())
+
+    def broken(**kwargs):
+        raise RuntimeError("pandas fell over")
+
+    tools._tool_describe = broken
+    text, is_error = tools.run("describe", {})
+    assert is_error and text == "Error: pandas fell over"
+    assert tools.calls[-1].error == "pandas fell over"
+
+
+def test_tables_can_be_picked_stacked_and_joined():
+    budget = pd.DataFrame({"Category": ["Food", "Rent"], "Budget": [30.0, 1000.0]})
+    tables = {
+        "2022": ledger().iloc[:4],
+        "2023": ledger().iloc[4:].reset_index(drop=True),
+        "Budget": budget,
+    }
+    tools = QueryTools(tables["2022"], tables=tables)
+
+    text, _ = tools.run("filter_rows", {"table": "2023"})
+    assert text.splitlines()[1].startswith("2,")
+    text, _ = tools.run(
+        "aggregate",
+        {
+            "tables": ["2022", "2023"],
+            "group_by": ["table"],
+            "metrics": [{"column": "Amount", "agg": "sum"}],
+        },
+    )
+    assert text.splitlines()[1:3] == ["2022,1225", "2023,1250"]
+    text, _ = tools.run(
+        "join",
+        {
+            "left": "2022",
+            "right": "Budget",
+            "on": "Category",
+            "columns": ["Category", "Amount", "Budget"],
+        },
+    )
+    assert text.splitlines()[:2] == ["Category,Amount,Budget", "Food,5,30"]
+
+    text, is_error = tools.run("filter_rows", {"table": "2024"})
+    assert is_error and "No table '2024'" in text
+    assert (
+        describe_tables(tables, "2022")
+        .splitlines()[1]
+        .startswith('- "2022" (active): 4 rows')
+    )
+
+
+def block(kind, **fields):
+    return SimpleNamespace(type=kind, **fields)
+
+
+class ScriptedMessages:
+    """Replies with tool calls until the script runs out, then with text"""
+
+    def __init__(self, tool_rounds):
+        self.tool_rounds = tool_rounds
+        self.requests = []
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        usage = SimpleNamespace(input_tokens=100, output_tokens=10)
+        step = len(self.requests) - 1
+        if step < self.tool_rounds:
+            call = block(
+                "tool_use",
+                id=f"call-{step}",
+                name="aggregate",
+                input={"group_by": ["Category"]},
+            )
+            return SimpleNamespace(
+                content=[block("text", text="Checking."), call],
+                stop_reason="tool_use",
+                usage=usage,
+            )
+        return SimpleNamespace(
+            content=[block("text", text="Food has 3 rows.")],
+            stop_reason="end_turn",
+            usage=usage,
+        )
+
+
+def ask(messages, tools):
+    provider = AnthropicProvider(SimpleNamespace(messages=messages), "claude-test")
+    request = {
+        "system": [{"type": "text", "text": "Instructions"}],
+        "messages": [{"role": "user", "content": "How many Food rows?"}],
+    }
+    return ProviderRouter().complete_sync(request, [provider], tools=tools)
+
+
+def test_tool_loop_sends_results_back_until_answered():
+    messages = ScriptedMessages(tool_rounds=1)
+    tools = QueryTools(ledger())
+
+    completion = ask(messages, tools)
+
+    assert completion.text == "Food has 3 rows."
+    assert completion.usage["input_tokens"] == 200
+    assert [c["name"] for c in completion.tool_calls] == ["aggregate"]
+    first, second = messages.requests
+    assert [t["name"] for t in first["tools"]] == [
+        "describe",
+        "filter_rows",
+        "aggregate",
+        "top_k",
+        "pivot",
+    ]
+    assert "query tools" in first["system"][0]["text"]
+    result = second["messages"][-1]["content"][0]
+    assert result["type"] == "tool_result" and result["tool_use_id"] == "call-0"
+    assert result["content"] == "Category,rows\nFood,3\nRent,2\n(2 rows)"
+
+
+def test_tool_loop_stops_after_max_steps():
+    messages = ScriptedMessages(tool_rounds=10)
+    tools = QueryTools(ledger(), max_steps=2)
+
+    completion = ask(messages, tools)
+
+    # Two rounds of tools, then one last reply that is returned as is
+    assert len(messages.requests) == 3
+    assert len(tools.calls) == 2
+    assert (
+        "last tool call" in messages.requests[2]["messages"][-1]["content"][-1]["text"]
+    )
+    assert completion.stop_reason == "tool_use"
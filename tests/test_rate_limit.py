@@ -0,0 +1,214 @@
+"""
+Tests for the API token buckets and retry scheduler
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.rate_limit import (
+    ApiGovernor,
+    Quota,
+    RetryPolicy,
+    TokenBucket,
+    classify_error,
+    parse_retry_after,
+)
+
+
+class FakeClock:
+    """Clock whose sleep just advances time"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Response(dict):
+    """httplib2.Response: a dict of lower-case headers with a status"""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+
+class HttpError(Exception):
+    """Shaped like googleapiclient.errors.HttpError"""
+
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.resp = Response(status, headers)
+
+
+class APIStatusError(Exception):
+    """Shaped like anthropic.APIStatusError"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def governor(clock, quota=Quota(60, 0), **policy):
+    return ApiGovernor(
+        {"sheets_read": quota, "anthropic": quota},
+        RetryPolicy(**policy),
+        burst_seconds=5,
+        clock=clock,
+        sleep=clock.sleep,
+        rng=lambda lo, hi: hi,
+    )
+
+
+def test_bucket_allows_burst_then_paces_at_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, burst_seconds=5, clock=clock)
+    waits = [bucket.acquire(clock.sleep) for _ in range(8)]
+    assert waits[:5] == [0, 0, 0, 0, 0]
+    assert waits[5:] == pytest.approx([1.0, 1.0, 1.0])
+    assert clock.now == pytest.approx(3.0)
+
+
+def test_reservations_are_served_in_arrival_order():
+    clock = FakeClock()
+    bucket = TokenBucket(per_minute=60, burst_seconds=1, clock=clock)
+    assert [bucket.reserve() for _ in range(4)] == pytest.approx([0, 1, 2, 3])
+
+
+def test_retries_transient_errors_then_succeeds():
+    clock = FakeClock()
+    gov = governor(clock, base_delay=1, max_delay=4)
+    outcomes = [HttpError(503), HttpError(500), {"ok": True}]
+
+    def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert gov.call("sheets_read", flaky) == {"ok": True}
+    assert clock.sleeps == [1, 2]  # 1 * 2**attempt, jitter pinned to the top
+    assert gov.stats()["sheets_read"]["retries"] == 2
+
+
+def test_retry_after_is_honoured_and_pauses_the_bucket():
+    clock = FakeClock()
+    gov = governor(clock, base_delay=0.5)
+    calls = []
+
+    def limited():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise APIStatusError(429, {"retry-after": "7"})
+        return "done"
+
+    assert gov.call("anthropic", limited) == "done"
+    assert calls[1] - calls[0] >= 7
+    # Other callers were held back by the same pause
+    assert gov.bucket("anthropic").reserve() > 0
+
+
+def test_client_errors_are_not_retried():
+    clock = FakeClock()
+    gov = governor(clock)
+
+    def forbidden():
+        raise HttpError(403)
+
+    with pytest.raises(HttpError):
+        gov.call("sheets_read", forbidden)
+    assert clock.sleeps == []
+    assert gov.stats()["sheets_read"]["failures"] == 1
+
+
+def test_gives_up_after_max_retries():
+    clock = FakeClock()
+    gov = governor(clock, max_retries=2)
+    attempts = []
+
+    def down():
+        attempts.append(1)
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        gov.call("sheets_read", down)
+    assert len(attempts) == 3
+
+
+def test_per_user_buckets_are_separate():
+    clock = FakeClock()
+    gov = governor(clock, quota=Quota(600, 60))
+    for _ in range(5):
+        gov.call("sheets_read", lambda: None, user="alice")
+    assert clock.sleeps == []
+    gov.call("sheets_read", lambda: None, user="alice")
+    gov.call("sheets_read", lambda: None, user="bob")
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_async_calls_queue_and_report_depth():
+    gov = ApiGovernor({"anthropic": Quota(600)}, burst_seconds=0.1)
+    peak = []
+
+    async def request():
+        peak.append(gov.stats().get("anthropic", {}).get("waiting", 0))
+        return "ok"
+
+    async def run():
+        return await asyncio.gather(
+            *(gov.call_async("anthropic", request) for _ in range(4))
+        )
+
+    assert asyncio.run(run()) == ["ok"] * 4
+    stats = gov.stats()["anthropic"]
+    assert stats["acquired"] == 4
+    assert stats["max_waiting"] == 3
+    assert stats["waiting"] == 0
+
+
+def test_bucket_is_thread_safe():
+    bucket = TokenBucket(per_minute=60000, burst_seconds=60)
+    threads = [
+        threading.Thread(target=lambda: [bucket.reserve() for _ in range(100)])
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert bucket.acquired == 800
+
+
+def test_parse_retry_after_and_classify():
+    assert parse_retry_after({"retry-after-ms": "1500"}) == 1.5
+    assert parse_retry_after({"retry-after": "3"}) == 3.0
+    assert parse_retry_after({}) is None
+    assert classify_error(APIStatusError(529)) == (True, 529, None)
+    assert classify_error(HttpError(404))[0] is False
+    assert classify_error(ValueError("bad"))[0] is False
+
+
+def test_classify_httpx_status_error():
+    import httpx
+
+    request = httpx.Request("GET", "https://sheets.googleapis.com/v4/spreadsheets/x")
+    response = httpx.Response(429, headers={"retry-after": "2"}, request=request)
+    error = httpx.HTTPStatusError("slow down", request=request, response=response)
+    assert classify_error(error) == (True, 429, 2.0)
+
+    response = httpx.Response(403, request=request)
+    error = httpx.HTTPStatusError("denied", request=request, response=response)
+    assert classify_error(error) == (False, 403, None)
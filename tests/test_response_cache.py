@@ -0,0 +1,68 @@
+"""
+Tests for the on-disk response cache
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.response_cache import ResponseCache, frame_fingerprint, make_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_round_trip_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache" / "responses.sqlite")
+    key = make_key("model", [{"text": "sys"}], [{"role": "user", "content": "hi"}])
+    ResponseCache(path).put(key, {"text": "answer"})
+
+    reopened = ResponseCache(path)
+    assert reopened.get(key) == {"text": "answer"}
+    assert reopened.get("missing") is None
+    assert reopened.stats()["hits"] == 1
+
+
+def test_ttl_expiry(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(str(tmp_path / "r.sqlite"), ttl=60, clock=clock)
+    cache.put("k", {"text": "a"})
+    clock.now += 61
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_size_bound_evicts_least_recently_used(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(str(tmp_path / "r.sqlite"), max_bytes=250, clock=clock)
+    for key in ("a", "b"):
+        cache.put(key, {"text": key * 80})
+        clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.put("c", {"text": "c" * 80})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_fingerprint_tracks_content():
+    frame = pd.DataFrame({"Amount": [1.0, 2.0], "Vendor": ["a", "b"]})
+    same = frame.copy()
+    changed = frame.copy()
+    changed.loc[1, "Amount"] = 2.5
+
+    assert frame_fingerprint(frame) == frame_fingerprint(same)
+    assert frame_fingerprint(frame) != frame_fingerprint(changed)
+    assert make_key("m", "s", "p", frame_fingerprint(frame)) != make_key(
+        "m", "s", "p", frame_fingerprint(changed)
+    )
@@ -0,0 +1,495 @@
+"""
+Tests for the FastAPI server (main.py)
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def get_final_message(self):
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text="".join(self.chunks))],
+            stop_reason="end_turn",
+            usage=SimpleNamespace(input_tokens=12, output_tokens=len(self.chunks)),
+        )
+
+
+class FakeMessages:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = []
+
+    def stream(self, **kwargs):
+        self.calls.append(kwargs)
+        return FakeStream(self.chunks)
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        text = "".join(self.chunks)
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)])
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    import main
+
+    fake = SimpleNamespace(messages=FakeMessages(["Hel", "lo", "!"]))
+    monkeypatch.setattr(main.holysheet_api, "claude", fake)
+    return main
+
+
+def test_stream_chat_events(server):
+    async def collect():
+        return [
+            event async for event in server.holysheet_api.stream_chat_with_claude("hi")
+        ]
+
+    events = asyncio.run(collect())
+    kinds = [kind for kind, _ in events]
+    assert kinds == ["start", "delta", "delta", "delta", "end"]
+    end = events[-1][1]
+    assert end["usage"]["input_tokens"] == 12
+    assert end["usage"]["output_tokens"] == 3
+    assert end["usage"]["cache_hit"] is False
+    assert end["timing"]["ttft_ms"] is not None
+
+
+def test_websocket_streams_deltas(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            assert ws.receive_json()["type"] == "session"
+            ws.send_json(
+                {"type": "chat", "message": "hi", "stream": True, "request_id": "r1"}
+            )
+            frames = [ws.receive_json() for _ in range(5)]
+
+    assert [f["type"] for f in frames] == [
+        "chat_start",
+        "chat_delta",
+        "chat_delta",
+        "chat_delta",
+        "chat_end",
+    ]
+    assert all(f["request_id"] == "r1" for f in frames)
+    assert "".join(f["text"] for f in frames if f["type"] == "chat_delta") == "Hello!"
+
+
+def test_websocket_msgpack_batches_stream(server):
+    msgpack = pytest.importorskip("msgpack")
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws", subprotocols=["holysheet.msgpack"]) as ws:
+            assert ws.accepted_subprotocol == "holysheet.msgpack"
+            assert msgpack.unpackb(ws.receive_bytes())["type"] == "session"
+            ws.send_json(
+                {"type": "chat", "message": "hi", "stream": True, "request_id": "r1"}
+            )
+            messages = []
+            while not messages or messages[-1]["type"] != "chat_end":
+                decoded = msgpack.unpackb(ws.receive_bytes())
+                messages.extend(decoded if isinstance(decoded, list) else [decoded])
+
+    deltas = [m["text"] for m in messages if m["type"] == "chat_delta"]
+    assert "".join(deltas) == "Hello!"
+    assert messages[0]["type"] == "chat_start"
+
+
+def test_websocket_plain_chat_response(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "chat", "message": "hi"})
+            frame = ws.receive_json()
+
+    assert frame == {"type": "chat_response", "message": "Hello!"}
+
+
+def test_follow_up_carries_earlier_turns(server):
+    from fastapi.testclient import TestClient
+
+    messages = server.holysheet_api.claude.messages
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            session_id = ws.receive_json()["session_id"]
+            for question in ["total for March?", "and April?"]:
+                ws.send_json({"type": "chat", "message": question})
+                assert ws.receive_json()["type"] == "chat_response"
+
+    sent = messages.calls[-1]["messages"]
+    assert [m["role"] for m in sent] == ["user", "assistant", "user"]
+    assert sent[0]["content"] == "total for March?"
+    assert sent[-1]["content"] == "and April?"
+    session = server.holysheet_api.sessions.get(session_id)
+    assert len(session.history) == 4
+
+
+def test_sessions_keep_sheets_apart(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from tests.fakes import FakeSheetsService
+
+    service = FakeSheetsService(
+        {"Ledger": [["Date", "Amount"], ["2024-01-01", "$5.00"], ["2024-01-02", "$7"]]}
+    )
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+    messages = server.holysheet_api.claude.messages
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as first:
+            first_id = first.receive_json()["session_id"]
+            first.send_json({"type": "load_sheet", "sheet": "session-test-sheet"})
+            loaded = first.receive_json()
+            assert loaded["type"] == "sheet_loaded"
+            assert loaded["data"]["rows"] == 2
+
+            first.send_json({"type": "chat", "message": "total?"})
+            first.receive_json()
+            assert "Amount" in messages.calls[-1]["system"][-1]["text"]
+
+        with client.websocket_connect("/ws") as second:
+            second.receive_json()
+            second.send_json({"type": "chat", "message": "total?"})
+            second.receive_json()
+            assert len(messages.calls[-1]["system"]) == 1  # no sheet leaked in
+
+        # Reconnecting with the token resumes the first session
+        with client.websocket_connect(f"/ws?session={first_id}") as again:
+            assert again.receive_json()["session_id"] == first_id
+
+    session = server.holysheet_api.sessions.get(first_id)
+    assert session.sheet_name == "Fake Workbook"
+    assert [m["role"] for m in session.history] == ["user", "assistant"]
+
+
+def test_session_reads_with_its_own_google_client(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from tests.fakes import FakeSheetsService
+
+    service = FakeSheetsService({"Ledger": [["Date", "Amount"], ["2024-01-01", "5"]]})
+    closed = []
+    factory = SimpleNamespace(sheets=lambda: service, close=lambda: closed.append(1))
+    monkeypatch.setattr(server, "client_factory_for_credentials", lambda c, s: factory)
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", None)
+    monkeypatch.setattr(server.holysheet_api, "setup_google_auth", lambda: False)
+    token = {"refresh_token": "r", "client_id": "c", "client_secret": "s"}
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            session_id = ws.receive_json()["session_id"]
+            ws.send_json({"type": "setup_google", "token": token})
+            assert ws.receive_json()["type"] == "google_connected"
+            ws.send_json({"type": "load_sheet", "sheet": "own-client-sheet"})
+            assert ws.receive_json()["type"] == "sheet_loaded"
+
+    # Read with the session's client, not put in the shared cache
+    assert any(name.startswith("values.") for name, _ in service.calls)
+    assert not any(
+        sid == "own-client-sheet"
+        for sid, _ in server.holysheet_api.sheet_cache._entries
+    )
+    server.holysheet_api.sessions.close(session_id)
+    assert closed == [1]
+
+
+def test_quick_action_answered_from_cache(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from holysheet.response_cache import ResponseCache
+    from tests.fakes import FakeSheetsService
+
+    service = FakeSheetsService({"Ledger": [["Date", "Amount"], ["2024-01-01", "5"]]})
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+    monkeypatch.setattr(
+        server.holysheet_api, "response_cache", ResponseCache(":memory:")
+    )
+    messages = server.holysheet_api.claude.messages
+    prompt = "Analyze this financial data."
+
+    def ask(ws, request_id):
+        ws.send_json(
+            {
+                "type": "chat",
+                "message": prompt,
+                "stream": True,
+                "request_id": request_id,
+                "action": "analyze",
+            }
+        )
+        frames = [ws.receive_json()]
+        while frames[-1]["type"] != "chat_end":
+            frames.append(ws.receive_json())
+        return frames
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "load_sheet", "sheet": "quick-action-sheet"})
+            ws.receive_json()
+            calls = len(messages.calls)
+            first = ask(ws, "a")
+            second = ask(ws, "b")
+
+    assert len(messages.calls) == calls + 1
+    assert "cached" not in first[-1]
+    assert second[-1]["cached"] is True
+    assert [f["text"] for f in second if f["type"] == "chat_delta"] == ["Hello!"]
+    assert all(f["request_id"] == "b" for f in second)
+
+
+def test_stats_endpoint(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        stats = client.get("/stats").json()
+
+    assert set(stats) == {
+        "chats",
+        "sessions",
+        "sheets",
+        "connections",
+        "apis",
+        "models",
+    }
+    assert stats["connections"]["connections"] == 0
+
+
+def test_quick_action_sends_whole_sheet_findings(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from holysheet.response_cache import ResponseCache
+    from tests.fakes import FakeSheetsService
+
+    rows = [["Date", "Amount"]] + [["2024-01-01", "5"], ["2024-01-01", "5"]]
+    rows += [[f"2024-02-{d:02d}", str(d)] for d in range(1, 28)]
+    service = FakeSheetsService({"Ledger": rows})
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+    monkeypatch.setattr(
+        server.holysheet_api, "response_cache", ResponseCache(":memory:")
+    )
+    messages = server.holysheet_api.claude.messages
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "load_sheet", "sheet": "findings-sheet"})
+            ws.receive_json()
+            ws.send_json({"type": "chat", "message": "Clean up", "action": "clean"})
+            duplicates = ws.receive_json()
+            ws.receive_json()
+
+    assert duplicates["type"] == "duplicates"
+    prompt = messages.calls[-1]["messages"][0]["content"]
+    assert "Computed over all 29 rows" in prompt
+    assert "- rows 2, 3" in prompt
+    assert prompt.endswith("Clean up")
+
+
+def test_clean_action_sends_near_duplicate_rows(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from holysheet.response_cache import ResponseCache
+    from tests.fakes import FakeSheetsService
+
+    rows = [
+        ["Date", "Vendor", "Amount"],
+        ["2024-03-01", "Amazon.com", "45.99"],
+        ["2024-03-02", "AMAZON.COM*MK12", "46.00"],
+        ["2024-03-01", "Starbucks", "5.25"],
+        ["2024-03-09", "Amazon.com", "45.99"],
+    ]
+    service = FakeSheetsService({"Card": rows})
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+    monkeypatch.setattr(
+        server.holysheet_api, "response_cache", ResponseCache(":memory:")
+    )
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "load_sheet", "sheet": "card-sheet"})
+            ws.receive_json()
+            ws.send_json(
+                {
+                    "type": "chat",
+                    "message": "Clean",
+                    "action": "clean",
+                    "request_id": "r1",
+                }
+            )
+            frame = ws.receive_json()
+            ws.receive_json()
+            ws.send_json({"type": "chat", "message": "Trends", "action": "trends"})
+            after = ws.receive_json()
+
+    assert frame["type"] == "duplicates"
+    assert frame["request_id"] == "r1"
+    assert frame["clusters"] == [{"rows": [2, 3], "similarity": 0.67, "exact": False}]
+    prompt = server.holysheet_api.claude.messages.calls[0]["messages"][0]["content"]
+    assert "Near-duplicate transactions (Vendor, Amount, Date): 1 clusters" in prompt
+    # Only the actions that look for duplicates send the rows
+    assert after["type"] == "chat_response"
+
+
+def test_workbook_tabs_load_as_tables(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from tests.fakes import FakeSheetsService
+
+    service = FakeSheetsService(
+        {
+            "2023": [["Date", "Amount"], ["2023-01-01", "5"]],
+            "2024": [["Date", "Amount"], ["2024-01-01", "7"], ["2024-01-02", "9"]],
+            "Notes": [],
+        }
+    )
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+    messages = server.holysheet_api.claude.messages
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_json()
+            ws.send_json({"type": "load_workbook", "sheet": "workbook-sheet"})
+            loaded = ws.receive_json()
+            ws.send_json({"type": "chat", "message": "Compare the years"})
+            ws.receive_json()
+            ws.send_json({"type": "select_sheet", "sheet": "workbook-sheet:2024"})
+            selected = ws.receive_json()
+            ws.send_json({"type": "select_sheet", "sheet": "nope"})
+            missing = ws.receive_json()
+
+    assert loaded["type"] == "workbook_loaded"
+    assert loaded["data"]["title"] == "Fake Workbook"
+    assert [t["rows"] for t in loaded["data"]["tabs"]] == [1, 2]
+    batch_calls = [c for c in service.calls if c[0] == "values.batchGet"]
+    assert len(batch_calls) == 1
+    system = messages.calls[-1]["system"][-1]["text"]
+    assert '"2023" (active)' in system and '"2024": 2 rows' in system
+    assert selected["type"] == "sheet_loaded" and selected["data"]["rows"] == 2
+    assert missing["type"] == "error"
+
+
+def test_rows_api_serves_compressed_windows(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from tests.fakes import FakeSheetsService
+
+    rows = [["Date", "Vendor", "Amount"]] + [
+        [f"2024-01-{i % 28 + 1:02d}", ["Acme", "Shell"][i % 2], str(i)]
+        for i in range(5000)
+    ]
+    service = FakeSheetsService({"Ledger": rows})
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            session_id = ws.receive_json()["session_id"]
+            ws.send_json({"type": "load_sheet", "sheet": "rows-api-sheet"})
+            ws.receive_json()
+
+        response = client.get(
+            "/api/rows",
+            params={"session": session_id, "offset": 10, "limit": 100},
+            headers={"Accept-Encoding": "gzip"},
+        )
+        window = response.json()
+        top = client.get(
+            "/api/rows",
+            params={
+                "session": session_id,
+                "sort": "Amount",
+                "desc": "true",
+                "where": '[{"column": "Vendor", "op": "==", "value": "Acme"}]',
+                "limit": 2,
+            },
+        ).json()
+        missing = client.get("/api/rows", params={"session": "nope"})
+        bad = client.get("/api/rows", params={"session": session_id, "sort": "Nope"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert window["total"] == 5000 and len(window["rows"]) == 100
+    assert window["rows"][0] == 12
+    assert top["total"] == 2500 and top["data"][2] == [4998, 4996]
+    assert missing.status_code == 404
+    assert bad.status_code == 400 and "Nope" in bad.json()["detail"]
+
+
+def test_rows_api_numbers_rows_from_the_range_start(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from tests.fakes import FakeSheetsService
+
+    rows = [["Report"], [], [], ["Vendor", "Amount"], ["Acme", "5"], ["Shell", "7"]]
+    service = FakeSheetsService({"Ledger": rows})
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            session_id = ws.receive_json()["session_id"]
+            ws.send_json(
+                {"type": "load_sheet", "sheet": "offset-sheet", "range": "Ledger!A4:B6"}
+            )
+            assert ws.receive_json()["data"]["rows"] == 2
+
+        window = client.get("/api/rows", params={"session": session_id}).json()
+
+    # Header on sheet row 4, so the data starts on row 5
+    assert window["rows"] == [5, 6]
+
+
+def test_chat_context_numbers_rows_from_the_range_start(server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from tests.fakes import FakeSheetsService
+
+    rows = [["Report"], [], [], ["Vendor", "Amount"], ["Acme", "5"], ["Shell", ""]]
+    rows = [["", ""] + row for row in rows]  # the table starts at column C
+    service = FakeSheetsService({"Ledger": rows})
+    monkeypatch.setattr(server.holysheet_api, "sheets_service", service)
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            session_id = ws.receive_json()["session_id"]
+            ws.send_json(
+                {"type": "load_sheet", "sheet": "offset-chat", "range": "Ledger!C4:D6"}
+            )
+            ws.receive_json()
+
+    session = server.holysheet_api.sessions.get(session_id)
+    request = server.holysheet_api.build_request(
+        "check", session=session, action="clean"
+    )
+    context = request["system"][-1]["text"]
+    assert "\n6    Shell" in context and "\n2 " not in context
+    assert "Vendor [C]" in context and "Amount [D]" in context
+    # Whole-sheet findings too: the empty Amount is cell D6
+    missing = server.session_analysis(session).missing[0]
+    assert missing["rows"] == [6] and missing["letter"] == "D"
@@ -0,0 +1,180 @@
+"""
+Tests for the per-connection session registry
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.sessions import SessionRegistry
+from holysheet.sheet_cache import estimate_size
+from holysheet.state import MemoryStateBackend, SQLiteStateBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def frame(rows=1000):
+    return pd.DataFrame({"Amount": range(rows), "Memo": ["x"] * rows})
+
+
+def test_unknown_token_gets_fresh_session():
+    registry = SessionRegistry()
+    session = registry.get_or_create("made-up-token")
+    assert session.session_id != "made-up-token"
+    assert registry.get_or_create(session.session_id) is session
+
+
+def test_idle_disconnected_sessions_are_evicted():
+    clock = FakeClock()
+    registry = SessionRegistry(idle_timeout=60, clock=clock)
+    idle = registry.get_or_create()
+    connected = registry.get_or_create()
+    connected.connections = 1
+
+    clock.now = 61
+    assert registry.evict_idle() == [idle.session_id]
+    assert registry.get(connected.session_id) is connected
+
+
+def test_resident_cap_unloads_least_recent_sessions_first():
+    clock = FakeClock()
+    size = estimate_size(frame())
+    registry = SessionRegistry(max_total_bytes=size * 2 + 10, clock=clock)
+
+    old, recent, new = (registry.get_or_create() for _ in range(3))
+    registry.attach_frame(old, "a", frame(), "A")
+    clock.now = 1
+    registry.attach_frame(recent, "b", frame(), "B")
+    clock.now = 2
+    registry.attach_frame(new, "c", frame(), "C")
+
+    assert old.frames == {}
+    assert "b" in recent.frames and new.sheet_name == "C"
+    assert registry.total_bytes <= registry.max_total_bytes
+    assert registry.stats()["unloaded_frames"] == 1
+
+
+def test_sheet_context_rebuilt_only_on_change():
+    registry = SessionRegistry()
+    session = registry.get_or_create()
+    calls = []
+
+    def build(df):
+        calls.append(1)
+        return f"{len(df)} rows"
+
+    assert session.sheet_context(build) is None
+    registry.attach_frame(session, "s", frame(10))
+    assert session.sheet_context(build) == "10 rows"
+    session.sheet_context(build)
+    registry.attach_frame(session, "s", frame(20))
+    assert session.sheet_context(build) == "20 rows"
+    assert len(calls) == 2
+
+
+def test_shared_backend_lets_another_worker_resume(tmp_path):
+    backend_path = str(tmp_path / "state.sqlite")
+    first = SessionRegistry(backend=SQLiteStateBackend(backend_path))
+    session = first.get_or_create()
+    first.attach_frame(session, "sheet:A1:B", frame(10), "Budget")
+    session.history.append({"role": "user", "content": "hi"})
+    session.memory.summary = "Earlier: budget questions"
+    first.save(session)
+
+    # A second process opening the same file picks the session up
+    second = SessionRegistry(backend=SQLiteStateBackend(backend_path))
+    resumed = second.get_or_create(session.session_id)
+    assert resumed.session_id == session.session_id
+    assert resumed.sheet_name == "Budget"
+    assert resumed.sheet_data.equals(frame(10))
+    assert resumed.history == [{"role": "user", "content": "hi"}]
+    assert resumed.memory.summary == "Earlier: budget questions"
+
+
+def test_worker_picks_up_changes_saved_by_another(tmp_path):
+    backend_path = str(tmp_path / "state.sqlite")
+    first = SessionRegistry(backend=SQLiteStateBackend(backend_path))
+    second = SessionRegistry(backend=SQLiteStateBackend(backend_path))
+    session = first.get_or_create()
+    first.attach_frame(session, "sheet:A1:B", frame(10), "Budget")
+    held = second.get_or_create(session.session_id)
+    kept = held.frames["sheet:A1:B"]
+
+    # The client moves back to the first worker and keeps going
+    session.history.append({"role": "user", "content": "hi"})
+    first.attach_frame(session, "sheet:Q1", frame(5), "Q1")
+
+    resumed = second.resume(session.session_id)
+    assert resumed is held
+    assert resumed.history == [{"role": "user", "content": "hi"}]
+    assert resumed.sheet_name == "Q1"
+    # Unchanged frames are not read back again
+    assert resumed.frames["sheet:A1:B"] is kept
+
+    # Two sessions on the same sheet keep their own snapshots
+    other = first.get_or_create()
+    first.attach_frame(other, "sheet:A1:B", frame(3), "Budget")
+    assert len(second.resume(session.session_id).frames["sheet:A1:B"]) == 10
+
+
+class Exploit:
+    ran = False
+
+    def __reduce__(self):
+        return (setattr, (Exploit, "ran", True))
+
+
+def test_frame_snapshots_are_arrow_not_pickle(tmp_path):
+    import pickle
+
+    backend_path = str(tmp_path / "state.sqlite")
+    first = SessionRegistry(backend=SQLiteStateBackend(backend_path))
+    session = first.get_or_create()
+    dated = frame(10).assign(When=pd.Timestamp("2024-03-25"))
+    dated.attrs["date_formats"] = {"When": "%d/%m/%Y"}
+    first.attach_frame(session, "sheet", dated, "Budget")
+    first.attach_frame(session, "other", frame(5), "Other")
+    first.save(session)
+
+    # Whoever can write the state file swaps a snapshot for a pickle
+    backend = SQLiteStateBackend(backend_path)
+    backend.set("sheet", f"{session.session_id}:other", pickle.dumps(Exploit()))
+    resumed = SessionRegistry(backend=backend).get_or_create(session.session_id)
+
+    assert not Exploit.ran
+    assert list(resumed.frames) == ["sheet"]
+    assert resumed.sheet_data["When"].dtype == dated["When"].dtype
+    assert resumed.sheet_data.attrs == dated.attrs
+
+
+def test_touch_renews_backend_entries(tmp_path):
+    clock = FakeClock()
+    backend = SQLiteStateBackend(str(tmp_path / "state.sqlite"), clock=clock)
+    registry = SessionRegistry(idle_timeout=100, clock=clock, backend=backend)
+    session = registry.get_or_create()
+    registry.attach_frame(session, "sheet", frame(10))
+
+    for _ in range(5):
+        clock.now += 60
+        registry.touch(session)
+
+    assert backend.get("session", session.session_id) is not None
+    assert backend.get("sheet", f"{session.session_id}:sheet") is not None
+
+
+def test_memory_backend_does_not_copy_frames():
+    backend = MemoryStateBackend()
+    registry = SessionRegistry(backend=backend)
+    session = registry.get_or_create()
+    registry.attach_frame(session, "sheet", frame(10))
+    assert backend.get("sheet", f"{session.session_id}:sheet") is None
+    assert backend.get("session", session.session_id) is not None
@@ -0,0 +1,146 @@
+"""
+Tests for the shared sheet data cache
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.sheet_cache import SheetCache, estimate_size
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_frame(rows=10):
+    return pd.DataFrame({"Amount": [str(i) for i in range(rows)]})
+
+
+def test_hit_within_window_skips_loader_and_revision_lookup():
+    clock = FakeClock()
+    cache = SheetCache(revalidate_after=30, clock=clock)
+    loads, lookups = [], []
+
+    def loader():
+        loads.append(1)
+        return make_frame()
+
+    def lookup(sheet_id):
+        lookups.append(sheet_id)
+        return "7"
+
+    first = cache.get_or_load("s1", "A1:Z1000", loader, lookup)
+    clock.now = 10
+    second = cache.get_or_load("s1", "A1:Z1000", loader, lookup)
+
+    assert second is first
+    assert len(loads) == 1
+    assert lookups == ["s1"]
+
+
+def test_revision_change_forces_reload():
+    clock = FakeClock()
+    cache = SheetCache(revalidate_after=30, clock=clock)
+    revision = {"value": "1"}
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return make_frame()
+
+    lookup = lambda sheet_id: revision["value"]  # noqa: E731
+
+    cache.get_or_load("s1", "A1:B2", loader, lookup)
+    clock.now = 40
+    cache.get_or_load("s1", "A1:B2", loader, lookup)
+    assert len(loads) == 1  # same revision, revalidated
+
+    revision["value"] = "2"
+    clock.now = 80
+    cache.get_or_load("s1", "A1:B2", loader, lookup)
+    assert len(loads) == 2
+
+
+def test_unknown_revision_expires_after_window():
+    clock = FakeClock()
+    cache = SheetCache(revalidate_after=5, clock=clock)
+    cache.put("s1", "A1:B2", make_frame())
+    assert cache.get("s1", "A1:B2") is not None
+    clock.now = 6
+    assert cache.get("s1", "A1:B2") is None
+
+
+def test_lru_eviction_under_byte_budget():
+    frame = make_frame(100)
+    size = estimate_size(frame)
+    cache = SheetCache(max_bytes=size * 2 + 1)
+
+    cache.put("s1", "r", frame)
+    cache.put("s2", "r", make_frame(100))
+    cache.get("s1", "r")  # s1 becomes most recently used
+    cache.put("s3", "r", make_frame(100))
+
+    assert cache.get("s2", "r") is None
+    assert cache.get("s1", "r") is not None
+    assert cache.total_bytes <= cache.max_bytes
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_one_spreadsheet():
+    cache = SheetCache()
+    cache.put("s1", "a", make_frame())
+    cache.put("s1", "b", make_frame())
+    cache.put("s2", "a", make_frame())
+    cache.invalidate("s1")
+    assert len(cache) == 1
+    assert cache.get("s2", "a") is not None
+
+
+def test_get_or_load_many_loads_only_the_misses():
+    cache = SheetCache()
+    cache.put("s1", "2023", make_frame(3))
+    requested = []
+
+    def loader(missing):
+        requested.append(missing)
+        return {name: make_frame(5) if name != "Empty" else None for name in missing}
+
+    frames = cache.get_or_load_many("s1", ["2023", "2024", "Empty"], loader)
+
+    assert requested == [["2024", "Empty"]]
+    assert list(frames) == ["2023", "2024"]
+    assert len(frames["2023"]) == 3
+    assert cache.get("s1", "2024") is frames["2024"]
+
+
+def test_get_or_refresh_hands_stale_copy_to_refresher():
+    clock = FakeClock()
+    cache = SheetCache(revalidate_after=30, clock=clock)
+    revision = {"s1": "1"}
+    refreshed = []
+
+    def refresher(old):
+        refreshed.append(len(old))
+        return pd.concat([old, make_frame(2)], ignore_index=True)
+
+    def fail():
+        raise AssertionError("should refresh, not reload")
+
+    first = cache.get_or_refresh("s1", "Ledger", make_frame, fail, revision.get)
+    clock.now = 10
+    assert cache.get_or_refresh("s1", "Ledger", fail, fail, revision.get) is first
+
+    revision["s1"] = "2"
+    clock.now = 45
+    frame = cache.get_or_refresh("s1", "Ledger", fail, refresher, revision.get)
+    assert refreshed == [10]
+    assert len(frame) == 12
+    assert cache.get("s1", "Ledger") is frame
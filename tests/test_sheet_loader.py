@@ -0,0 +1,227 @@
+"""
+Tests for auto-sized, chunked sheet loading
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet import rate_limit
+from holysheet.sheet_loader import (
+    SheetLoader,
+    column_letter,
+    get_workbook_info,
+    load_frame,
+    load_workbook,
+    range_start_column,
+    range_start_row,
+    refresh_frame,
+    split_range,
+)
+from tests.fakes import FakeSheetsService
+
+
+def ledger(rows, columns=30):
+    header = [f"Col{c}" for c in range(columns)]
+    body = [[f"{r}-{c}" for c in range(columns)] for r in range(rows)]
+    return [header] + body
+
+
+def test_column_letter():
+    assert column_letter(1) == "A"
+    assert column_letter(26) == "Z"
+    assert column_letter(27) == "AA"
+    assert column_letter(703) == "AAA"
+
+
+def test_split_range():
+    assert split_range(None) == (None, None)
+    assert split_range("Sheet1") == ("Sheet1", None)
+    assert split_range("A1:C9") == (None, "A1:C9")
+    assert split_range("'My Tab'!A1:C9") == ("My Tab", "A1:C9")
+    assert split_range("A:C") == (None, "A:C")
+    # Short tab names that look like cells
+    for tab in ["Q1", "Tax", "AB12"]:
+        assert split_range(tab) == (tab, None)
+    assert split_range("Q1", single_cells=True) == (None, "Q1")
+
+
+def test_range_start():
+    cases = {None: (1, 1), "Q1": (1, 1), "Sheet1!C5:F100": (5, 3), "B:D": (1, 2)}
+    for range_name, start in cases.items():
+        assert (range_start_row(range_name), range_start_column(range_name)) == start
+    assert range_start_column("'My Tab'!AB3") == 28
+
+
+def test_loads_past_old_hardcoded_range():
+    service = FakeSheetsService({"Ledger": ledger(2500, columns=30)})
+    frame = SheetLoader(service, chunk_rows=400, max_workers=3).load("sid")
+
+    assert frame.shape == (2500, 30)
+    assert frame.iloc[-1, -1] == "2499-29"
+    assert list(frame["Col0"][:3]) == ["0-0", "1-0", "2-0"]
+    batch_calls = [c for c in service.calls if c[0] == "values.batchGet"]
+    assert len(batch_calls) == 4  # 7 chunks, 2 ranges per request
+
+
+def test_blank_rows_at_chunk_boundary_keep_row_numbers():
+    rows = [["Vendor", "Amount"]] + [[f"V{i}", str(i)] for i in range(9)]
+    rows += [[], []]  # sheet rows 11-12 end the first chunk blank
+    rows += [[f"W{i}", str(i)] for i in range(5)]
+    service = FakeSheetsService({"Ledger": rows})
+    frame = SheetLoader(service, chunk_rows=12).load("sid")
+
+    assert len(frame) == 16
+    # Frame position + 2 is the sheet row
+    assert frame.index[frame["Vendor"] == "W0"][0] + 2 == 13
+    assert frame.iloc[9:11]["Vendor"].isna().all()
+
+    tab = get_workbook_info(service, "sid").tab("Ledger")
+    header, tail = SheetLoader(service, chunk_rows=4).read_rows("sid", tab, 9)
+    assert [row[0] if row else None for row in tail] == [
+        "V7",
+        "V8",
+        None,
+        None,
+        "W0",
+        "W1",
+        "W2",
+        "W3",
+        "W4",
+    ]
+
+
+def test_blank_end_of_a_large_grid_adds_no_rows():
+    rows = [["Vendor", "Amount"]] + [[f"V{i}", str(i)] for i in range(100)]
+    rows += [[] for _ in range(12_000 - len(rows))]
+    service = FakeSheetsService({"Ledger": rows})
+
+    frame = SheetLoader(service, chunk_rows=5000).load("sid")
+    assert len(frame) == 100
+    assert load_frame(service, "sid", "Ledger").shape == (100, 2)
+
+    tab = get_workbook_info(service, "sid").tab("Ledger")
+    _, tail = SheetLoader(service, chunk_rows=5000).read_rows("sid", tab, 90)
+    assert len(tail) == 12
+
+
+def test_ragged_rows_are_padded():
+    rows = [["Date", "Vendor", "Amount"], ["2024-01-01", "Acme"], ["2024-01-02"]]
+    service = FakeSheetsService({"Sheet1": rows})
+    frame = SheetLoader(service).load("sid")
+    assert frame.shape == (2, 3)
+    assert frame["Amount"].isna().all()
+
+
+def test_load_frame_explicit_range_and_named_tab():
+    service = FakeSheetsService(
+        {"2023": ledger(5, 3), "Budget": ledger(8, 2), "Q1": ledger(4, 2)}
+    )
+    assert load_frame(service, "sid", "A1:B3").shape == (2, 2)
+    assert load_frame(service, "sid", "Budget").shape == (8, 2)
+    assert load_frame(service, "sid", "Q1").shape == (4, 2)
+
+
+def test_each_credential_draws_on_its_own_user_bucket(monkeypatch):
+    governor = rate_limit.ApiGovernor({"sheets_read": rate_limit.Quota(0, 600)})
+    monkeypatch.setattr(rate_limit, "_shared_governor", governor)
+    service = FakeSheetsService({"Budget": ledger(8, 2)})
+
+    load_frame(service, "sid", "Budget", user="token.json")
+    load_workbook(service, "sid", user="session:abc")
+
+    def acquired(user):
+        return governor.bucket("sheets_read", None, user).acquired
+
+    assert acquired("token.json") == 2  # tab size, then its rows
+    assert acquired("session:abc") == 2
+    assert acquired(None) == 0
+
+
+def test_workbook_tabs_share_batch_requests():
+    tabs = {f"Tab {i}": ledger(20, 3) for i in range(10)}
+    tabs["Empty"] = []
+    service = FakeSheetsService(tabs)
+
+    info, frames = load_workbook(service, "sid")
+
+    assert info.title == "Fake Workbook"
+    assert [t.title for t in info.tabs][-1] == "Empty"
+    assert list(frames) == [f"Tab {i}" for i in range(10)]
+    assert all(frame.shape == (20, 3) for frame in frames.values())
+    assert frames["Tab 9"]["Col2"].iloc[-1] == "19-2"
+    names = [c[0] for c in service.calls]
+    assert names == ["spreadsheets.get", "values.batchGet"]
+
+
+def test_workbook_long_tab_streams_and_subset_reuses_info():
+    service = FakeSheetsService({"Long": ledger(1000, 2), "Short": ledger(3, 2)})
+    loader = SheetLoader(service, chunk_rows=200, ranges_per_request=2)
+
+    info, frames = loader.load_workbook("sid")
+    assert frames["Long"].shape == (1000, 2)
+    assert frames["Long"]["Col0"].iloc[-1] == "999-0"
+    assert frames["Short"].shape == (3, 2)
+    batch_calls = [c for c in service.calls if c[0] == "values.batchGet"]
+    # 1001 + 4 rows in 400-row calls
+    assert len(batch_calls) == 3
+
+    service.calls.clear()
+    _, frames = loader.load_workbook("sid", ["Short"], info=info)
+    assert list(frames) == ["Short"]
+    assert [c[0] for c in service.calls] == ["values.batchGet"]
+
+
+def typed_ledger(rows):
+    body = [
+        [f"2024-01-{r % 28 + 1:02d}", ["Food", "Rent"][r % 2], f"${r}.50"]
+        for r in range(rows)
+    ]
+    return [["Date", "Category", "Amount"]] + body
+
+
+def test_refresh_fetches_only_appended_rows():
+    sheet = typed_ledger(1000)
+    service = FakeSheetsService({"Ledger": sheet})
+    frame = load_frame(service, "sid")
+
+    sheet.append(["2024-02-01", "Travel", "$99.00"])
+    sheet.append(["2024-02-02", "Food", "$1.00"])
+    service.calls.clear()
+    refreshed, added = refresh_frame(service, "sid", None, frame, overlap=5)
+
+    assert added == 2
+    assert len(refreshed) == 1002
+    assert refreshed["Amount"].iloc[-2] == 99.0
+    assert refreshed["Date"].dtype == frame["Date"].dtype
+    assert list(refreshed["Category"].cat.categories) == ["Food", "Rent", "Travel"]
+    ranges = [
+        r for c in service.calls if c[0] == "values.batchGet" for r in c[1]["ranges"]
+    ]
+    # The header, then the last 5 known rows onwards
+    assert ranges == ["'Ledger'!A1:C1", "'Ledger'!A997:C1003"]
+    pd.testing.assert_frame_equal(
+        refreshed, load_frame(service, "sid"), check_categorical=False
+    )
+
+
+def test_refresh_reloads_when_history_changed():
+    sheet = typed_ledger(50)
+    service = FakeSheetsService({"Ledger": sheet})
+    frame = load_frame(service, "sid")
+
+    refreshed, added = refresh_frame(service, "sid", None, frame)
+    assert added == 0 and refreshed is frame
+
+    sheet[-1][2] = "$7.00"  # an edit inside the rows read again
+    sheet.append(["2024-02-01", "Food", "$1.00"])
+    refreshed, added = refresh_frame(service, "sid", None, frame, overlap=5)
+    assert added is None
+    assert refreshed["Amount"].iloc[-2] == 7.0
+
+    sheet.append(["not a date", "Food", "$1.00"])
+    refreshed, added = refresh_frame(service, "sid", None, refreshed, overlap=5)
+    assert added is None and len(refreshed) == 52
@@ -0,0 +1,123 @@
+"""
+Tests for the diff-based sheet write pipeline
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.sheet_writer import (
+    SheetAction,
+    apply_plan,
+    parse_actions,
+    parse_bounds,
+    plan_writes,
+)
+from tests.fakes import FakeSheetsService
+
+GRID = [
+    ["Date", "Payee", "Amount"],
+    ["2024-01-01", "rent", "1,200"],
+    ["2024-01-02", "groceries", "85.5"],
+    ["2024-01-03", "Utilities", "60"],
+]
+
+
+def test_parse_actions_handles_multiline_data_and_markdown():
+    text = """Here is the cleanup.
+
+**ACTION:** WRITE
+**RANGE:** B2:B3
+DATA: [
+  ["Rent"],
+  ["Groceries"]
+]
+EXPLANATION: Capitalize payees
+so they group together.
+
+ACTION: CLEAR
+RANGE: D1:D4
+EXPLANATION: Remove the empty helper column
+"""
+    actions = parse_actions(text)
+    assert [a.action for a in actions] == ["WRITE", "CLEAR"]
+    assert actions[0].range == "B2:B3"
+    assert actions[0].data == [["Rent"], ["Groceries"]]
+    assert actions[0].explanation == "Capitalize payees so they group together."
+    assert actions[1].data == []
+
+
+def test_parse_actions_rejects_bad_data():
+    with pytest.raises(ValueError):
+        parse_actions("ACTION: WRITE\nRANGE: A1\nDATA: [[oops")
+
+
+def test_parse_bounds():
+    assert parse_bounds("B7") == (7, 2, 7, 2)
+    assert parse_bounds("A2:C") == (2, 1, None, 3)
+    assert parse_bounds("AA10:AB12") == (10, 27, 12, 28)
+
+
+def test_only_changed_cells_are_written():
+    actions = [
+        SheetAction(
+            "WRITE", "B2:C4", [["Rent", 1200], ["Groceries", 85.5], ["Utilities", 60]]
+        )
+    ]
+    plan = plan_writes(actions, GRID, "A1:C4")
+    assert [c.a1 for c in plan.changes] == ["B2", "B3"]
+    assert plan.unchanged == 4
+    assert plan.data == {
+        "RAW": [
+            {
+                "range": "B2:B3",
+                "majorDimension": "ROWS",
+                "values": [["Rent"], ["Groceries"]],
+            }
+        ]
+    }
+
+
+def test_later_actions_override_earlier_ones():
+    actions = [
+        SheetAction("CLEAR", "C2:C4"),
+        SheetAction("FORMULA", "C4", [["=SUM(C2:C3)"]]),
+    ]
+    plan = plan_writes(actions, GRID, "A1:C4")
+    assert plan.data["RAW"] == [
+        {"range": "C2:C3", "majorDimension": "ROWS", "values": [[""], [""]]}
+    ]
+    assert plan.data["USER_ENTERED"][0]["range"] == "C4"
+
+
+def test_cells_outside_the_cached_grid_are_always_written():
+    plan = plan_writes([SheetAction("WRITE", "Other!A1", [["x"]])], GRID, "A1:C4")
+    assert plan.changes[0].before is None
+    assert plan.data["RAW"][0]["range"] == "'Other'!A1"
+
+
+def test_data_must_fit_range():
+    with pytest.raises(ValueError):
+        plan_writes([SheetAction("WRITE", "A1:A1", [["a", "b"]])], GRID, "A1:C4")
+
+
+def test_large_cleanup_is_one_batch_update():
+    rows = [["Amount"]] + [[f"{i:,}"] for i in range(3000)]
+    service = FakeSheetsService({"Ledger": [list(r) for r in rows]})
+    actions = [SheetAction("WRITE", "A2:A3001", [[i] for i in range(3000)])]
+    actions += [SheetAction("CLEAR", "B1:B3001")]
+    plan = plan_writes(actions, rows, "Ledger!A1:B3001")
+    assert plan.empty  # numbers already there; column B already empty
+
+    actions = [
+        SheetAction("WRITE", "Ledger!A2:A3001", [[str(-i)] for i in range(3000)])
+    ]
+    plan = plan_writes(actions, rows, "Ledger!A1:B3001")
+    assert len(plan.changes) == 2999  # the first row already holds 0
+    result = apply_plan(service, "sheet", plan)
+    assert result == {"requests": 1, "updated_cells": 2999}
+    assert [name for name, _ in service.calls] == ["values.batchUpdate"]
+    assert service.tabs["Ledger"][5] == ["-4"]
@@ -0,0 +1,124 @@
+"""
+Tests for the memory-mapped sheet snapshot store
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pyarrow")
+
+from holysheet.config import Settings
+from holysheet.sheet_cache import SheetCache
+from holysheet.snapshots import SnapshotStore
+
+
+def typed_frame(rows=100):
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range("2020-01-01", periods=rows, freq="D"),
+            "Category": pd.Categorical(["Food", "Rent"] * (rows // 2)),
+            "Vendor": pd.array([f"Vendor {i}" for i in range(rows)], dtype="string"),
+            "Amount": [i * 1.5 for i in range(rows)],
+        }
+    )
+
+
+def test_snapshot_round_trip_maps_columns_without_copying(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    frame = typed_frame()
+
+    assert store.save("sheet-1", "Ledger", "7", frame)
+    loaded = store.load("sheet-1", "Ledger", "7")
+
+    pd.testing.assert_frame_equal(loaded, frame, check_dtype=False)
+    assert isinstance(loaded["Category"].dtype, pd.CategoricalDtype)
+    # Backed by the read-only mapping rather than a private copy
+    assert not loaded["Amount"].to_numpy().flags.writeable
+    assert store.load("sheet-1", "Ledger", "8") is None
+    assert store.load("sheet-1", "Budget", "7") is None
+
+
+def test_new_revision_replaces_old_and_budget_prunes(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    store.save("sheet-1", "Ledger", "7", typed_frame())
+    store.save("sheet-1", "Ledger", "8", typed_frame())
+
+    assert store.stats()["files"] == 1
+    assert store.load("sheet-1", "Ledger", "7") is None
+
+    store.max_bytes = store.stats()["bytes"] + 1
+    store.save("sheet-2", "Ledger", "1", typed_frame())
+    assert store.stats()["files"] == 1
+    assert store.load("sheet-2", "Ledger", "1") is not None
+
+    mixed = pd.DataFrame({"Value": ["a", 1]})
+    assert not store.save("sheet-3", "Ledger", "1", mixed)
+
+
+def test_cache_restart_reads_snapshot_instead_of_loader(tmp_path):
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return typed_frame()
+
+    def lookup(sheet_id):
+        return "42"
+
+    first = SheetCache(snapshots=SnapshotStore(str(tmp_path)))
+    first.get_or_load("sheet-1", "Ledger", loader, lookup)
+
+    # A fresh process: empty memory, same directory
+    second = SheetCache(snapshots=SnapshotStore(str(tmp_path)))
+    frame = second.get_or_load("sheet-1", "Ledger", loader, lookup)
+    assert len(loads) == 1
+    assert len(frame) == 100
+    assert second.stats()["snapshots"]["hits"] == 1
+
+    # Without a known revision a snapshot can't be trusted
+    third = SheetCache(snapshots=SnapshotStore(str(tmp_path)))
+    third.get_or_load("sheet-1", "Ledger", loader)
+    assert len(loads) == 2
+
+    many = SheetCache(snapshots=SnapshotStore(str(tmp_path)))
+    frames = many.get_or_load_many(
+        "sheet-1", ["Ledger", "Budget"], lambda missing: {"Budget": None}, lookup
+    )
+    assert list(frames) == ["Ledger"]
+
+    many.invalidate("sheet-1")
+    assert many.snapshots.stats()["files"] == 0
+
+
+def test_refresh_after_restart_starts_from_older_snapshot(tmp_path):
+    revision = {"sheet-1": "1"}
+    first = SheetCache(snapshots=SnapshotStore(str(tmp_path)))
+    first.get_or_refresh("sheet-1", "Ledger", typed_frame, None, revision.get)
+
+    revision["sheet-1"] = "2"
+    bases = []
+
+    def refresher(old):
+        bases.append(len(old))
+        return pd.concat([old, typed_frame(2)], ignore_index=True)
+
+    second = SheetCache(snapshots=SnapshotStore(str(tmp_path)))
+    frame = second.get_or_refresh("sheet-1", "Ledger", None, refresher, revision.get)
+
+    assert bases == [100]
+    assert len(frame) == 102
+    assert second.snapshots.load("sheet-1", "Ledger", "2") is not None
+
+
+def test_empty_snapshot_dir_in_environment_disables_store(monkeypatch):
+    monkeypatch.setenv("HOLYSHEET_SHEET_SNAPSHOT_DIR", "")
+    monkeypatch.setenv("HOLYSHEET_SHEET_SNAPSHOT_MAX_MB", "")
+    settings = Settings.from_env()
+    assert settings.sheet_snapshot_dir == ""
+    assert settings.sheet_snapshot_max_mb == 2048
+    assert SnapshotStore.from_settings(settings) is None
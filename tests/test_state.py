@@ -0,0 +1,72 @@
+"""
+Tests for the shared state backends
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from holysheet.config import Settings
+from holysheet.state import (
+    MemoryStateBackend,
+    SQLiteStateBackend,
+    state_backend_from_settings,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend_and_clock(request, tmp_path):
+    clock = FakeClock()
+    if request.param == "memory":
+        return MemoryStateBackend(clock=clock), clock
+    return SQLiteStateBackend(str(tmp_path / "state.sqlite"), clock=clock), clock
+
+
+def test_roundtrip_and_namespaces(backend_and_clock):
+    backend, _ = backend_and_clock
+    backend.set("session", "a", b"one")
+    backend.set("sheet", "a", b"two")
+    assert backend.get("session", "a") == b"one"
+    assert backend.get("sheet", "a") == b"two"
+    backend.delete("session", "a")
+    assert backend.get("session", "a") is None
+    assert backend.get("sheet", "a") == b"two"
+
+
+def test_entries_expire(backend_and_clock):
+    backend, clock = backend_and_clock
+    backend.set("session", "short", b"x", ttl=10)
+    backend.set("session", "forever", b"y")
+    clock.now += 5
+    assert backend.get("session", "short") == b"x"
+    clock.now += 10
+    assert backend.get("session", "short") is None
+    backend.set("session", "other", b"z", ttl=1)
+    clock.now += 2
+    assert backend.purge_expired() == 1
+    assert backend.get("session", "forever") == b"y"
+
+
+def test_sqlite_backend_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    SQLiteStateBackend(path).set("session", "s", b"data")
+    assert SQLiteStateBackend(path).get("session", "s") == b"data"
+
+
+def test_backend_from_settings(tmp_path):
+    settings = Settings(state_backend="sqlite", state_path=str(tmp_path / "s.db"))
+    assert state_backend_from_settings(settings).shared
+    assert not state_backend_from_settings(Settings()).shared
+    with pytest.raises(ValueError):
+        state_backend_from_settings(Settings(state_backend="redis"))